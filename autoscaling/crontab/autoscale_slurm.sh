@@ -8,6 +8,10 @@ import json
 import copy
 import yaml
 import re
+import argparse
+import asyncio
+import fcntl
+import signal
 
 lockfile = "/tmp/autoscaling_lock"
 queues_conf_file = "/opt/oci-hpc/conf/queues.conf"
@@ -27,61 +31,229 @@ def israckaware():
                 break
     return rackware
 
-def getTopology(clusterName):
-    out = subprocess.Popen(['scontrol','show','topology',clusterName], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-    stdout,stderr = out.communicate()
-    for item in stdout.strip().split():
-        if item.startswith("Nodes="):
-            nodes_condensed=item.split("Nodes=")[1]
-            out2 = subprocess.Popen(['scontrol','show','hostname',nodes_condensed], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-            stdout2,stderr2 = out2.communicate()    
-            print(stdout2.strip().split())
-            return stdout2.strip().split()
-    return []
+def expandHostlist(hostlist):
+    # Pure python equivalent of "scontrol show hostname", avoids one fork per hostlist
+    hosts=[]
+    depth=0
+    current=''
+    for char in hostlist.strip():
+        if char == ',' and depth == 0:
+            if current:
+                hosts.extend(expandHostname(current))
+            current=''
+            continue
+        if char == '[':
+            depth+=1
+        elif char == ']':
+            depth-=1
+        current+=char
+    if current:
+        hosts.extend(expandHostname(current))
+    return hosts
+
+def expandHostname(hostname):
+    if not '[' in hostname:
+        return [hostname]
+    prefix,rest=hostname.split('[',1)
+    ranges,suffix=rest.split(']',1)
+    hosts=[]
+    for item in ranges.split(','):
+        if '-' in item:
+            first,last=item.split('-',1)
+            for index in range(int(first),int(last)+1):
+                hosts.append(prefix+str(index).zfill(len(first)))
+        else:
+            hosts.append(prefix+item)
+    expanded=[]
+    for host in hosts:
+        expanded.extend(expandHostname(host+suffix))
+    return expanded
+
+def getJsonValue(value):
+    # Newer Slurm versions wrap numbers as {"set":true,"infinite":false,"number":X}
+    if isinstance(value,dict):
+        if not value.get("set",True) or value.get("infinite",False):
+            return None
+        return value.get("number")
+    return value
+
+def getJsonList(value):
+    if value is None:
+        return []
+    if isinstance(value,list):
+        return value
+    return [i for i in str(value).split(',') if i != '']
+
+def getNodeState(node_json):
+    # Rebuild the state string returned by sinfo %T (idle, idle*, idle~, allocated, mixed, drained, ...)
+    states=[i.upper() for i in getJsonList(node_json.get("state"))]
+    flags=states[1:]+[i.upper() for i in getJsonList(node_json.get("state_flags"))]
+    state=states[0].lower() if len(states) else "unknown"
+    if "DRAIN" in flags:
+        if state in ["idle","down"]:
+            state="drained"
+        else:
+            state="draining"
+    elif "FAIL" in flags:
+        if state in ["allocated","mixed"]:
+            state="failing"
+        else:
+            state="fail"
+    elif "MAINT" in flags:
+        state="maint"
+    elif "COMPLETING" in flags:
+        state="completing"
+    # sinfo shows a single suffix, the first flag of this list that is set
+    for flag,suffix in [("NOT_RESPONDING","*"),("POWERED_DOWN","~"),("POWERING_UP","#"),("POWERING_DOWN","%"),("POWER_DOWN","!"),("REBOOT_REQUESTED","@"),("REBOOT_ISSUED","^"),("PLANNED","-")]:
+        if flag in flags:
+            state=state+suffix
+            break
+    return state
+
 # Get the list of Jobs in all states
 def getJobs():
     # changing the position of Dependency as it is giving blank instead of null. to handle that, putting it at the end.
+    # squeue -r expands job arrays, which the JSON output does not, so this call stays in text mode. It is a single call per tick.
     out = subprocess.Popen(['squeue','-r','-O','STATE,JOBID,FEATURE:100,NUMNODES,Partition,UserName,Dependency'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
     stdout,stderr = out.communicate()
     return stdout.split("\n")[1:]
 
-def getClusters():
-    out = subprocess.Popen(['sinfo','-hN','-o','\"%T %E %D %N\"'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-    stdout,stderr = out.communicate()
-    return stdout.split("\n")
-
-def getNodeDetails(node):
-    out = subprocess.Popen(['sinfo','-h','-n',node,'-o','"%f %R"'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-    stdout,stderr = out.communicate()
-    for pot_output in stdout.split("\n"):
-        if not "(null)" in pot_output and pot_output.strip() != '':
-            output=pot_output
-            if output[0] == '"':
-                output=output[1:]
-            if output[-1] == '"':
-                output=output[:-1]
-        else:
-            continue
-    return output
-
-def getIdleTime(node):
-    out = subprocess.Popen(["sacct -X -n -S 01/01/01 -N "+node+" -o End | tail -n 1"],stdout=subprocess.PIPE,stderr=subprocess.STDOUT,shell=True,universal_newlines=True)
+def getNodesJson():
+    out = subprocess.Popen(['scontrol','show','nodes','--json'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
     stdout,stderr = out.communicate()
-    last_end_time = None
     try:
-        last_end_time = datetime.datetime.strptime(stdout.strip(),"%Y-%m-%dT%H:%M:%S")
+        return json.loads(stdout)["nodes"]
     except:
-        pass
-    out = subprocess.Popen(["scontrol show node "+node+" | grep SlurmdStartTime | awk '{print $2}'"],stdout=subprocess.PIPE, stderr=subprocess.STDOUT,shell=True,universal_newlines=True)
+        print("The node list could not be retrieved from scontrol show nodes --json")
+        print(stderr)
+        return None
+
+def getLastJobEndTimes(since):
+    # One sacct call for every node instead of one per node
+    last_end_times={}
+    out = subprocess.Popen(['sacct','-X','-n','-a','-P','-S',since.strftime("%Y-%m-%dT%H:%M:%S"),'-o','NodeList%1000,End'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
     stdout,stderr = out.communicate()
-    try: 
-        cluster_start_time=datetime.datetime.strptime(stdout.split("\n")[0].split("=")[1],"%Y-%m-%dT%H:%M:%S")
-    except:
+    for line in stdout.split("\n"):
+        if len(line.split("|")) != 2:
+            continue
+        nodelist,end=line.split("|")
+        try:
+            end_time = datetime.datetime.strptime(end.strip(),"%Y-%m-%dT%H:%M:%S")
+        except:
+            continue
+        if nodelist.strip() in ["","None assigned"]:
+            continue
+        for node in expandHostlist(nodelist):
+            if not node in last_end_times.keys() or last_end_times[node] < end_time:
+                last_end_times[node]=end_time
+    return last_end_times
+
+def getTopologySwitches():
+    # Parse the full topology once, in the order scontrol prints it
+    out = subprocess.Popen(['scontrol','show','topology'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    stdout,stderr = out.communicate()
+    switches=[]
+    for line in stdout.split("\n"):
+        if not line.strip().startswith("SwitchName="):
+            continue
+        switch={"name":None,"nodes":[],"has_switches":False,"switches":[]}
+        for item in line.strip().split():
+            if item.startswith("SwitchName="):
+                switch["name"]=item.split("SwitchName=")[1]
+            elif item.startswith("Nodes="):
+                switch["nodes"]=expandHostlist(item.split("Nodes=")[1])
+            elif item.startswith("Switches="):
+                switch["has_switches"]=True
+                switch["switches"]=expandHostlist(item.split("Switches=")[1])
+        switches.append(switch)
+    return switches
+
+def getSwitchesPerNode(switches):
+    # Switches that "scontrol show topology <node>" prints for each node: its leaf switches and all their parents, in the topology order
+    parents={}
+    for switch in switches:
+        for child in switch["switches"]:
+            parents.setdefault(child,[]).append(switch["name"])
+    names_per_node={}
+    for switch in switches:
+        for node in switch["nodes"]:
+            names=names_per_node.setdefault(node,set())
+            todo=[switch["name"]]
+            while todo:
+                name=todo.pop()
+                if not name in names:
+                    names.add(name)
+                    todo.extend(parents.get(name,[]))
+    switches_per_node={}
+    for switch in switches:
+        for node,names in names_per_node.items():
+            if switch["name"] in names:
+                switches_per_node.setdefault(node,[]).append(switch)
+    return switches_per_node
+
+def getTopologyClusterName(switches):
+    # Same selection as parsing "scontrol show topology <node>" for a single node
+    clusterName=None
+    if len(switches) > 1:
+        for switch in switches:
+            if switch["has_switches"]:
+                clusterName=switch["name"]
+                break
+            elif switch["name"].startswith("inactive-"):
+                continue
+            else:
+                clusterName=switch["name"]
+    elif len(switches) == 1:
+        clusterName=switches[0]["name"]
+    if clusterName is None or clusterName.startswith("inactive-"):
+        return "NOCLUSTERFOUND"
+    return clusterName
+
+def getSlurmSnapshot(jobs=None):
+    # Take a single snapshot of the Slurm state for this tick and index it, so that every decision is a dictionary lookup
+    if jobs is None:
+        jobs=getJobs()
+    snapshot={"jobs":jobs,"nodes":{},"topology":{},"last_job_end":{}}
+    nodes_json=getNodesJson()
+    if nodes_json is None:
+        return None
+    switches=getTopologySwitches()
+    switches_per_node=getSwitchesPerNode(switches)
+    for switch in switches:
+        snapshot["topology"][switch["name"]]=switch["nodes"]
+    # Parent switches listed without their nodes get the nodes of their children
+    for node,node_switches in switches_per_node.items():
+        for switch in node_switches:
+            if switch["has_switches"] and not node in snapshot["topology"][switch["name"]]:
+                snapshot["topology"][switch["name"]]=snapshot["topology"][switch["name"]]+[node]
+    snapshot["last_job_end"]=getLastJobEndTimes(datetime.datetime.now()-datetime.timedelta(days=1))
+    for node_json in nodes_json:
+        name=node_json["name"]
+        features=[i for i in getJsonList(node_json.get("features")) if i != "(null)"]
+        partitions=getJsonList(node_json.get("partitions"))
+        clusterName="NOCLUSTERFOUND"
+        for feature in features:
+            if feature.startswith('CN__'):
+                clusterName=feature[4:]
+        if clusterName == "NOCLUSTERFOUND":
+            clusterName=getTopologyClusterName(switches_per_node.get(name,[]))
+        slurmd_start_time=getJsonValue(node_json.get("slurmd_start_time"))
+        if slurmd_start_time:
+            slurmd_start_time=datetime.datetime.fromtimestamp(slurmd_start_time)
+        else:
+            slurmd_start_time=None
+        snapshot["nodes"][name]={"state":getNodeState(node_json),"features":features,"partition":partitions[-1] if len(partitions) else None,"cluster":clusterName,"slurmd_start_time":slurmd_start_time}
+    return snapshot
+
+def getTopology(snapshot,clusterName):
+    return snapshot["topology"].get(clusterName,[])
+
+def getIdleTime(snapshot,node):
+    last_end_time = snapshot["last_job_end"].get(node)
+    cluster_start_time = snapshot["nodes"][node]["slurmd_start_time"]
+    if cluster_start_time is None:
         print ("The cluster start time of node "+node+" could not be found")
-        print ("There seems to be an issue with the command")
-        print ("scontrol show node "+node+" | grep SlurmdStartTime | awk '{print $2}'")
-        print ("Here is the output it generated")
-        print (stdout)
+        print ("There seems to be an issue with the SlurmdStartTime reported by scontrol show nodes --json")
         print ("The node will be deleted")
         cluster_start_time=datetime.datetime.now()-datetime.timedelta(hours=24)
     if last_end_time is None:
@@ -90,6 +262,9 @@ def getIdleTime(node):
         right_time=max([cluster_start_time,last_end_time])
     return ( datetime.datetime.now() - right_time ).total_seconds()
 
+def getClusterName(snapshot,node):
+    return snapshot["nodes"][node]["cluster"]
+
 # Get the last time a node state was changed. This is used to get how long a cluster has been idle for
 def getQueueConf(queue_file):
     with open(queue_file) as file:
@@ -160,42 +335,12 @@ def getAllClusterNames(config):
             availableNames[partition["name"]][instance_type["name"]]=range(1,int(instance_type["max_cluster_count"])+1)
     return availableNames
 
-def getClusterName(node):
-    details=getNodeDetails(node)
-    clusterName="NOCLUSTERFOUND"
-    for feature in details[0].split(","):
-        if feature.startswith('CN__'):
-            clusterName=feature[4:]
-    if clusterName == "NOCLUSTERFOUND":
-        out = subprocess.Popen(['scontrol','show','topology',node], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-        stdout,stderr = out.communicate()
-        clusterName = None
-        try:
-            if len(stdout.split('\n')) > 2:
-                for output in stdout.split('\n')[:-1]:
-                    if "Switches=" in output:
-                        clusterName=output.split()[0].split('SwitchName=')[1]
-                        break
-                    elif "SwitchName=inactive-" in output:
-                        continue
-                    else:
-                        clusterName=output.split()[0].split('SwitchName=')[1]
-            elif len(stdout.split('\n')) == 2:
-                clusterName=stdout.split('\n')[0].split()[0].split('SwitchName=')[1]
-            if clusterName.startswith("inactive-"):
-                return "NOCLUSTERFOUND"
-        except: 
-            print('No ClusterName could be found for '+node)
-            print('There seems to be some issues in the slurm topology file')
-            return "NOCLUSTERFOUND"
-    return clusterName
-
-def getstatus_slurm():
+def getstatus_slurm(snapshot,daemon_state=None):
     cluster_to_build=[]
 
     # Get cluster to build
     # squeue -O STATE,JOBID,FEATURE:100,NUMNODES,Partition,UserName,Dependency
-    for line in getJobs():
+    for line in snapshot["jobs"]:
         if len(line.split())>3:
             new_line=re.split(r"\s{1,}", line)
             if new_line[0] == 'PENDING' and ('null' in new_line[6] or len(new_line[6])==0):
@@ -228,63 +373,41 @@ def getstatus_slurm():
     nodes_to_destroy_temp={}
     nodes_to_destroy={}
     # Get Cluster to destroy, or nodes to destroy
-    for line in getClusters():
-        if len(line.split()) == 0:
-            break
-        old_nodes=line.split()[-1].split(',')
-        brokenListOfNodes=False
-        nodes=[]
-        for node in old_nodes:
-            if brokenListOfNodes:
-                if ']' in node:
-                    brokenListOfNodes=False
-                    nodes.append(currentNode+','+node)
-                else:
-                    currentNode=currentNode+','+node
-            elif '[' in node and not ']' in node:
-                brokenListOfNodes=True
-                currentNode=node
+    for node in snapshot["nodes"].keys():
+        node_details=snapshot["nodes"][node]
+        state=node_details["state"]
+        features=node_details["features"]
+        queue=node_details["partition"]
+        clustername=getClusterName(snapshot,node)
+        if clustername is None or queue is None:
+            continue
+        instanceType=features[0] if len(features) else ''
+        if queue in current_nodes.keys():
+            if instanceType in current_nodes[queue].keys():
+                current_nodes[queue][instanceType]+=1
             else:
-                nodes.append(node)
-        clusters = []
-        for node in nodes:
-            if node[-1]=="\"":
-                node=node[:-1]
-            if node[0]=="\"":
-                node=node[1:]
-            details=getNodeDetails(node).split(' ')
-            features=details[0].split(',')
-            queue=details[-1]
-            clustername=getClusterName(node)
-            if clustername is None:
+                current_nodes[queue][instanceType]=1
+        else:
+            current_nodes[queue]={instanceType:1}
+        if state == 'idle' or state == 'down' or state.endswith('*'):
+            if not state.endswith('*') and clustername == "NOCLUSTERFOUND":
                 continue
-            instanceType=features[0]
-            if queue in current_nodes.keys():
-                if instanceType in current_nodes[queue].keys():
-                    current_nodes[queue][instanceType]+=1
-                else:
-                    current_nodes[queue][instanceType]=1
-            else:
-                current_nodes[queue]={instanceType:1}
-            if line.split()[0] == '\"idle' or line.split()[0] == '\"down' or line.split()[0].endswith('*'):
-                if not line.split()[0].endswith('*') and clustername == "NOCLUSTERFOUND": 
-                    continue
-                if not os.path.isdir(os.path.join(clusters_path,clustername)) and clustername != "NOCLUSTERFOUND":
-                    continue
-                node_idle_time=getIdleTime(node)
-                if node_idle_time<idle_time:
-                    print (clustername + " is too young to die : "+str(node_idle_time) + " : "+node)
-                    continue
-                if isPermanent(config,queue,instanceType) is None :
-                    continue
-                elif isPermanent(config,queue,instanceType):
-                    continue
-                if not clustername in nodes_to_destroy_temp.keys():
-                    nodes_to_destroy_temp[clustername]=[]
-                nodes_to_destroy_temp[clustername].append(node)
-            elif line.split()[0] == '\"allocated' or line.split()[0] == '\"mixed':
-                if not clustername in running_cluster:
-                    running_cluster.append(clustername)
+            if not os.path.isdir(os.path.join(clusters_path,clustername)) and clustername != "NOCLUSTERFOUND":
+                continue
+            node_idle_time=getIdleTime(snapshot,node)
+            if node_idle_time<idle_time:
+                print (clustername + " is too young to die : "+str(node_idle_time) + " : "+node)
+                continue
+            if isPermanent(config,queue,instanceType) is None :
+                continue
+            elif isPermanent(config,queue,instanceType):
+                continue
+            if not clustername in nodes_to_destroy_temp.keys():
+                nodes_to_destroy_temp[clustername]=[]
+            nodes_to_destroy_temp[clustername].append(node)
+        elif state == 'allocated' or state == 'mixed':
+            if not clustername in running_cluster:
+                running_cluster.append(clustername)
     cluster_to_destroy=[]
     for clustername in nodes_to_destroy_temp.keys():
         destroyEntireCluster=True
@@ -294,7 +417,7 @@ def getstatus_slurm():
             nodes_to_destroy[clustername]=nodes_to_destroy_temp[clustername]
             destroyEntireCluster=False
         else:
-            for node in getTopology(clustername):
+            for node in getTopology(snapshot,clustername):
                 if not node in nodes_to_destroy_temp[clustername]:
                     nodes_to_destroy[clustername]=nodes_to_destroy_temp[clustername]
                     destroyEntireCluster=False
@@ -340,6 +463,31 @@ def getstatus_slurm():
                     continue
         if os.path.isfile(os.path.join(clusters_path,clusterName,'currently_destroying')):
             cluster_destroying.append(clusterName)
+
+    # Clusters launched by the daemon may not have written their state files yet
+    if not daemon_state is None:
+        for clusterName in daemon_state["building"].keys():
+            if os.path.isfile(os.path.join(clusters_path,clusterName,'currently_building')):
+                continue
+            nodes,instance_type,queue=daemon_state["building"][clusterName]
+            clusterNumber=int(clusterName.split('-')[1])
+            if not queue in used_index.keys():
+                used_index[queue]={}
+            if not instance_type in used_index[queue].keys():
+                used_index[queue][instance_type]=[]
+            if not clusterNumber in used_index[queue][instance_type]:
+                used_index[queue][instance_type].append(clusterNumber)
+            cluster_building.append([nodes,instance_type,queue])
+            if queue in building_nodes.keys():
+                if instance_type in building_nodes[queue].keys():
+                    building_nodes[queue][instance_type]+=nodes
+                else:
+                    building_nodes[queue][instance_type]=nodes
+            else:
+                building_nodes[queue]={instance_type:nodes}
+        for clusterName in daemon_state["destroying"]:
+            if not clusterName in cluster_destroying:
+                cluster_destroying.append(clusterName)
     return cluster_to_build,cluster_to_destroy,nodes_to_destroy,cluster_building,cluster_destroying,used_index,current_nodes,building_nodes
 
 def getAutoscaling():
@@ -351,116 +499,266 @@ def getAutoscaling():
         autoscaling_value=output[i]
     return autoscaling_value
 
+def getLock(lockfile):
+    # flock is released by the kernel when the process exits, a crashed run cannot leave a stale lock behind
+    lock=open(lockfile,'w')
+    try:
+        fcntl.flock(lock,fcntl.LOCK_EX|fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+def getScalingActions(snapshot,daemon_state=None):
+    actions=[]
+    cluster_to_build,cluster_to_destroy,nodes_to_destroy,cluster_building,cluster_destroying,used_index,current_nodes,building_nodes=getstatus_slurm(snapshot,daemon_state)
+
+    print (time.strftime("%Y-%m-%d %H:%M:%S"))
+    print (cluster_to_build,'cluster_to_build')
+    print (cluster_to_destroy,'cluster_to_destroy')
+    print (nodes_to_destroy,'nodes_to_destroy')
+    print (cluster_building,'cluster_building')
+    print (cluster_destroying,'cluster_destroying')
+    print (current_nodes,'current_nodes')
+    print (building_nodes,'building_nodes')
+
+    for i in cluster_building:
+        for j in cluster_to_build:
+            if i[0]==j[0] and i[1]==j[1] and i[2]==j[2]:
+                cluster_to_build.remove(j)
+                break
+    for cluster in cluster_to_destroy:
+        cluster_name=cluster[0]
+        actions.append({"type":"delete","cluster_name":cluster_name,"message":"Deleting cluster "+cluster_name,"command":[script_path+'/delete_cluster.sh',cluster_name],"wait":5})
+
+    for cluster_name in nodes_to_destroy.keys():
+        initial_nodes=[]
+        unreachable_nodes=[]
+        if cluster_name == "NOCLUSTERFOUND":
+            actions.append({"type":"resize","cluster_name":cluster_name,"message":"Resizing cluster "+cluster_name,"command":[script_path+'/resize.sh','remove_unreachable','--quiet','--nodes']+nodes_to_destroy[cluster_name],"wait":1})
+            continue
+        for node in nodes_to_destroy[cluster_name]:
+            try:
+                alt_names=subprocess.check_output(["cat /etc/hosts | grep "+node],shell=True,universal_newlines=True)
+                for alt_name in alt_names.split("\n")[0].split():
+                    if alt_name.startswith('inst-'):
+                        initial_nodes.append(alt_name)
+                        break
+            except:
+                unreachable_nodes.append(node)
+        if len(initial_nodes) > 0:
+            actions.append({"type":"resize","cluster_name":cluster_name,"message":"Resizing cluster "+cluster_name,"command":[script_path+'/resize.sh','--force','--cluster_name',cluster_name,'remove','--remove_unreachable','--quiet','--nodes']+initial_nodes,"wait":1})
+        if len(unreachable_nodes) > 0:
+            actions.append({"type":"resize","cluster_name":cluster_name,"message":"Resizing cluster "+cluster_name,"command":[script_path+'/resize.sh','--cluster_name',cluster_name,'remove_unreachable','--quiet','--nodes']+unreachable_nodes,"wait":1})
+
+    for index,cluster in enumerate(cluster_to_build):
+        nodes=cluster[0]
+        instance_type = cluster[1]
+        queue=cluster[2]
+        jobID=str(cluster[3])
+        user=str(cluster[4])
+        jobconfig=getJobConfig(config,queue,instance_type)
+        limits=getQueueLimits(config,queue,instance_type)
+        try:
+            clusterCount=len(used_index[queue][instance_type])
+        except:
+            clusterCount=0
+        if clusterCount>=limits["max_cluster_count"]:
+            print ("This would go over the number of running clusters, you have reached the max number of clusters")
+            continue
+        nextIndex=None
+        if clusterCount==0:
+            if queue in used_index.keys():
+                used_index[queue][instance_type]=[1]
+            else:
+                used_index[queue]={instance_type:[1]}
+            nextIndex=1
+        else:
+            for i in range(1,10000):
+                if not i in used_index[queue][instance_type]:
+                    nextIndex=i
+                    used_index[queue][instance_type].append(i)
+                    break
+        clusterName=queue+'-'+str(nextIndex)+'-'+jobconfig["hostname_convention"]
+        if not queue in current_nodes.keys():
+            current_nodes[queue]={instance_type:0}
+        else:
+            if not instance_type in current_nodes[queue].keys():
+                current_nodes[queue][instance_type]=0
+        if not queue in building_nodes.keys():
+            building_nodes[queue]={instance_type:0}
+        else:
+            if not instance_type in building_nodes[queue].keys():
+                building_nodes[queue][instance_type]=0
+        if nodes > limits["max_cluster_size"]:
+            print ("Cluster "+clusterName+" won't be created, it would go over the total number of nodes per cluster limit")
+        elif current_nodes[queue][instance_type] + building_nodes[queue][instance_type] + nodes > limits["max_number_nodes"]:
+            print ("Cluster "+clusterName+" won't be created, it would go over the total number of nodes limit")
+        else:
+            current_nodes[queue][instance_type]+=nodes
+            clusterCount+=1
+            actions.append({"type":"create","cluster_name":clusterName,"nodes":nodes,"instance_type":instance_type,"queue":queue,"message":"Creating cluster "+clusterName+" with "+str(nodes)+" nodes","command":[script_path+'/create_cluster.sh',str(nodes),clusterName,instance_type,queue,jobID,user],"wait":5})
+    return actions
+
+def getActionKey(action):
+    return action["type"]+":"+action["cluster_name"]+":"+" ".join(action["command"][1:])
+
+class AutoscalingDaemon:
+    def __init__(self,poll_interval,tick_interval,max_retries,retry_delay):
+        self.poll_interval=poll_interval
+        self.tick_interval=tick_interval
+        self.max_retries=max_retries
+        self.retry_delay=retry_delay
+        # in memory equivalent of currently_building and currently_destroying for the children of this daemon
+        self.state={"building":{},"destroying":[]}
+        self.children={}
+        self.attempts={}
+        self.history=[]
+        self.pending_signature=None
+        self.last_tick=0
+        self.dirty=True
+        self.stopping=False
+
+    def stop(self):
+        print ("Stopping the autoscaling daemon, running children: "+str(list(self.children.keys())))
+        self.stopping=True
+
+    def getPendingSignature(self,jobs):
+        return sorted([line.strip() for line in jobs if line.strip().startswith('PENDING')])
+
+    async def run(self):
+        loop=asyncio.get_event_loop()
+        while not self.stopping:
+            try:
+                jobs=await loop.run_in_executor(None,getJobs)
+                signature=self.getPendingSignature(jobs)
+                if self.dirty or signature != self.pending_signature or time.time()-self.last_tick >= self.tick_interval:
+                    self.pending_signature=signature
+                    self.dirty=False
+                    self.last_tick=time.time()
+                    await self.tick(jobs)
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(self.poll_interval)
+
+    async def tick(self,jobs):
+        global config
+        loop=asyncio.get_event_loop()
+        autoscaling=await loop.run_in_executor(None,getAutoscaling)
+        if autoscaling != "true":
+            print("Autoscaling is false (set in /etc/ansible/hosts)")
+            return
+        config=getQueueConf(queues_conf_file)
+        snapshot=await loop.run_in_executor(None,getSlurmSnapshot,jobs)
+        if snapshot is None:
+            print("The Slurm state could not be retrieved, not scaling during this tick")
+            return
+        # launch() and reap() change the state on the loop thread while the worker reads it, give it a copy
+        actions=await loop.run_in_executor(None,getScalingActions,snapshot,copy.deepcopy(self.state))
+        for action in actions:
+            key=getActionKey(action)
+            if key in self.children.keys():
+                continue
+            if action["type"] in ["delete","resize"] and self.isClusterBusy(action["cluster_name"]):
+                continue
+            attempt=self.attempts.get(key,{"count":0,"next_try":0})
+            if attempt["count"] > self.max_retries:
+                continue
+            if time.time() < attempt["next_try"]:
+                continue
+            await self.launch(action,key)
+
+    def isClusterBusy(self,cluster_name):
+        for child in self.children.values():
+            if child["cluster_name"] == cluster_name:
+                return True
+        return False
+
+    async def launch(self,action,key):
+        print (action["message"])
+        try:
+            process=await asyncio.create_subprocess_exec(*action["command"])
+        except Exception:
+            traceback.print_exc()
+            self.recordExit(key,None,time.time(),None)
+            return
+        child={"key":key,"type":action["type"],"cluster_name":action["cluster_name"],"command":action["command"],"pid":process.pid,"start":time.time()}
+        self.children[key]=child
+        if action["type"] == "create":
+            self.state["building"][action["cluster_name"]]=[action["nodes"],action["instance_type"],action["queue"]]
+        elif action["type"] == "delete":
+            self.state["destroying"].append(action["cluster_name"])
+        asyncio.ensure_future(self.reap(child,process))
+        # Keep the same spacing between launches as the cron mode to avoid bursts of API calls
+        await asyncio.sleep(action["wait"])
+
+    async def reap(self,child,process):
+        returncode=await process.wait()
+        del self.children[child["key"]]
+        if child["type"] == "create":
+            self.state["building"].pop(child["cluster_name"],None)
+        elif child["type"] == "delete" and child["cluster_name"] in self.state["destroying"]:
+            self.state["destroying"].remove(child["cluster_name"])
+        self.recordExit(child["key"],child,child["start"],returncode)
+        self.dirty=True
+
+    def recordExit(self,key,child,start,returncode):
+        duration=time.time()-start
+        attempt=self.attempts.get(key,{"count":0,"next_try":0})
+        if returncode == 0:
+            self.attempts.pop(key,None)
+        else:
+            attempt["count"]+=1
+            attempt["next_try"]=time.time()+self.retry_delay*2**(attempt["count"]-1)
+            self.attempts[key]=attempt
+        self.history.append({"key":key,"pid":None if child is None else child["pid"],"returncode":returncode,"duration":duration,"attempts":attempt["count"]})
+        self.history=self.history[-100:]
+        print (time.strftime("%Y-%m-%d %H:%M:%S")+" "+key+" exited with code "+str(returncode)+" after "+str(int(duration))+" seconds (failed attempts: "+str(attempt["count"])+")")
+        if attempt["count"] > self.max_retries:
+            print ("Giving up on "+key+" after "+str(attempt["count"])+" failed attempts")
+
+parser = argparse.ArgumentParser(description='Slurm autoscaling. Runs a single pass by default (cron mode)')
+parser.add_argument('--daemon', help='If present, run as a long running process that reacts to pending jobs within seconds instead of running once',action='store_true',default=False)
+parser.add_argument('--poll_interval', type=float, help='Daemon mode: seconds between two checks of the pending jobs',default=5)
+parser.add_argument('--tick_interval', type=float, help='Daemon mode: maximum number of seconds between two full evaluations of the cluster state',default=60)
+parser.add_argument('--max_retries', type=int, help='Daemon mode: number of times a failed create, delete or resize is retried',default=3)
+parser.add_argument('--retry_delay', type=float, help='Daemon mode: initial delay in seconds before retrying a failed command, doubled at every failure',default=60)
+args = parser.parse_args()
+
+path = os.path.dirname(os.path.dirname(os.path.realpath(sys.argv[0])))
+clusters_path = os.path.join(path,'clusters')
+
+lock = getLock(lockfile)
+if lock is None:
+    print( "Lockfile "+lockfile + " is held by another autoscaling process, exiting" )
+    exit()
+
+if args.daemon:
+    # Line buffered output so that the log follows the daemon in real time
+    sys.stdout = os.fdopen(sys.stdout.fileno(),'w',1)
+    daemon = AutoscalingDaemon(args.poll_interval,args.tick_interval,args.max_retries,args.retry_delay)
+    loop = asyncio.get_event_loop()
+    loop.add_signal_handler(signal.SIGTERM,daemon.stop)
+    loop.add_signal_handler(signal.SIGINT,daemon.stop)
+    loop.run_until_complete(daemon.run())
+    exit()
+
 autoscaling = getAutoscaling()
 
 if autoscaling == "true":
-
-    if os.path.isfile(lockfile):
-        print( "Lockfile "+lockfile + " is present, exiting" )
-        exit()
-    open(lockfile,'w').close()
     try:
-        path = os.path.dirname(os.path.dirname(os.path.realpath(sys.argv[0])))
-        clusters_path = os.path.join(path,'clusters')
         config = getQueueConf(queues_conf_file)
 
-        cluster_to_build,cluster_to_destroy,nodes_to_destroy,cluster_building,cluster_destroying,used_index,current_nodes,building_nodes=getstatus_slurm()
-
-        print (time.strftime("%Y-%m-%d %H:%M:%S"))
-        print (cluster_to_build,'cluster_to_build')
-        print (cluster_to_destroy,'cluster_to_destroy')
-        print (nodes_to_destroy,'nodes_to_destroy')
-        print (cluster_building,'cluster_building')
-        print (cluster_destroying,'cluster_destroying')
-        print (current_nodes,'current_nodes')
-        print (building_nodes,'building_nodes')
-
-        for i in cluster_building:
-            for j in cluster_to_build:
-                if i[0]==j[0] and i[1]==j[1] and i[2]==j[2]:
-                    cluster_to_build.remove(j)
-                    break
-        for cluster in cluster_to_destroy:
-            cluster_name=cluster[0]
-            print ("Deleting cluster "+cluster_name)
-            subprocess.Popen([script_path+'/delete_cluster.sh',cluster_name])
-            time.sleep(5)
-
-        for cluster_name in nodes_to_destroy.keys():
-            print ("Resizing cluster "+cluster_name)
-            initial_nodes=[]
-            unreachable_nodes=[]
-            if cluster_name == "NOCLUSTERFOUND":
-                subprocess.Popen([script_path+'/resize.sh','remove_unreachable','--nodes']+nodes_to_destroy[cluster_name],'--quiet')
-                continue
-            for node in nodes_to_destroy[cluster_name]:
-                try:
-                    alt_names=subprocess.check_output(["cat /etc/hosts | grep "+node],shell=True,universal_newlines=True)
-                    for alt_name in alt_names.split("\n")[0].split():
-                        if alt_name.startswith('inst-'):
-                            initial_nodes.append(alt_name)
-                            break
-                except:
-                    unreachable_nodes.append(node)    
-            if len(initial_nodes) > 0:
-                subprocess.Popen([script_path+'/resize.sh','--force','--cluster_name',cluster_name,'remove','--remove_unreachable','--nodes']+initial_nodes,'--quiet')
-            if len(unreachable_nodes) > 0:
-                subprocess.Popen([script_path+'/resize.sh','--cluster_name',cluster_name,'remove_unreachable','--nodes']+unreachable_nodes,'--quiet')
-            time.sleep(1)
-
-        for index,cluster in enumerate(cluster_to_build):
-            nodes=cluster[0]
-            instance_type = cluster[1]
-            queue=cluster[2]
-            jobID=str(cluster[3])
-            user=str(cluster[4])
-            jobconfig=getJobConfig(config,queue,instance_type)
-            limits=getQueueLimits(config,queue,instance_type)
-            try:
-                clusterCount=len(used_index[queue][instance_type])
-            except:
-                clusterCount=0
-            if clusterCount>=limits["max_cluster_count"]:
-                print ("This would go over the number of running clusters, you have reached the max number of clusters")
-                continue
-            nextIndex=None
-            if clusterCount==0:
-                if queue in used_index.keys():
-                    used_index[queue][instance_type]=[1]
-                else:
-                    used_index[queue]={instance_type:[1]}
-                nextIndex=1
-            else:
-                for i in range(1,10000):
-                    if not i in used_index[queue][instance_type]:
-                        nextIndex=i
-                        used_index[queue][instance_type].append(i)
-                        break
-            clusterName=queue+'-'+str(nextIndex)+'-'+jobconfig["hostname_convention"]
-            if not queue in current_nodes.keys():
-                current_nodes[queue]={instance_type:0}
-            else:
-                if not instance_type in current_nodes[queue].keys():
-                    current_nodes[queue][instance_type]=0
-            if not queue in building_nodes.keys():
-                building_nodes[queue]={instance_type:0}
-            else:
-                if not instance_type in building_nodes[queue].keys():
-                    building_nodes[queue][instance_type]=0
-            if nodes > limits["max_cluster_size"]:
-                print ("Cluster "+clusterName+" won't be created, it would go over the total number of nodes per cluster limit")
-            elif current_nodes[queue][instance_type] + building_nodes[queue][instance_type] + nodes > limits["max_number_nodes"]:
-                print ("Cluster "+clusterName+" won't be created, it would go over the total number of nodes limit")
-            else:
-                current_nodes[queue][instance_type]+=nodes
-                clusterCount+=1
-                print ("Creating cluster "+clusterName+" with "+str(nodes)+" nodes")
-                subprocess.Popen([script_path+'/create_cluster.sh',str(nodes),clusterName,instance_type,queue,jobID,user])
-                time.sleep(5)
+        snapshot = getSlurmSnapshot()
+        if snapshot is None:
+            raise Exception("The Slurm state could not be retrieved, not scaling during this run")
+        for action in getScalingActions(snapshot):
+            print (action["message"])
+            subprocess.Popen(action["command"])
+            time.sleep(action["wait"])
 
     except Exception:
         traceback.print_exc()
-    os.remove(lockfile)
 else:
     print("Autoscaling is false (set in /etc/ansible/hosts)")
     exit()
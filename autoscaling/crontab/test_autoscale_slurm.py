@@ -0,0 +1,55 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),"autoscale_slurm.sh")
+
+def load_functions():
+    """ Functions of autoscale_slurm.sh, without the command line part that takes the lock and runs a pass """
+    with open(SCRIPT) as f:
+        source = f.read()
+    namespace = {"__name__":"autoscale_slurm"}
+    exec(compile(source[:source.index("parser = argparse.ArgumentParser")],SCRIPT,"exec"),namespace)
+    return namespace
+
+CONFIG = [{"name":"compute","instance_types":[{"name":"hpc","shape":"BM.HPC2.36","cluster_network":True,"hostname_convention":"hpc","default":True,"permanent":False,"max_number_nodes":10,"max_cluster_size":5,"max_cluster_count":5}]}]
+
+class GetStatusSlurmTest(unittest.TestCase):
+    def setUp(self):
+        self.autoscale = load_functions()
+        self.clusters_path = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.clusters_path,"compute-1-hpc"))
+        self.autoscale["clusters_path"] = self.clusters_path
+        self.autoscale["config"] = CONFIG
+        long_ago = datetime.datetime.now()-datetime.timedelta(hours=2)
+        self.snapshot = {
+            "jobs":[],
+            "nodes":{"compute-hpc-node-1":{"state":"idle","features":["hpc"],"partition":"compute","cluster":"compute-1-hpc","slurmd_start_time":long_ago}},
+            "topology":{"compute-1-hpc":["compute-hpc-node-1"]},
+            "last_job_end":{}
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.clusters_path)
+
+    def test_cron_mode(self):
+        status = self.autoscale["getstatus_slurm"](self.snapshot,None)
+        cluster_to_build,cluster_to_destroy,nodes_to_destroy,cluster_building,cluster_destroying,used_index,current_nodes,building_nodes = status
+        self.assertEqual(cluster_to_destroy,[["compute-1-hpc"]])
+        self.assertEqual(cluster_building,[])
+        self.assertEqual(current_nodes,{"compute":{"hpc":1}})
+
+    def test_daemon_state(self):
+        daemon_state = {"building":{"compute-2-hpc":[3,"hpc","compute"]},"destroying":["compute-3-hpc"]}
+        status = self.autoscale["getstatus_slurm"](self.snapshot,daemon_state)
+        cluster_to_build,cluster_to_destroy,nodes_to_destroy,cluster_building,cluster_destroying,used_index,current_nodes,building_nodes = status
+        self.assertEqual(cluster_to_destroy,[["compute-1-hpc"]])
+        self.assertEqual(cluster_building,[[3,"hpc","compute"]])
+        self.assertEqual(building_nodes,{"compute":{"hpc":3}})
+        self.assertEqual(cluster_destroying,["compute-3-hpc"])
+        self.assertEqual(sorted(used_index["compute"]["hpc"]),[1,2])
+
+if __name__ == '__main__':
+    unittest.main()
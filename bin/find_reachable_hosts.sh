@@ -1,20 +1,12 @@
 #!/bin/bash
 
 #
-# A little waiter function to make sure all the nodes are up before we start configure
+# Writes to $2 the hosts of $1 that are reachable with SSH as user $3
 #
 
-echo "Checking For SSH"
+scripts=`realpath $0`
+folder=`dirname $scripts`
 
-ssh_options="-i ~/.ssh/cluster.key -o StrictHostKeyChecking=no"
-rm $2
-touch $2
+echo "Checking For SSH"
 
-for host in $(cat $1) ; do
-  r=0
-  echo "validating connection to: ${host}"
-  if [[ `ssh ${ssh_options} -o ConnectTimeout=15 $3@${host} uptime | grep load | wc -l` > 0 ]] ;
-  then
-    echo ${host} >> $2
-  fi
-done
\ No newline at end of file
+/usr/bin/python3 $folder/resize/ssh_probe.py --username $3 --output $2 $1
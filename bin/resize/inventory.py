@@ -0,0 +1,232 @@
+import os
+import shlex
+import subprocess
+import tempfile
+from collections import OrderedDict
+
+class InventoryHost:
+    """ One host line of a section, e.g. compute-1 ansible_host=172.16.0.2 ansible_user=opc role=compute """
+    def __init__(self, name, variables=None):
+        self.name = name
+        self.variables = OrderedDict() if variables is None else OrderedDict(variables)
+        # Line the host was read from, written back as it is while the host is not changed
+        self.source = None
+
+    @classmethod
+    def from_line(cls, line):
+        try:
+            # Quoted values can contain spaces, the quotes are kept in the value
+            fields = shlex.split(line,comments=False,posix=False)
+        except ValueError:
+            fields = line.split()
+        variables = OrderedDict()
+        for field in fields[1:]:
+            if "=" in field:
+                key,value = field.split("=",1)
+                variables[key] = value
+        host = cls(fields[0],variables)
+        host.source = (line if line.endswith("\n") else line+"\n",host.name,list(host.variables.items()))
+        return host
+
+    @property
+    def ip(self):
+        return self.variables.get("ansible_host")
+
+    def line(self):
+        if not self.source is None and self.source[1:] == (self.name,list(self.variables.items())):
+            return self.source[0]
+        return " ".join([self.name]+[key+"="+value for key,value in self.variables.items()])+"\n"
+
+def is_host_line(line):
+    fields = line.split()
+    return len(fields) > 0 and not fields[0].startswith(("#",";")) and not "=" in fields[0]
+
+class InventorySection:
+    """
+    Lines of one section of the inventory, in order.
+    Host lines are indexed by name and by IP, other lines (comments, the lines of :vars and :children sections) are kept as they are.
+    """
+    def __init__(self, name, header=None):
+        self.name = name
+        self.header = "["+name+"]\n" if header is None else header
+        self.entries = OrderedDict()
+        self.ips = {}
+        self.other_lines = 0
+
+    def is_host_section(self):
+        return not self.name.endswith((":vars",":children"))
+
+    def add_line(self, line):
+        if self.is_host_section() and is_host_line(line):
+            self.add(InventoryHost.from_line(line))
+        else:
+            self.entries[("line",self.other_lines)] = line
+            self.other_lines += 1
+
+    def add(self, host):
+        """ Add a host at the end of the section, or replace the host with the same name """
+        self.remove(host.name)
+        self.entries[host.name] = host
+        if not host.ip is None:
+            self.ips[host.ip] = host
+        return host
+
+    def remove(self, name):
+        host = self.entries.pop(name,None)
+        if not host is None and not host.ip is None and self.ips.get(host.ip) is host:
+            del self.ips[host.ip]
+        return host
+
+    def remove_ip(self, ip):
+        host = self.ips.get(ip)
+        if host is None:
+            return None
+        return self.remove(host.name)
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def get_by_ip(self, ip):
+        return self.ips.get(ip)
+
+    def lookup(self, name_or_ip):
+        """ Host with this name, or else with this IP """
+        host = self.entries.get(name_or_ip)
+        if not isinstance(host,InventoryHost):
+            host = self.ips.get(name_or_ip)
+        return host
+
+    def is_empty(self):
+        """ True if the section has no line at all, blank lines count as content like in the templates """
+        return len(self.entries) == 0
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.hosts())
+
+    def __iter__(self):
+        return iter(self.hosts())
+
+    def hosts(self):
+        return [entry for key,entry in self.entries.items() if isinstance(entry,InventoryHost)]
+
+    def names(self):
+        return [host.name for host in self.hosts()]
+
+    def clear(self):
+        for name in self.names():
+            self.remove(name)
+
+    def lines(self):
+        return [entry.line() if isinstance(entry,InventoryHost) else entry for entry in self.entries.values()]
+
+class Inventory:
+    """
+    Ansible INI inventory, as written by the stack and the resize scripts.
+    Sections are kept in order, host lookups by name or IP do not scan the file.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.sections = OrderedDict()
+        # Lines before the first section
+        self.preamble = []
+
+    @classmethod
+    def load(cls, path):
+        """ Parse an inventory file. Returns None if the file cannot be read """
+        try:
+            with open(path,"r") as f:
+                text = f.read()
+        except (IOError,OSError):
+            return None
+        inventory = cls(path)
+        current_section = None
+        for line in text.splitlines(True):
+            if line.strip().startswith("[") and line.strip().endswith("]"):
+                current_section = inventory.section(line.split('[')[1].split(']')[0],header=line)
+            elif not current_section is None:
+                current_section.add_line(line)
+            else:
+                inventory.preamble.append(line)
+        return inventory
+
+    def section(self, name, header=None):
+        """ Return a section, creating it at the end of the inventory if needed """
+        if not name in self.sections:
+            self.sections[name] = InventorySection(name,header)
+        return self.sections[name]
+
+    def __getitem__(self, name):
+        return self.section(name)
+
+    def __contains__(self, name):
+        return name in self.sections
+
+    def get_var(self, name, default=None, section="all:vars"):
+        """ Value of a variable of the all:vars section """
+        if not section in self.sections:
+            return default
+        for line in self.sections[section].lines():
+            # Variables are written as key=value or key = value
+            key,separator,value = line.partition("=")
+            if separator and key.strip() == name:
+                return value.strip()
+        return default
+
+    def remove_hosts(self, names_or_ips, sections):
+        """ Remove hosts by name or IP from the given sections. Returns the removed hosts """
+        removed = []
+        for value in names_or_ips:
+            for section_name in sections:
+                if not section_name in self.sections:
+                    continue
+                host = self.sections[section_name].lookup(value)
+                if not host is None:
+                    self.sections[section_name].remove(host.name)
+                    removed.append(host)
+        return removed
+
+    def render(self):
+        text = "".join(self.preamble)
+        for name,section in self.sections.items():
+            text += section.header
+            text += "".join(section.lines())
+        return text
+
+    def write(self, path=None):
+        """
+        Write the inventory only if its content changed. The file is replaced atomically,
+        through sudo when the directory is not writable.
+        Returns:
+            True if the file was written.
+        """
+        if path is None:
+            path = self.path
+        text = self.render()
+        try:
+            with open(path,"r") as f:
+                if f.read() == text:
+                    return False
+        except (IOError,OSError):
+            pass
+        directory = os.path.dirname(os.path.abspath(path))
+        if os.access(directory,os.W_OK):
+            fd,tmp_path = tempfile.mkstemp(dir=directory,prefix="."+os.path.basename(path)+".")
+        else:
+            fd,tmp_path = tempfile.mkstemp(prefix=os.path.basename(path)+".")
+        with os.fdopen(fd,"w") as f:
+            f.write(text)
+        if os.path.exists(path):
+            os.chmod(tmp_path,os.stat(path).st_mode & 0o777)
+        else:
+            os.chmod(tmp_path,0o644)
+        if os.path.dirname(tmp_path) == directory:
+            os.replace(tmp_path,path)
+        else:
+            # Copy next to the target first so that the final rename stays atomic
+            subprocess.check_call(["sudo","cp","--preserve=mode",tmp_path,path+".tmp"])
+            subprocess.check_call(["sudo","mv","-f",path+".tmp",path])
+            os.remove(tmp_path)
+        return True
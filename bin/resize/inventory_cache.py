@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import time
+
+cache_file="/opt/oci-hpc/cache/inventory.db"
+# Seconds before the instance list of a cluster is fetched again from OCI. Can be overridden with OCI_HPC_INVENTORY_CACHE_TTL
+default_ttl=int(os.environ.get("OCI_HPC_INVENTORY_CACHE_TTL","120"))
+
+def get_connection():
+    """ Open the cache database, creating it if needed. Returns None if the cache cannot be used """
+    try:
+        os.makedirs(os.path.dirname(cache_file),exist_ok=True)
+        connection = sqlite3.connect(cache_file,timeout=30)
+        connection.execute("CREATE TABLE IF NOT EXISTS clusters (cluster_ocid TEXT PRIMARY KEY, updated REAL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS instances (cluster_ocid TEXT, display_name TEXT, ip TEXT, ocid TEXT, lifecycle_state TEXT, position INTEGER)")
+        connection.execute("CREATE INDEX IF NOT EXISTS instances_cluster ON instances (cluster_ocid)")
+        return connection
+    except (OSError,sqlite3.Error) as e:
+        print("The inventory cache "+cache_file+" cannot be used: "+str(e))
+        return None
+
+def get_cached_instances(cluster_ocid,ttl=default_ttl):
+    """
+    Return the cached instances of a cluster.
+    Args:
+        cluster_ocid: OCID of the cluster network, instance pool or compute cluster.
+        ttl: maximum age of the entry in seconds. 0 disables the cache.
+    Returns:
+        A list of dictionaries with display_name, ip, ocid and lifecycle_state, or None when there is no valid entry.
+    """
+    if ttl <= 0:
+        return None
+    connection = get_connection()
+    if connection is None:
+        return None
+    try:
+        row = connection.execute("SELECT updated FROM clusters WHERE cluster_ocid=?",(cluster_ocid,)).fetchone()
+        if row is None or time.time()-row[0] > ttl:
+            return None
+        rows = connection.execute("SELECT display_name, ip, ocid, lifecycle_state FROM instances WHERE cluster_ocid=? ORDER BY position",(cluster_ocid,)).fetchall()
+    except sqlite3.Error as e:
+        print("The inventory cache could not be read: "+str(e))
+        return None
+    finally:
+        connection.close()
+    return [{'display_name':row[0],'ip':row[1],'ocid':row[2],'lifecycle_state':row[3]} for row in rows]
+
+def set_cached_instances(cluster_ocid,instances):
+    """ Replace the cached instances of a cluster """
+    connection = get_connection()
+    if connection is None:
+        return False
+    try:
+        with connection:
+            connection.execute("DELETE FROM instances WHERE cluster_ocid=?",(cluster_ocid,))
+            connection.executemany("INSERT INTO instances (cluster_ocid, display_name, ip, ocid, lifecycle_state, position) VALUES (?,?,?,?,?,?)",[(cluster_ocid,instance['display_name'],instance['ip'],instance['ocid'],instance.get('lifecycle_state'),position) for position,instance in enumerate(instances)])
+            connection.execute("INSERT OR REPLACE INTO clusters (cluster_ocid, updated) VALUES (?,?)",(cluster_ocid,time.time()))
+    except sqlite3.Error as e:
+        print("The inventory cache could not be updated: "+str(e))
+        return False
+    finally:
+        connection.close()
+    return True
+
+def invalidate_instances(cluster_ocid):
+    """ Drop the cached instances of a cluster, to be called whenever nodes are added or removed """
+    connection = get_connection()
+    if connection is None:
+        return False
+    try:
+        with connection:
+            connection.execute("DELETE FROM instances WHERE cluster_ocid=?",(cluster_ocid,))
+            connection.execute("DELETE FROM clusters WHERE cluster_ocid=?",(cluster_ocid,))
+    except sqlite3.Error as e:
+        print("The inventory cache could not be invalidated: "+str(e))
+        return False
+    finally:
+        connection.close()
+    return True
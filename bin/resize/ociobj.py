@@ -9,6 +9,7 @@ class ocicore:
             self.computeManagementClient = oci.core.ComputeManagementClient(self.config_oci)
             self.ComputeManagementClientCompositeOperations = oci.core.ComputeManagementClientCompositeOperations(self.computeManagementClient)
             self.virtualNetworkClient = oci.core.VirtualNetworkClient(self.config_oci)
+            self.workRequestClient = oci.work_requests.WorkRequestClient(self.config_oci)
             self.dns_client = oci.dns.DnsClient(self.config_oci)
         else:
             self.signer = oci.auth.signers.InstancePrincipalsSecurityTokenSigner()
@@ -17,11 +18,12 @@ class ocicore:
             self.computeManagementClient = oci.core.ComputeManagementClient(config={}, signer=self.signer)
             self.ComputeManagementClientCompositeOperations = oci.core.ComputeManagementClientCompositeOperations(self.computeManagementClient)
             self.virtualNetworkClient = oci.core.VirtualNetworkClient(config={}, signer=self.signer)
+            self.workRequestClient = oci.work_requests.WorkRequestClient(config={}, signer=self.signer)
             self.dns_client = oci.dns.DnsClient(config={}, signer=self.signer)
 
 class ocicluster:
     def __init__(self, comp_ocid, cn_ocid, CN, cluster_name, username, inventory, hostfile,  \
-                 playbooks_dir, slurm_name_change, hostname_convention, autoscaling):
+                 playbooks_dir, slurm_name_change, hostname_convention, autoscaling, cache_ttl=0):
         self.comp_ocid = comp_ocid
         self.cn_ocid = cn_ocid
         self.CN = CN
@@ -32,4 +34,5 @@ class ocicluster:
         self.playbooks_dir = playbooks_dir
         self.slurm_name_change = slurm_name_change
         self.hostname_convention = hostname_convention
-        self.autoscaling = autoscaling
\ No newline at end of file
+        self.autoscaling = autoscaling
+        self.cache_ttl = cache_ttl
\ No newline at end of file
@@ -2,80 +2,148 @@ import subprocess
 import time
 import shutil
 import os
-from utils import backup_inventory, parse_inventory, write_inventory, get_instances, getreachable
+import json
+from datetime import datetime
+from utils import backup_inventory, get_instances, getreachable
+from inventory import Inventory, InventoryHost
 from ociobj import ocicore, ocicluster
+from ssh_probe import wait_for_hosts, print_probe
 
-def update_cluster(inventory,playbook,hostfile=None,add_vars={}):
+unreachable_batchsize=8
+# Per host and per task timings of every playbook run, written by playbooks/callback_plugins/resize_events.py
+events_dir="/opt/oci-hpc/logs/ansible"
+
+def get_playbook_results(events_file):
+    """
+    Read the events written by the resize_events callback during a playbook run.
+    Args:
+        events_file: path of the JSON lines file.
+    Returns:
+        A dictionary with True for every host that had no failure and was always reachable, False otherwise, and the list of task results.
+    """
+    host_results={}
+    task_results=[]
+    stats=None
+    try:
+        with open(events_file) as f:
+            for line in f:
+                try:
+                    event=json.loads(line)
+                except ValueError:
+                    continue
+                if event['event'] == 'result':
+                    task_results.append(event)
+                    if not event['host'] in host_results:
+                        host_results[event['host']]=True
+                    if event['status'] in ['failed','unreachable'] and not event['ignore_errors']:
+                        host_results[event['host']]=False
+                elif event['event'] == 'stats':
+                    stats=event['hosts']
+    except IOError:
+        return host_results,task_results
+    if not stats is None:
+        for host in stats.keys():
+            host_results[host]=(stats[host]['failures'] == 0 and stats[host]['unreachable'] == 0)
+    return host_results,task_results
+
+def print_slowest_tasks(task_results,count=10):
+    tasks={}
+    for result in task_results:
+        key=(result['play'],result['task'])
+        tasks[key]=max(tasks.get(key,0),result['duration'])
+    if len(tasks):
+        print("Slowest tasks (longest host):")
+        for (play,task),duration in sorted(tasks.items(),key=lambda item: item[1],reverse=True)[:count]:
+            print("  "+str(duration)+"s "+str(play)+" : "+str(task))
+
+def update_cluster(inventory,playbook,hostfile=None,add_vars={},return_hosts=False):
     my_env = os.environ.copy()
     my_env["ANSIBLE_HOST_KEY_CHECKING"] = "False"
-    rc = 0
-    inventory_dict = parse_inventory(inventory)
-    username="opc"
-    for inv_vars in inventory_dict["all:vars"]:
-        if inv_vars.startswith("compute_username"):
-            username=inv_vars.split("compute_username=")[1].strip()
-            break
+    username=Inventory.load(inventory).get_var("compute_username","opc")
     if not hostfile is None:
-        p = subprocess.Popen(["/opt/oci-hpc/bin/wait_for_hosts.sh",hostfile,username],env=my_env,stderr = subprocess.PIPE, stdout=subprocess.PIPE)
-        while True:
-            output = p.stdout.readline().decode()
-            if output == '' and p.poll() is not None:
-                break
-            if output:
-                print(output.strip())
-        if (rc != 0):
-            print("The hosts did not come up for SSH, not reconfiguring")
-            return 2
+        print("Waiting for SSH to come up")
+        hosts=[line.strip() for line in open(hostfile) if line.strip()]
+        results=wait_for_hosts(hosts,username,callback=print_probe)
+        unreachable_hosts=[host for host in hosts if not results[host]['reachable']]
+        if len(unreachable_hosts):
+            print("The following hosts did not come up for SSH: "+" ".join(unreachable_hosts))
     for add_var in add_vars.keys():
         my_env[add_var] = add_vars[add_var]
-    p = subprocess.Popen(["ansible-playbook","-i",inventory,playbook],env=my_env,stderr = subprocess.PIPE, stdout=subprocess.PIPE)
-    while True:
-        output = p.stdout.readline().decode()
-        if output == '' and p.poll() is not None:
-            break
-        if output:
-            print(output.strip())
-    rc = p.returncode
+    try:
+        os.makedirs(events_dir,exist_ok=True)
+        events_file=os.path.join(events_dir,os.path.basename(playbook).replace(".yml","")+"_"+datetime.now().strftime("%Y%m%d%H%M%S%f")+".jsonl")
+    except OSError:
+        events_file="/tmp/"+os.path.basename(playbook).replace(".yml","")+"_"+datetime.now().strftime("%Y%m%d%H%M%S%f")+".jsonl"
+    callback_plugins=os.path.join(os.path.dirname(os.path.realpath(playbook)),"callback_plugins")
+    my_env["RESIZE_EVENTS_FILE"] = events_file
+    my_env["ANSIBLE_CALLBACK_PLUGINS"] = ":".join([path for path in [my_env.get("ANSIBLE_CALLBACK_PLUGINS"),callback_plugins] if path])
+    for callbacks_variable in ["ANSIBLE_CALLBACKS_ENABLED","ANSIBLE_CALLBACK_WHITELIST"]:
+        my_env[callbacks_variable] = ",".join([callback for callback in [my_env.get(callbacks_variable),"resize_events"] if callback])
+    # stderr is merged into stdout so that neither pipe can fill up and block ansible
+    p = subprocess.Popen(["ansible-playbook","-i",inventory,playbook],env=my_env,stderr=subprocess.STDOUT,stdout=subprocess.PIPE,universal_newlines=True)
+    for output in p.stdout:
+        if output.strip():
+            print(output.rstrip())
+    rc = p.wait()
+    host_results,task_results=get_playbook_results(events_file)
+    print_slowest_tasks(task_results)
+    print("The task timings of this run are in "+events_file)
+    failed_hosts=[host for host in host_results.keys() if not host_results[host]]
+    if len(failed_hosts):
+        print("STDOUT: The playbook failed on: "+" ".join(failed_hosts))
     tmp_file_do_not_edit="/tmp/"+inventory.replace("/",'_')+".do_not_edit"
     if (rc == 0):
         print("success")
         if os.path.isfile(tmp_file_do_not_edit):
             os.remove(tmp_file_do_not_edit)
-        return 0
+        update_flag = 0
     else:
         print("return code from ansible playbook job was non-zero, review what failed during ansible tasks run : "+str(rc))
         if os.path.isfile(tmp_file_do_not_edit):
             shutil.move(tmp_file_do_not_edit, "/tmp/etc_ansible_hosts.do_not_edit.old")
         print("Resolve the issue which caused ansible playbook to fail (hint: look for word fatal in above output). Then run the below command to only run the reconfigure step (ansible playbook) without again adding or removing node from HPC/GPU cluster.")
-        return 1
+        update_flag = 1
+    if return_hosts:
+        return update_flag,host_results
+    return update_flag
         #if mode == 'add':
         #    print("Command:  python3 playbooks/resize.py reconfigure --nodes newly_added_node1_hostname newly_added_node2_hostname ")
         #if mode == 'remove':
         #    print("Command:  python3 playbooks/resize.py reconfigure --slurm_only_update true ")
 
+def destroy_unreachable_batches(inventory,playbook,nodes):
+    """
+    Run the unreachable node removal playbook for all the nodes at once.
+    If it fails, run it again on batches of nodes so that one faulty node does not block the others.
+    Args:
+        inventory: inventory used to run the playbook.
+        playbook: path of the playbook.
+        nodes: list of IPs or hostnames to remove.
+    Returns:
+        0 if all the nodes were removed, the return code of update_cluster otherwise.
+    """
+    update_flag = update_cluster(inventory,playbook,add_vars={"unreachable_node_list":",".join(nodes)})
+    if update_flag == 0 or len(nodes) == 1:
+        return update_flag
+    print("STDOUT: Removing all the nodes at once failed, retrying in batches of "+str(unreachable_batchsize))
+    update_flag = 0
+    for i in range(0,len(nodes),unreachable_batchsize):
+        batch = nodes[i:i+unreachable_batchsize]
+        batch_flag = update_cluster(inventory,playbook,add_vars={"unreachable_node_list":",".join(batch)})
+        if batch_flag != 0:
+            print("STDOUT: The removal failed for "+" ".join(batch))
+            update_flag = batch_flag
+    return update_flag
+
 def destroy_unreachable_reconfigure(ocicluster,ocicore,nodes_to_remove,playbook):
     if not os.path.isfile("/etc/ansible/hosts"):
         print("STDOUT: There is no inventory file, are you on the controller? The cluster has not been resized")
         exit(1)
     backup_inventory(ocicluster.inventory)
-    inventory_dict = parse_inventory(ocicluster.inventory)
+    hosts_inventory = Inventory.load(ocicluster.inventory)
     tmp_inventory_destroy="/tmp/"+ocicluster.inventory.replace('/','_')+"_destroy"
-    ips_to_remove = []
-    for host in nodes_to_remove:
-        hostRemoved=False
-        for line in inventory_dict['compute_configured']:
-            if host in line:
-                inventory_dict['compute_configured'].remove(line)
-                ips_to_remove.append(line.split("ansible_host=")[1].split("ansible_user=")[0].strip())
-                hostRemoved=True
-        for line in inventory_dict['compute_to_add']:
-            if host in line:
-                inventory_dict['compute_to_add'].remove(line)
-                ips_to_remove.append(line.split("ansible_host=")[1].split("ansible_user=")[0].strip())
-                hostRemoved=True
-        for line in inventory_dict['nfs']:
-            if host in line:
-                inventory_dict['nfs'].remove(line)
+    ips_to_remove = [host.ip for host in hosts_inventory.remove_hosts(nodes_to_remove,['compute_configured','compute_to_add'])]
+    hosts_inventory.remove_hosts(nodes_to_remove,['nfs'])
     if len(ips_to_remove) != len(nodes_to_remove):
         instances = get_instances(ocicluster, ocicore)
         for instance in instances:
@@ -84,24 +152,17 @@ def destroy_unreachable_reconfigure(ocicluster,ocicore,nodes_to_remove,playbook)
         if len(ips_to_remove) != len(nodes_to_remove):
             print("STDOUT: Some nodes are removed in OCI and removed from the inventory")
             print("STDOUT: Try rerunning with the --nodes option and a list of IPs or Slurm Hostnames to cleanup the controller")
-    write_inventory(inventory_dict,tmp_inventory_destroy)
+    hosts_inventory.write(tmp_inventory_destroy)
     if not len(ips_to_remove) or not ocicluster.slurm_name_change:
         if not len(ips_to_remove):
             print("STDOUT: No hostname found, trying anyway with "+" ".join(nodes_to_remove))
-        for node in nodes_to_remove: # Temporary fix while the playbook is changed to be able to run multiple at the time
-            update_flag = update_cluster(tmp_inventory_destroy,playbook,add_vars={"unreachable_node_list":node})
-            time.sleep(10)
+        update_flag = destroy_unreachable_batches(tmp_inventory_destroy,playbook,nodes_to_remove)
     else:
-        for ip in ips_to_remove: # Temporary fix while the playbook is changed to be able to run multiple at the time
-            update_flag = update_cluster(tmp_inventory_destroy,playbook,add_vars={"unreachable_node_list":ip})
-            time.sleep(10)
+        update_flag = destroy_unreachable_batches(tmp_inventory_destroy,playbook,ips_to_remove)
     if update_flag == 0:
         os.remove(tmp_inventory_destroy)
-        inventory_dict['compute_to_destroy']=[]
-        tmp_inventory="/tmp/"+ocicluster.inventory.replace('/','_')
-        write_inventory(inventory_dict,tmp_inventory)
-        os.system('sudo mv '+tmp_inventory+' '+ocicluster.inventory)
-        os.system('')
+        hosts_inventory['compute_to_destroy'].clear()
+        hosts_inventory.write()
     return update_flag
 
 def destroy_reconfigure(ocicluster,ocicore,nodes_to_remove,playbook,remove_unreachable):
@@ -109,116 +170,87 @@ def destroy_reconfigure(ocicluster,ocicore,nodes_to_remove,playbook,remove_unrea
         print("STDOUT: There is no inventory file, are you on the controller? The cluster has not been resized")
         exit(1)
     backup_inventory(ocicluster.inventory)
-    inventory_dict = parse_inventory(ocicluster.inventory)
-    inventory_dict['compute_to_destroy']=[]
+    hosts_inventory = Inventory.load(ocicluster.inventory)
+    hosts_inventory['compute_to_destroy'].clear()
     instances = get_instances(ocicluster, ocicore)
     nodes_to_remove_instances = [{'ip':node,'display_name':node} for node in nodes_to_remove ]
-    username="opc"
-    for inv_vars in inventory_dict["all:vars"]:
-        if inv_vars.startswith("compute_username"):
-            username=inv_vars.split("compute_username=")[1].strip()
-            break
     if remove_unreachable:
-        reachable_instances,unreachable_instances = getreachable(instances,username)
-        reachable_node_to_remove,unreachable_node_to_remove = getreachable(nodes_to_remove_instances,username)
+        reachable_instances,unreachable_instances = getreachable(instances,ocicluster)
+        reachable_node_to_remove,unreachable_node_to_remove = getreachable(nodes_to_remove_instances,ocicluster)
     else:
         reachable_instances=instances
         unreachable_instances=[]
         reachable_node_to_remove=nodes_to_remove_instances
         unreachable_node_to_remove=[]
+    reachable_names=set([node['display_name'] for node in reachable_node_to_remove])
     for host in nodes_to_remove:
-        compute_to_remove=[]
-        nfs_to_remove=[]
-        for line in inventory_dict['compute_configured']:
-            if host in line:
-                if host in [node['display_name'] for node in reachable_node_to_remove ]:
-                    inventory_dict['compute_to_destroy'].append(line)
-                compute_to_remove.append(line)
-        for line in inventory_dict['compute_to_add']:
-            if host in line:
-                if host in [node['display_name'] for node in reachable_node_to_remove ]:
-                    inventory_dict['compute_to_destroy'].append(line)
-                compute_to_remove.append(line)
-        for line in inventory_dict['nfs']:
-            if host in line:
-                if host in [node['display_name'] for node in reachable_node_to_remove ]:
-                    nfs_to_remove.append(line)
-        for line in compute_to_remove:
-            inventory_dict['compute_configured'].remove(line)
-        for line in nfs_to_remove:
-            inventory_dict['nfs'].remove(line)
-    for instance in unreachable_instances:
-        for line in inventory_dict['compute_configured']:
-            if instance['display_name'] in line:
-                inventory_dict['compute_configured'].remove(line)
-        for line in inventory_dict['compute_to_add']:
-           if instance['display_name'] in line:
-                inventory_dict['compute_to_add'].remove(line)
+        for section in ['compute_configured','compute_to_add']:
+            inventory_host = hosts_inventory[section].lookup(host)
+            if not inventory_host is None:
+                if host in reachable_names:
+                    hosts_inventory['compute_to_destroy'].add(InventoryHost.from_line(inventory_host.line()))
+                hosts_inventory[section].remove(inventory_host.name)
+        if host in reachable_names:
+            hosts_inventory.remove_hosts([host],['nfs'])
+    hosts_inventory.remove_hosts([instance['display_name'] for instance in unreachable_instances],['compute_configured','compute_to_add'])
     tmp_inventory_destroy="/tmp/"+ocicluster.inventory.replace('/','_')+"_destroy"
-    write_inventory(inventory_dict,tmp_inventory_destroy)
+    hosts_inventory.write(tmp_inventory_destroy)
     update_flag = update_cluster(tmp_inventory_destroy,playbook)
     if update_flag == 0:
         os.remove(tmp_inventory_destroy)
-        inventory_dict['compute_to_destroy']=[]
-        tmp_inventory="/tmp/"+ocicluster.inventory.replace('/','_')
-        write_inventory(inventory_dict,tmp_inventory)
-        os.system('sudo mv '+tmp_inventory+' '+ocicluster.inventory)
-        os.system('')
+        hosts_inventory['compute_to_destroy'].clear()
+        hosts_inventory.write()
     return update_flag
 
 def add_reconfigure(ocicluster,ocicore,specific_hosts=None):
     instances = get_instances(ocicluster, ocicore)
     backup_inventory(ocicluster.inventory)
-    inventory_dict = parse_inventory(ocicluster.inventory)
-    username="opc"
-    for inv_vars in inventory_dict["all:vars"]:
-        if inv_vars.startswith("compute_username"):
-            username=inv_vars.split("compute_username=")[1].strip()
-            break
-    reachable_instances=instances
-    unreachable_instances=[]
-    if not os.path.isfile(ocicluster.inventory):
+    hosts_inventory = Inventory.load(ocicluster.inventory)
+    if hosts_inventory is None:
         print("STDOUT: There is no inventory file, are you on the controller? The cluster has been resized but not reconfigured")
         exit(1)
+    username=hosts_inventory.get_var("compute_username","opc")
+    compute_configured=hosts_inventory['compute_configured']
+    compute_to_add=hosts_inventory['compute_to_add']
     host_to_wait_for=[]
-    for node in reachable_instances:
+    for node in instances:
         name=node['display_name']
         ip=node['ip']
-        configured=False
-        for line in inventory_dict['compute_configured']:
-            if name in line and ip in line:
-                configured = True
-                break
-        if not configured:
-            nodeline=name+" ansible_host="+ip+" ansible_user="+username+" role=compute\n"
-            if not specific_hosts is None:
-                if name in specific_hosts:
-                    inventory_dict['compute_to_add'].append(nodeline)
-                else:
-                    inventory_dict['compute_configured'].append(nodeline)
+        configured_host=compute_configured.get(name)
+        if configured_host is None or configured_host.ip != ip:
+            new_host=InventoryHost(name,[("ansible_host",ip),("ansible_user",username),("role","compute")])
+            if not specific_hosts is None and not name in specific_hosts:
+                compute_configured.add(new_host)
             else:
-                inventory_dict['compute_to_add'].append(nodeline)
+                compute_to_add.add(new_host)
             host_to_wait_for.append(ip)
-    if len(inventory_dict['nfs'])==0:
-        if len(inventory_dict['compute_to_add']) > 0:
-            inventory_dict['nfs'].append(inventory_dict['compute_to_add'][0])
-        elif len(inventory_dict['compute_configured']) > 0:
-            inventory_dict['nfs'].append(inventory_dict['compute_configured'][0])
+    if hosts_inventory['nfs'].is_empty():
+        if len(compute_to_add) > 0:
+            hosts_inventory['nfs'].add(InventoryHost.from_line(compute_to_add.hosts()[0].line()))
+        elif len(compute_configured) > 0:
+            hosts_inventory['nfs'].add(InventoryHost.from_line(compute_configured.hosts()[0].line()))
     hostfile=open("/tmp/hosts_"+ocicluster.cluster_name,'w')
     hostfile.write("\n".join(host_to_wait_for))
     hostfile.close()
     tmp_inventory_add="/tmp/"+ocicluster.inventory.replace('/','_')+"_add"
-    write_inventory(inventory_dict,tmp_inventory_add)
-    update_flag = update_cluster(tmp_inventory_add,ocicluster.playbooks_dir+"resize_add.yml",hostfile="/tmp/hosts_"+ocicluster.cluster_name)
+    hosts_inventory.write(tmp_inventory_add)
+    update_flag,host_results = update_cluster(tmp_inventory_add,ocicluster.playbooks_dir+"resize_add.yml",hostfile="/tmp/hosts_"+ocicluster.cluster_name,return_hosts=True)
     if update_flag == 0:
         os.remove(tmp_inventory_add)
-        for line in inventory_dict['compute_to_add']:
-            inventory_dict['compute_configured'].append(line)
-        inventory_dict['compute_to_add']=[]
-        tmp_inventory="/tmp/"+ocicluster.inventory.replace('/','_')
-        write_inventory(inventory_dict,tmp_inventory)
-        os.system('sudo mv '+tmp_inventory+' '+ocicluster.inventory)
+        for host in compute_to_add.hosts():
+            compute_configured.add(host)
+        compute_to_add.clear()
+        hosts_inventory.write()
     else:
+        failed_hosts=[host for host in host_results.keys() if not host_results[host]]
+        # If only some of the new nodes failed, keep the others as configured. The failed ones are left out of the inventory to be added again
+        if len(failed_hosts) and set(failed_hosts) < set(compute_to_add.names()):
+            for host in compute_to_add.hosts():
+                if not host.name in failed_hosts:
+                    compute_configured.add(host)
+            compute_to_add.clear()
+            hosts_inventory.write()
+            print("STDOUT: The node(s) "+" ".join(failed_hosts)+" could not be configured, the other new nodes were added")
         print("STDOUT: The reconfiguration to add the node(s) had an error")
         print("STDOUT: Try rerunning this command: ansible-playbook -i "+tmp_inventory_add+' '+ocicluster.playbooks_dir+"resize_add.yml" )
         exit(1)
@@ -229,31 +261,21 @@ def reconfigure(ocicluster,ocicore,crucial=False):
         print("STDOUT: There is no inventory file, are you on the controller? Reconfigure did not happen")
         exit(1)
     backup_inventory(ocicluster.inventory)
-    inventory_dict = parse_inventory(ocicluster.inventory)
+    hosts_inventory = Inventory.load(ocicluster.inventory)
     host_to_wait_for=[]
-    inventory_dict['compute_configured']=[]
-    inventory_dict['compute_to_add']=[]
-    username="opc"
-    for inv_vars in inventory_dict["all:vars"]:
-        if inv_vars.startswith("compute_username"):
-            username=inv_vars.split("compute_username=")[1].strip()
-            break
+    hosts_inventory['compute_configured'].clear()
+    hosts_inventory['compute_to_add'].clear()
+    username=hosts_inventory.get_var("compute_username","opc")
     for node in instances:
-        name=node['display_name']
-        ip=node['ip']
-        nodeline=name+" ansible_host="+ip+" ansible_user="+username+" role=compute\n"
-        inventory_dict['compute_configured'].append(nodeline)
-        host_to_wait_for.append(ip)
-    if len(inventory_dict['nfs'])==0:
-        if len(inventory_dict['compute_to_add']) > 0:
-            inventory_dict['nfs'].append(inventory_dict['compute_to_add'][0])
-        elif len(inventory_dict['compute_configured']) > 0:
-            inventory_dict['nfs'].append(inventory_dict['compute_configured'][0])
+        hosts_inventory['compute_configured'].add(InventoryHost(node['display_name'],[("ansible_host",node['ip']),("ansible_user",username),("role","compute")]))
+        host_to_wait_for.append(node['ip'])
+    if hosts_inventory['nfs'].is_empty() and len(hosts_inventory['compute_configured']) > 0:
+        hosts_inventory['nfs'].add(InventoryHost.from_line(hosts_inventory['compute_configured'].hosts()[0].line()))
     hostfile=open("/tmp/hosts_"+ocicluster.cluster_name,'w')
     hostfile.write("\n".join(host_to_wait_for))
     hostfile.close()
     tmp_inventory_reconfig="/tmp/"+ocicluster.inventory.replace('/','_')+"_reconfig"
-    write_inventory(inventory_dict,tmp_inventory_reconfig)
+    hosts_inventory.write(tmp_inventory_reconfig)
     if ocicluster.autoscaling:
         playbook=ocicluster.playbooks_dir+"new_nodes.yml"
     else:
@@ -262,7 +284,8 @@ def reconfigure(ocicluster,ocicore,crucial=False):
         playbook=ocicluster.playbooks_dir+"resize_remove.yml"
     update_flag = update_cluster(tmp_inventory_reconfig,playbook,hostfile="/tmp/hosts_"+ocicluster.cluster_name)
     if update_flag == 0:
-        os.system('sudo mv '+tmp_inventory_reconfig+' '+ocicluster.inventory)
+        hosts_inventory.write()
+        os.remove(tmp_inventory_reconfig)
     else:
         print("The reconfiguration had an error")
         print("Try rerunning this command: ansible-playbook -i "+tmp_inventory_reconfig+' '+playbook )
\ No newline at end of file
@@ -9,10 +9,14 @@ import shutil
 import os
 import copy
 import ipaddress
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from ociobj import ocicore, ocicluster
-from utils import get_metadata, wait_for_running_status, get_instances, parse_inventory, getNFSnode, get_summary, updateTFState, getreachable, getLaunchInstanceDetails, check_replace_slumhostname
+from utils import get_metadata, wait_for_running_status, get_instances, getNFSnode, get_summary, updateTFState, getreachable, getLaunchInstanceDetails, get_instance_primary_vnic_attachment, check_replace_slumhostname, wait_for_terminations, launch_instances, api_workers
 from reconfigure import destroy_unreachable_reconfigure, add_reconfigure, reconfigure
+from inventory_cache import default_ttl, invalidate_instances
+from inventory import Inventory
 
 batchsize=12
 inventory="/etc/ansible/hosts"
@@ -35,6 +39,8 @@ parser.add_argument('--ansible_crucial', help='If present during reconfiguration
 parser.add_argument('--remove_unreachable', help='If present, ALL nodes that are not sshable will be terminated before running the action that was requested (Example Adding a node). \
                     CAUTION: Use this only if you want to remove ALL nodes that are unreachable. Instead, remove specific nodes that are unreachable by using positional argument remove_unreachable.',action='store_true',default=False)
 parser.add_argument('--quiet', help='If present, the script will not prompt for a response when removing nodes and will not give a reminder to save data from nodes that are being removed ',action='store_true',default=False)
+parser.add_argument('--no_cache', help='If present, the list of instances is always fetched from OCI instead of the local inventory cache',action='store_true',default=False)
+parser.add_argument('--cache_ttl', type=int, help='Number of seconds the list of instances of a cluster is kept in the local inventory cache. Default is '+str(default_ttl),default=default_ttl)
 
 args = parser.parse_args()
 
@@ -58,47 +64,19 @@ else:
     host_check_file="/opt/oci-hpc/autoscaling/clusters/"+cluster_name+'/hosts_'+cluster_name
     autoscaling = True
 
-inventory_dict = parse_inventory(inventory)
-username="opc"
-for inv_vars in inventory_dict["all:vars"]:
-    if inv_vars.startswith("compute_username"):
-        username=inv_vars.split("compute_username=")[1].strip()
-        break
-zone_name=cluster_name+".local"
-for inv_vars in inventory_dict["all:vars"]:
-    if inv_vars.startswith("zone_name"):
-        zone_name=inv_vars.split("zone_name=")[1].strip()
-        break
-dns_entries=True
-for inv_vars in inventory_dict["all:vars"]:
-    if inv_vars.startswith("dns_entries"):
-        dns_entries=(inv_vars.split("dns_entries=")[1].strip().lower() == "true")
-        break
-vcn_compartment=comp_ocid
-for inv_vars in inventory_dict["all:vars"]:
-    if inv_vars.startswith("vcn_compartment"):
-        vcn_compartment=inv_vars.split("vcn_compartment=")[1].strip()
-        break
-hostname_convention=None
-for inv_vars in inventory_dict["all:vars"]:
-    if inv_vars.startswith("hostname_convention"):
-        hostname_convention=inv_vars.split("hostname_convention=")[1].strip()
-        break
-instance_type=""
-for inv_vars in inventory_dict["all:vars"]:
-    if inv_vars.startswith("instance_type"):
-        instance_type=inv_vars.split("instance_type=")[1].strip()
-        break
+hosts_inventory = Inventory.load(inventory)
+username=hosts_inventory.get_var("compute_username","opc")
+zone_name=hosts_inventory.get_var("zone_name",cluster_name+".local")
+dns_entries=(hosts_inventory.get_var("dns_entries","true").lower() == "true")
+vcn_compartment=hosts_inventory.get_var("vcn_compartment",comp_ocid)
+hostname_convention=hosts_inventory.get_var("hostname_convention")
+instance_type=hosts_inventory.get_var("instance_type","")
 private_subnet_cidr=None
-for inv_vars in inventory_dict["all:vars"]:
-    if inv_vars.startswith("private_subnet"):
-        private_subnet_cidr=ipaddress.ip_network(inv_vars.split("private_subnet=")[1].strip())
-        break
+if not hosts_inventory.get_var("private_subnet") is None:
+    private_subnet_cidr=ipaddress.ip_network(hosts_inventory.get_var("private_subnet"))
 slurm_name_change=None
-for inv_vars in inventory_dict["all:vars"]:
-    if inv_vars.startswith("change_hostname"):
-        slurm_name_change=(inv_vars.split("change_hostname=")[1].strip().lower() == "true")
-        break
+if not hosts_inventory.get_var("change_hostname") is None:
+    slurm_name_change=(hosts_inventory.get_var("change_hostname").lower() == "true")
 
 hostnames=args.nodes
 if hostnames is None:
@@ -137,6 +115,11 @@ if args.remove_unreachable is None:
 else:
     remove_unreachable=args.remove_unreachable
 
+if args.no_cache:
+    cache_ttl=0
+else:
+    cache_ttl=args.cache_ttl
+
 ocicore = ocicore(user_logging)
 
 cn_summary,ip_summary,CN = get_summary(comp_ocid,cluster_name,ocicore)
@@ -152,7 +135,7 @@ if CN != "CC":
         ipa_ocid = cn_ocid
 
 ocicluster = ocicluster(comp_ocid, cn_ocid, CN, cluster_name, username, inventory, hostfile, \
-                        playbooks_dir, slurm_name_change, hostname_convention, autoscaling)
+                        playbooks_dir, slurm_name_change, hostname_convention, autoscaling, cache_ttl)
 
 if args.mode == 'list':
     state = cn_summary.lifecycle_state
@@ -161,32 +144,30 @@ if args.mode == 'list':
     for cn_instance in cn_instances:
         print(cn_instance['display_name']+' '+cn_instance['ip']+' '+cn_instance['ocid'])
 elif args.mode == 'reconfigure':
+    # Nodes may have been changed outside of this script, e.g. terminated from the console
+    invalidate_instances(cn_ocid)
     if len(hostnames)>0:
         add_reconfigure(ocicluster,ocicore,specific_hosts=hostnames)
     else:
         reconfigure(ocicluster,ocicore,crucial=ansible_crucial)
 else:
     wait_for_running_status(ocicluster,ocicore)
+    # Changes to the cluster start from the current list of nodes, not from the cache
+    invalidate_instances(cn_ocid)
     cn_instances = get_instances(ocicluster, ocicore)
     inventory_instances =[]
     only_inventory_instance=[]
     if dns_entries:
         zone_id=ocicore.dns_client.list_zones(compartment_id=vcn_compartment,name=zone_name,zone_type="PRIMARY",scope="PRIVATE").data[0].id
-    for line in inventory_dict['compute_configured']:
-        host=line.split('ansible_host=')[0].strip()
-        ip=line.split("ansible_host=")[1].split("ansible_user=")[0].strip()
-        inventory_instances.append({'display_name':host,'ip':ip,'ocid':None})
-        if not host in [i['display_name'] for i in cn_instances]:
-            ip=line.split("ansible_host=")[1].split("ansible_user=")[0].strip()
-            print("STDOUT: "+host+" with IP: "+ip+" is in the inventory but not in the cluster")
-            only_inventory_instance.append({'display_name':host,'ip':ip,'ocid':None})
-    for line in inventory_dict['compute_to_add']:
-        host=line.split('ansible_host=')[0].strip()
-        ip=line.split("ansible_host=")[1].split("ansible_user=")[0].strip()
-        inventory_instances.append({'display_name':host,'ip':ip,'ocid':None})
-        if not host in [i['display_name'] for i in cn_instances]:
-            print("STDOUT: "+host+" with IP: "+ip+" is in the inventory but not in the cluster")
-            only_inventory_instance.append({'display_name':host,'ip':ip,'ocid':None})
+    cn_instance_names=set([i['display_name'] for i in cn_instances])
+    for section in ['compute_configured','compute_to_add']:
+        for inventory_host in hosts_inventory[section]:
+            host=inventory_host.name
+            ip=inventory_host.ip
+            inventory_instances.append({'display_name':host,'ip':ip,'ocid':None})
+            if not host in cn_instance_names:
+                print("STDOUT: "+host+" with IP: "+ip+" is in the inventory but not in the cluster")
+                only_inventory_instance.append({'display_name':host,'ip':ip,'ocid':None})
     if args.mode == 'remove_unreachable':
         if len(hostnames) == 0:
             reachable_instances,unreachable_instances=getreachable(cn_instances+only_inventory_instance,ocicluster,delay=10)
@@ -247,19 +228,42 @@ else:
                     exit(1)
                 else:
                     print("STDOUT: Force deleting the nodes")
-        terminated_instances=0
         cn_summary,ip_summary,CN = get_summary(comp_ocid,cluster_name,ocicore)
         if CN != "CC":
             current_size = ip_summary.size
-        for instanceName in hostnames_to_remove:
+
+        # Detaches of the same instance pool conflict with each other (409), they are submitted one at a time
+        detach_lock = threading.Lock()
+        failed_terminations = {}
+
+        def terminate_instance(instanceName):
+            # Only submit the termination, all of them are waited for together
             try:
-                instance_id = ocicore.computeClient.list_instances(comp_ocid,display_name=instanceName).data[0].id
+                instances = ocicore.computeClient.list_instances(comp_ocid,display_name=instanceName,retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY).data
+                if not len(instances):
+                    print("STDOUT: The instance "+instanceName+" does not exist")
+                    return None
+                instance_id = instances[0].id
+                work_request_id = None
                 if CN == "CC":
-                    ocicore.ComputeClientCompositeOperations.terminate_instance_and_wait_for_state(instance_id,wait_for_states=["TERMINATING","TERMINATED"])
+                    ocicore.computeClient.terminate_instance(instance_id,retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
                 else:
                     instance_details = oci.core.models.DetachInstancePoolInstanceDetails(instance_id=instance_id,is_auto_terminate=True,is_decrement_size=True)
-                    ocicore.ComputeManagementClientCompositeOperations.detach_instance_pool_instance_and_wait_for_work_request(ipa_ocid,instance_details)
-                if dns_entries:
+                    with detach_lock:
+                        work_request_id = ocicore.computeManagementClient.detach_instance_pool_instance(ipa_ocid,instance_details,retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY).headers['opc-work-request-id']
+            except oci.exceptions.ServiceError as e:
+                if e.status == 404:
+                    print("STDOUT: The instance "+instanceName+" does not exist")
+                else:
+                    print("STDOUT: The instance "+instanceName+" could not be terminated: "+str(e.status)+" "+str(e.code)+" "+str(e.message))
+                    failed_terminations[instanceName]=e
+                return None
+            except Exception as e:
+                print("STDOUT: The instance "+instanceName+" could not be terminated: "+str(e))
+                failed_terminations[instanceName]=e
+                return None
+            if dns_entries:
+                try:
                     get_rr_set_response = ocicore.dns_client.delete_rr_set(zone_name_or_id=zone_id,domain=instanceName+"."+zone_name,rtype="A",scope="PRIVATE")
                     ip=None
                     for i in cn_instances:
@@ -269,28 +273,32 @@ else:
                         index = list(private_subnet_cidr.hosts()).index(ip)+2
                         slurm_name=hostname_convention+"-"+str(index)+"."+zone_name
                         get_rr_set_response = ocicore.dns_client.delete_rr_set(zone_name_or_id=zone_id,domain=slurm_name,rtype="A",scope="PRIVATE")
-                terminated_instances = terminated_instances + 1
-                print("STDOUT: The instance "+instanceName+" is terminating")
-            except:
-                print("STDOUT: The instance "+instanceName+" does not exist")
+                except Exception as e:
+                    print("STDOUT: The DNS entries of "+instanceName+" could not be deleted: "+str(e))
+            print("STDOUT: The instance "+instanceName+" is terminating")
+            return instance_id,work_request_id
+
+        with ThreadPoolExecutor(max_workers=min(api_workers,hostnames_to_remove_len)) as executor:
+            terminations = [termination for termination in executor.map(terminate_instance,hostnames_to_remove) if not termination is None]
+        terminated_instances=len(terminations)
+        if CN == "CC":
+            not_terminated = wait_for_terminations(ocicore,[instance_id for instance_id,work_request_id in terminations],[])
+        else:
+            not_terminated = wait_for_terminations(ocicore,[],[work_request_id for instance_id,work_request_id in terminations])
+        if len(not_terminated):
+            print("STDOUT: "+str(len(not_terminated))+" of the "+str(terminated_instances)+" terminations did not complete")
+        invalidate_instances(cn_ocid)
         cn_summary,ip_summary,CN = get_summary(comp_ocid,cluster_name,ocicore)
         if CN == "CC":
-            instance_id = ocicore.computeClient.list_instances(comp_ocid,display_name=hostnames_to_remove[-1]).data[0].id
-            for i in range(10):
-                try:
-                    instance_state = ocicore.computeClient.get_instance(instance_id).data.lifecycle_state
-                    if instance_state == "TERMINATED":
-                        break
-                    else:
-                        time.sleep(10)
-                except:
-                    break
             cn_instances = get_instances(ocicluster,ocicore)
             newsize=len(cn_instances)
         else:
             newsize=ip_summary.size
             updateTFState(inventory,cluster_name,newsize)
         print("STDOUT: Resized to "+str(newsize)+" instances")
+        if len(failed_terminations):
+            print("STDOUT: "+str(len(failed_terminations))+" instances could not be terminated and are still running: "+" ".join(failed_terminations.keys()))
+            exit(1)
 #        if error_code != 0 and force:
 #            print("STDOUT: The nodes were forced deleted, trying to reconfigure the left over nodes")
 #            reconfigure(comp_ocid,cn_ocid,inventory,CN)
@@ -302,20 +310,25 @@ else:
             if len(cn_instances) == 0:
                 print("STDOUT: The resize script cannot work for a compute cluster if the size is there is no node in the cluster")
             else:
+                max_index=-1
                 for cn_instance in cn_instances:
-                    max_index=-1
                     if int(cn_instance['display_name'].split('-')[-1]) > max_index:
                         max_index=int(cn_instance['display_name'].split('-')[-1])
                 instance=ocicore.computeClient.get_instance(cn_instances[0]['ocid']).data
                 print("STDOUT: Provisioning instances")
-                for i in range(args.number):
-                    launch_instance_details=getLaunchInstanceDetails(instance,comp_ocid,cn_ocid,max_index,i)
-                    ocicore.ComputeClientCompositeOperations.launch_instance_and_wait_for_state(launch_instance_details,wait_for_states=["RUNNING"])
+                vnic_attachment=get_instance_primary_vnic_attachment(instance,comp_ocid,ocicore)
+                launch_instance_details_list=[getLaunchInstanceDetails(instance,comp_ocid,cn_ocid,max_index,i,vnic_attachment) for i in range(args.number)]
+                launched_instances,failed_instances=launch_instances(ocicore,launch_instance_details_list)
+                for instanceName in launched_instances:
+                    print("STDOUT: The instance "+instanceName+" is running")
+                for instanceName,reason in failed_instances.items():
+                    print("STDOUT: The instance "+instanceName+" could not be launched: "+str(reason))
         else:
             size = current_size - hostnames_to_remove_len + args.number
             update_size = oci.core.models.UpdateInstancePoolDetails(size=size)
             print("STDOUT: Provisioning instances")
             ocicore.ComputeManagementClientCompositeOperations.update_instance_pool_and_wait_for_state(ipa_ocid,update_size,['RUNNING'],waiter_kwargs={'max_wait_seconds':3600})
+        invalidate_instances(cn_ocid)
         cn_summary,ip_summary,CN = get_summary(comp_ocid,cluster_name,ocicore)
         if CN == "CC":
             new_cn_instances = get_instances(ocicluster,ocicore)
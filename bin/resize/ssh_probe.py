@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+ssh_key="~/.ssh/cluster.key"
+probe_workers=64
+connect_timeout=5
+host_deadline=20
+
+def tcp_check(host,port=22,timeout=connect_timeout):
+    """ Return None if a TCP connection can be opened on the port, the error message otherwise """
+    try:
+        sock = socket.create_connection((host,port),timeout=timeout)
+        sock.close()
+        return None
+    except (OSError,socket.timeout) as e:
+        return str(e)
+
+def probe_host(host,username,timeout=connect_timeout,deadline=host_deadline):
+    """
+    Check that a host answers on port 22 and accepts an SSH session running uptime.
+    Args:
+        host: IP or hostname to check.
+        username: user to connect with.
+        timeout: timeout in seconds of the TCP and SSH connections.
+        deadline: maximum time in seconds spent on the host.
+    Returns:
+        A dictionary with the host, whether it is reachable, the latency in seconds and the error if it is not.
+    """
+    start = time.time()
+    result = {'host':host,'reachable':False,'latency':None,'error':None}
+    error = tcp_check(host,timeout=min(timeout,deadline))
+    if error is not None:
+        result['error']="tcp/22: "+error
+        result['latency']=round(time.time()-start,3)
+        return result
+    remaining = max(deadline-(time.time()-start),1)
+    # Parallel probes must not write to ~/.ssh/known_hosts at the same time, they do not record the host keys
+    command = ["ssh","-i",os.path.expanduser(ssh_key),"-o","StrictHostKeyChecking=no","-o","UserKnownHostsFile=/dev/null","-o","LogLevel=ERROR","-o","BatchMode=yes","-o","ConnectTimeout="+str(int(min(timeout,remaining))),username+"@"+host,"uptime"]
+    try:
+        p = subprocess.run(command,stdout=subprocess.PIPE,stderr=subprocess.PIPE,universal_newlines=True,timeout=remaining)
+        if p.returncode == 0 and "load" in p.stdout:
+            result['reachable']=True
+        else:
+            result['error']="ssh: "+(p.stderr.strip().split("\n")[-1] if p.stderr.strip() else "return code "+str(p.returncode))
+    except subprocess.TimeoutExpired:
+        result['error']="ssh: deadline of "+str(deadline)+"s exceeded"
+    result['latency']=round(time.time()-start,3)
+    return result
+
+def probe_hosts(hosts,username,workers=probe_workers,timeout=connect_timeout,deadline=host_deadline,callback=None):
+    """
+    Probe hosts in parallel.
+    Args:
+        hosts: list of IPs or hostnames.
+        username: user to connect with.
+        workers: maximum number of hosts probed at the same time.
+        timeout: timeout in seconds of the TCP and SSH connections.
+        deadline: maximum time in seconds spent on each host.
+        callback: function called with each result as soon as it is available.
+    Returns:
+        A dictionary with the result of each host.
+    """
+    results={}
+    hosts=list(dict.fromkeys(hosts))
+    if not len(hosts):
+        return results
+    with ThreadPoolExecutor(max_workers=min(workers,len(hosts))) as executor:
+        futures=[executor.submit(probe_host,host,username,timeout,deadline) for host in hosts]
+        for future in as_completed(futures):
+            result=future.result()
+            results[result['host']]=result
+            if callback is not None:
+                callback(result)
+    return results
+
+def wait_for_hosts(hosts,username,retries=10,interval=30,workers=probe_workers,timeout=connect_timeout,deadline=host_deadline,callback=None):
+    """
+    Probe hosts until all of them are reachable, only checking again the hosts that were not.
+    Args:
+        hosts: list of IPs or hostnames.
+        username: user to connect with.
+        retries: number of additional rounds for the hosts that are not reachable yet.
+        interval: time in seconds between two rounds.
+    Returns:
+        A dictionary with the last result of each host.
+    """
+    results={}
+    pending=list(dict.fromkeys(hosts))
+    for attempt in range(retries+1):
+        results.update(probe_hosts(pending,username,workers=workers,timeout=timeout,deadline=deadline,callback=callback))
+        pending=[host for host in pending if not results[host]['reachable']]
+        if not len(pending) or attempt == retries:
+            break
+        print("Still waiting for "+str(len(pending))+" hosts: "+" ".join(pending))
+        sys.stdout.flush()
+        time.sleep(interval)
+    return results
+
+def print_probe(result):
+    if result['reachable']:
+        print("validating connection to: "+result['host']+" reachable in "+str(result['latency'])+"s")
+    else:
+        print("validating connection to: "+result['host']+" unreachable after "+str(result['latency'])+"s ("+str(result['error'])+")")
+    sys.stdout.flush()
+
+def print_result(result):
+    print(json.dumps(result))
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check in parallel which hosts are reachable with SSH. Results are printed as one JSON object per line as they arrive')
+    parser.add_argument('hostfile', help='File with one IP or hostname per line')
+    parser.add_argument('--username', help='User to connect with',default=os.environ.get('USER','opc'))
+    parser.add_argument('--output', help='If present, the reachable hosts are written to this file, one per line')
+    parser.add_argument('--wait', help='If present, keep checking the hosts that are not reachable yet',action='store_true',default=False)
+    parser.add_argument('--retries', type=int, help='Number of additional rounds in wait mode',default=10)
+    parser.add_argument('--interval', type=int, help='Seconds between two rounds in wait mode',default=30)
+    parser.add_argument('--workers', type=int, help='Maximum number of hosts probed at the same time',default=probe_workers)
+    parser.add_argument('--timeout', type=int, help='Timeout in seconds of the TCP and SSH connections',default=connect_timeout)
+    parser.add_argument('--deadline', type=int, help='Maximum time in seconds spent on each host',default=host_deadline)
+    parser.add_argument('--strict', help='If present, exit with status 1 when at least one host is unreachable. The status is 0 otherwise, like the shell wrappers always returned',action='store_true',default=False)
+    args = parser.parse_args()
+
+    hosts=[]
+    with open(args.hostfile) as f:
+        for line in f:
+            if line.strip():
+                hosts.append(line.strip())
+    if args.wait:
+        results=wait_for_hosts(hosts,args.username,retries=args.retries,interval=args.interval,workers=args.workers,timeout=args.timeout,deadline=args.deadline,callback=print_result)
+    else:
+        results=probe_hosts(hosts,args.username,workers=args.workers,timeout=args.timeout,deadline=args.deadline,callback=print_result)
+    reachable=[host for host in hosts if results[host]['reachable']]
+    unreachable=[host for host in hosts if not results[host]['reachable']]
+    if args.output is not None:
+        with open(args.output,'w') as f:
+            for host in reachable:
+                f.write(host+"\n")
+    print(json.dumps({'reachable':reachable,'unreachable':unreachable}))
+    if args.strict and len(unreachable):
+        exit(1)
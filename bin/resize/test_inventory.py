@@ -0,0 +1,48 @@
+import os
+import re
+import tempfile
+import unittest
+from inventory import Inventory, InventoryHost
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","..","inventory.tpl")
+
+def render_template():
+    """ inventory.tpl as written by the stack, with two compute nodes and quoted values that contain spaces """
+    with open(TEMPLATE) as f:
+        text = f.read()
+    text = re.sub(r"%\{ for host, ip in compute ~\}\n(.*\n)%\{ endfor ~\}\n",lambda match: match.group(1).replace("${host}","compute-1").replace("${ip}","172.16.0.2")+match.group(1).replace("${host}","compute-2").replace("${ip}","172.16.0.3"),text)
+    text = re.sub(r"%\{ if [^}]* \}(.*?)%\{ endif \}",r"\1",text)
+    values = {"cluster_name": "cluster-1", "admin_password": "\"secret with spaces\"", "nfs_options": "'rw, noatime'", "scratch_nfs": "true"}
+    return re.sub(r"\$\{(\w+)\}",lambda match: values.get(match.group(1),match.group(1)+"_value"),text)
+
+class InventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.text = render_template()
+        fd,self.path = tempfile.mkstemp()
+        with os.fdopen(fd,"w") as f:
+            f.write(self.text)
+        self.inventory = Inventory.load(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        self.assertEqual(self.inventory.render(),self.text)
+
+    def test_vars(self):
+        self.assertEqual(self.inventory.get_var("cluster_name"),"cluster-1")
+        self.assertEqual(self.inventory.get_var("scratch_nfs"),"true")
+        self.assertEqual(self.inventory.get_var("admin_password"),"\"secret with spaces\"")
+        self.assertEqual(self.inventory.get_var("ansible_connection"),"ssh")
+        self.assertEqual(len(self.inventory["all:vars"]),0)
+
+    def test_changed_hosts(self):
+        self.inventory["compute_configured"].remove_ip("172.16.0.2")
+        self.inventory["compute_to_add"].add(InventoryHost("compute-3",[("ansible_host","172.16.0.4"),("ansible_user","opc"),("role","compute")]))
+        text = self.inventory.render()
+        self.assertNotIn("compute-1 ",text)
+        self.assertIn("[compute_to_add]\ncompute-3 ansible_host=172.16.0.4 ansible_user=opc role=compute\n",text)
+        self.assertEqual(text.split("[all:vars]")[1],self.text.split("[all:vars]")[1])
+
+if __name__ == '__main__':
+    unittest.main()
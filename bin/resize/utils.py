@@ -7,7 +7,11 @@ import os
 import copy
 import ipaddress
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from ociobj import ocicore, ocicluster
+from inventory_cache import get_cached_instances, set_cached_instances
+from ssh_probe import wait_for_hosts, print_probe
+from inventory import Inventory
 
 def get_metadata():
     """ Make a request to metadata endpoint """
@@ -41,63 +45,59 @@ def wait_for_running_status(ocicluster,ocicore,expected_size=None):
             break
     return True
 
+# Maximum number of OCI API calls running at the same time when resolving the instances
+api_workers=16
+
+def get_primary_vnic_attachments(ocicluster,ocicore):
+    """ List the VNIC attachments of the whole compartment once and index the primary ones by instance OCID """
+    vnic_attachments={}
+    try:
+        for vnic_attachment in oci.pagination.list_call_get_all_results(ocicore.computeClient.list_vnic_attachments,compartment_id=ocicluster.comp_ocid,retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY).data:
+            if vnic_attachment.display_name is None and vnic_attachment.lifecycle_state != "DETACHED":
+                vnic_attachments[vnic_attachment.instance_id]=vnic_attachment
+    except Exception as e:
+        print("The VNIC attachments of the compartment could not be listed, falling back to one call per instance: "+str(e))
+    return vnic_attachments
+
+def get_instance_vnic(instance_id,display_name,lifecycle_state,vnic_attachment,ocicluster,ocicore):
+    try:
+        if vnic_attachment is None:
+            # The instance may be too recent to be in the compartment wide list
+            for potential_vnic_attachment in oci.pagination.list_call_get_all_results(ocicore.computeClient.list_vnic_attachments,compartment_id=ocicluster.comp_ocid,instance_id=instance_id,retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY).data:
+                if potential_vnic_attachment.display_name is None:
+                    vnic_attachment = potential_vnic_attachment
+        vnic = ocicore.virtualNetworkClient.get_vnic(vnic_attachment.vnic_id,retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY).data
+    except:
+        return None
+    return {'display_name':display_name,'ip':vnic.private_ip,'ocid':instance_id,'lifecycle_state':lifecycle_state}
+
 def get_instances(ocicluster,ocicore):
-    cn_instances=[]
+    cached_instances = get_cached_instances(ocicluster.cn_ocid,ocicluster.cache_ttl)
+    # validation.py caches the instances without their IP
+    if not cached_instances is None and all(not i['ip'] is None for i in cached_instances):
+        return [{'display_name':i['display_name'],'ip':i['ip'],'ocid':i['ocid']} for i in cached_instances]
+    instances_to_resolve=[]
     if ocicluster.CN == "CC":
-        instances = ocicore.computeClient.list_instances(ocicluster.comp_ocid,compute_cluster_id=ocicluster.cn_ocid).data
+        instances = oci.pagination.list_call_get_all_results(ocicore.computeClient.list_instances,ocicluster.comp_ocid,compute_cluster_id=ocicluster.cn_ocid,retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY).data
         for instance in instances:
             if instance.lifecycle_state == "TERMINATED":
                 continue
-            try:
-                for potential_vnic_attachment in oci.pagination.list_call_get_all_results(ocicore.computeClient.list_vnic_attachments,compartment_id=ocicluster.comp_ocid,instance_id=instance.id).data:
-                    if potential_vnic_attachment.display_name is None:
-                        vnic_attachment = potential_vnic_attachment
-                vnic = ocicore.virtualNetworkClient.get_vnic(vnic_attachment.vnic_id).data
-            except:
-                continue
-            cn_instances.append({'display_name':instance.display_name,'ip':vnic.private_ip,'ocid':instance.id})
+            instances_to_resolve.append((instance.id,instance.display_name,instance.lifecycle_state))
     else:
         if ocicluster.CN == "CN":
-            instance_summaries = oci.pagination.list_call_get_all_results(ocicore.computeManagementClient.list_cluster_network_instances,ocicluster.comp_ocid,ocicluster.cn_ocid).data
+            instance_summaries = oci.pagination.list_call_get_all_results(ocicore.computeManagementClient.list_cluster_network_instances,ocicluster.comp_ocid,ocicluster.cn_ocid,retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY).data
         else:
-            instance_summaries = oci.pagination.list_call_get_all_results(ocicore.computeManagementClient.list_instance_pool_instances,ocicluster.comp_ocid,ocicluster.cn_ocid).data
+            instance_summaries = oci.pagination.list_call_get_all_results(ocicore.computeManagementClient.list_instance_pool_instances,ocicluster.comp_ocid,ocicluster.cn_ocid,retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY).data
         for instance_summary in instance_summaries:
-            try:
-                instance = ocicore.computeClient.get_instance(instance_summary.id).data
-                for potential_vnic_attachment in oci.pagination.list_call_get_all_results(ocicore.computeClient.list_vnic_attachments,compartment_id=ocicluster.comp_ocid,instance_id=instance.id).data:
-                    if potential_vnic_attachment.display_name is None:
-                        vnic_attachment = potential_vnic_attachment
-                vnic = ocicore.virtualNetworkClient.get_vnic(vnic_attachment.vnic_id).data
-            except:
-                continue
-            cn_instances.append({'display_name':instance_summary.display_name,'ip':vnic.private_ip,'ocid':instance_summary.id})
-    return cn_instances
-
-def parse_inventory(inventory):
-    try:
-        inv = open(inventory,"r")
-    except:
-        return None
-    inventory_dict = {}
-    current_section = None
-    for line in inv:
-        if line.strip().startswith("[") and line.strip().endswith("]"):
-            current_section=line.split('[')[1].split(']')[0]
-            if not current_section in inventory_dict.keys():
-                inventory_dict[current_section]=[]
-        else:
-            if not current_section is None:
-                inventory_dict[current_section].append(line)
-    inv.close()
-    return inventory_dict
-
-def write_inventory(dict,inventory):
-    inv = open(inventory,"w")
-    for section in dict.keys():
-        inv.write("["+section+"]\n")
-        for line in dict[section]:
-            inv.write(line)
-    inv.close()
+            instances_to_resolve.append((instance_summary.id,instance_summary.display_name,instance_summary.state))
+    cn_instances=[]
+    if len(instances_to_resolve) > 0:
+        vnic_attachments = get_primary_vnic_attachments(ocicluster,ocicore)
+        with ThreadPoolExecutor(max_workers=min(api_workers,len(instances_to_resolve))) as executor:
+            futures = [executor.submit(get_instance_vnic,instance_id,display_name,lifecycle_state,vnic_attachments.get(instance_id),ocicluster,ocicore) for instance_id,display_name,lifecycle_state in instances_to_resolve]
+            cn_instances = [instance for instance in (future.result() for future in futures) if not instance is None]
+    set_cached_instances(ocicluster.cn_ocid,cn_instances)
+    return [{'display_name':i['display_name'],'ip':i['ip'],'ocid':i['ocid']} for i in cn_instances]
 
 def remove_ip(filename,iplist):
     tmp_filename=os.path.join('/tmp',os.path.basename(filename))
@@ -137,15 +137,10 @@ def backup_inventory(inventory):
         shutil.move(tmp_file_do_not_edit,inventory)
 
 def getNFSnode(inventory):
-    dict = parse_inventory(inventory)
-    if dict is None:
+    hosts_inventory = Inventory.load(inventory)
+    if hosts_inventory is None or len(hosts_inventory['nfs']) == 0:
         return ''
-    if len(dict['nfs']) == 0:
-        return ''
-    if dict['nfs'][0] == '\n':
-        return ''
-    else:
-        return dict['nfs'][0].split()[0]
+    return hosts_inventory['nfs'].names()[0]
 
 def get_summary(comp_ocid,cluster_name,ocicore):
     CN = "CN"
@@ -237,14 +232,19 @@ def updateTFState(inventory,cluster_name,size):
     except:
         return 0
     
-def getLaunchInstanceDetails(instance,comp_ocid,cn_ocid,max_previous_index,index,ocicore):
+def get_instance_primary_vnic_attachment(instance,comp_ocid,ocicore):
+    """ Primary VNIC attachment of the instance used as a template, looked up once for all the launches """
+    vnic_attachment = None
+    for potential_vnic_attachment in oci.pagination.list_call_get_all_results(ocicore.computeClient.list_vnic_attachments,compartment_id=comp_ocid,instance_id=instance.id,retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY).data:
+        if potential_vnic_attachment.display_name is None:
+            vnic_attachment = potential_vnic_attachment
+    return vnic_attachment
+
+def getLaunchInstanceDetails(instance,comp_ocid,cn_ocid,max_previous_index,index,vnic_attachment):
 
     agent_config=instance.agent_config
     agent_config.__class__ = oci.core.models.LaunchInstanceAgentConfigDetails
 
-    for potential_vnic_attachment in oci.pagination.list_call_get_all_results(ocicore.computeClient.list_vnic_attachments,compartment_id=comp_ocid,instance_id=instance.id).data:
-        if potential_vnic_attachment.display_name is None:
-            vnic_attachment = potential_vnic_attachment
     splitted_name=instance.display_name.split('-')
     create_vnic_details=oci.core.models.CreateVnicDetails(assign_public_ip=False,subnet_id=vnic_attachment.subnet_id)
 
@@ -260,46 +260,108 @@ def getLaunchInstanceDetails(instance,comp_ocid,cn_ocid,max_previous_index,index
     launch_instance_details=oci.core.models.LaunchInstanceDetails(agent_config=agent_config,availability_domain=instance.availability_domain, compartment_id=comp_ocid,compute_cluster_id=cn_ocid,shape=instance.shape,shape_config=launchInstanceShapeConfigDetails,source_details=instance.source_details,metadata=instance.metadata,display_name=new_display_name,freeform_tags=instance.freeform_tags,create_vnic_details=create_vnic_details)
     return launch_instance_details
 
+def launch_instances(ocicore,launch_instance_details_list,max_wait_seconds=3600,interval=30):
+    """
+    Submit all the launches at once and wait for them together.
+    Args:
+        launch_instance_details_list: list of LaunchInstanceDetails, one per instance.
+        max_wait_seconds: maximum time to wait for all the instances to be RUNNING.
+    Returns:
+        The list of display names of the RUNNING instances and a dictionary with the reason of each failed launch.
+    """
+    failed={}
+    def submit_launch(launch_instance_details):
+        try:
+            # No retries, a capacity error should be reported right away rather than retried for minutes
+            return ocicore.computeClient.launch_instance(launch_instance_details,retry_strategy=oci.retry.NoneRetryStrategy()).data.id
+        except oci.exceptions.ServiceError as e:
+            failed[launch_instance_details.display_name]=e.message
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1,min(api_workers,len(launch_instance_details_list)))) as executor:
+        instance_ids=list(executor.map(submit_launch,launch_instance_details_list))
+    pending={instance_id:launch_instance_details.display_name for instance_id,launch_instance_details in zip(instance_ids,launch_instance_details_list) if not instance_id is None}
+
+    def get_instance_state(instance_id):
+        try:
+            return ocicore.computeClient.get_instance(instance_id,retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY).data.lifecycle_state
+        except oci.exceptions.ServiceError:
+            return None
+
+    launched=[]
+    start = time.time()
+    while len(pending):
+        with ThreadPoolExecutor(max_workers=min(api_workers,len(pending))) as executor:
+            states=dict(zip(pending.keys(),executor.map(get_instance_state,pending.keys())))
+        for instance_id,state in states.items():
+            if state == "RUNNING":
+                launched.append(pending.pop(instance_id))
+            elif state in ["TERMINATING","TERMINATED"]:
+                failed[pending.pop(instance_id)]="The instance went to "+state+" while launching"
+        if not len(pending):
+            break
+        if time.time()-start > max_wait_seconds:
+            for instance_id in list(pending.keys()):
+                failed[pending.pop(instance_id)]="The instance is not RUNNING after "+str(max_wait_seconds)+" seconds"
+            break
+        time.sleep(interval)
+    return launched,failed
+
+def wait_for_terminations(ocicore,instance_ids,work_request_ids,max_wait_seconds=1200,interval=10):
+    """
+    Wait for a set of terminations submitted at the same time.
+    Args:
+        instance_ids: OCIDs of the instances terminated directly (Compute Cluster), to wait until they are TERMINATED.
+        work_request_ids: OCIDs of the detach work requests (Instance Pool or Cluster Network), to wait until they are finished.
+        max_wait_seconds: maximum time to wait for all of them.
+    Returns:
+        The list of instance and work request OCIDs that did not complete successfully.
+    """
+    def get_instance_state(instance_id):
+        try:
+            return ocicore.computeClient.get_instance(instance_id,retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY).data.lifecycle_state == "TERMINATED"
+        except oci.exceptions.ServiceError as e:
+            return e.status == 404
+    def get_work_request_state(work_request_id):
+        try:
+            status = ocicore.workRequestClient.get_work_request(work_request_id,retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY).data.status
+        except oci.exceptions.ServiceError:
+            return False
+        if status in ["FAILED","CANCELED"]:
+            print("STDOUT: The work request "+work_request_id+" is "+status)
+            failed.append(work_request_id)
+            return True
+        return status == "SUCCEEDED"
+
+    pending = [(get_instance_state,instance_id) for instance_id in instance_ids]+[(get_work_request_state,work_request_id) for work_request_id in work_request_ids]
+    failed = []
+    start = time.time()
+    while len(pending):
+        with ThreadPoolExecutor(max_workers=min(api_workers,len(pending))) as executor:
+            done = list(executor.map(lambda check: check[0](check[1]),pending))
+        pending = [check for check,is_done in zip(pending,done) if not is_done]
+        if not len(pending):
+            break
+        if time.time()-start > max_wait_seconds:
+            print("STDOUT: "+str(len(pending))+" terminations did not complete after "+str(max_wait_seconds)+" seconds")
+            break
+        time.sleep(interval)
+    return failed+[check[1] for check in pending]
+
 def getreachable(instances,ocicluster,delay=0):
     if delay == 0 :
         delays=[0]
     else:
         delays=range(0,delay,int(delay/1))#change 1 back to 10
-    
-    reachable_ips=[]
-    for i in delays:
-        input_file=open('/tmp/input_hosts_to_check_'+ocicluster.cluster_name,'w')
-        for node in instances:
-            if not node['ip'] in reachable_ips:
-                input_file.write(node['ip']+"\n")
-        input_file.close()
-        my_env = os.environ.copy()
-        my_env["ANSIBLE_HOST_KEY_CHECKING"] = "False"
-        p = subprocess.Popen(["/opt/oci-hpc/bin/find_reachable_hosts.sh","/tmp/input_hosts_to_check_"+ocicluster.cluster_name,"/tmp/reachable_hosts_"+ocicluster.cluster_name,ocicluster.username,"0"],env=my_env,stderr = subprocess.PIPE, stdout=subprocess.PIPE)
-        while True:
-            output = p.stdout.readline().decode()
-            if output == '' and p.poll() is not None:
-                break
-            if output:
-                print(output.strip())
-        output_file=open('/tmp/reachable_hosts_'+ocicluster.cluster_name,'r')
-        for line in output_file:
-            reachable_ips.append(line.strip())
-        output_file.close()
-        if len(instances)==len(reachable_ips):
-            break
-        if i != delays[-1]:
-            time.sleep(int(delay/10))
+
+    print("Checking For SSH")
+    results=wait_for_hosts([node['ip'] for node in instances],ocicluster.username,retries=len(delays)-1,interval=int(delay/10),callback=print_probe)
     reachable_instances=[]
     unreachable_instances=[]
-    for ip in reachable_ips:
-        added=False
-        for node in instances:
-            if node['ip']==ip:
-                reachable_instances.append(node)
-                added=True
     for node in instances:
-        if not node in reachable_instances:
+        if results[node['ip']]['reachable']:
+            reachable_instances.append(node)
+        else:
             unreachable_instances.append(node)
     return reachable_instances,unreachable_instances
 
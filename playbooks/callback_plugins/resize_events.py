@@ -0,0 +1,89 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    name: resize_events
+    type: aggregate
+    short_description: Write one JSON line per task result with its duration
+    description:
+      - Used by the resize scripts to know which hosts failed and which tasks are slow.
+      - The events are written to the file given by the RESIZE_EVENTS_FILE environment variable as they happen.
+    requirements:
+      - enable in configuration
+'''
+
+import json
+import os
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+
+class CallbackModule(CallbackBase):
+
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'resize_events'
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self.events_file = None
+        path = os.environ.get('RESIZE_EVENTS_FILE')
+        if path:
+            try:
+                self.events_file = open(path, 'a')
+            except (IOError, OSError) as e:
+                self._display.warning("resize_events: cannot open %s: %s" % (path, e))
+        self.play = None
+        self.task_start = {}
+        self.host_start = {}
+
+    def _write(self, event):
+        if self.events_file is None:
+            return
+        event['time'] = time.time()
+        self.events_file.write(json.dumps(event) + "\n")
+        self.events_file.flush()
+
+    def _result(self, status, result, ignore_errors=False):
+        host = result._host.get_name()
+        task = result._task
+        start = self.host_start.pop((host, task._uuid), self.task_start.get(task._uuid, time.time()))
+        self._write({'event': 'result', 'status': status, 'host': host, 'play': self.play, 'task': task.get_name(),
+                     'action': task.action, 'duration': round(time.time() - start, 3), 'ignore_errors': ignore_errors})
+
+    def v2_playbook_on_play_start(self, play):
+        self.play = play.get_name()
+        self._write({'event': 'play_start', 'play': self.play})
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self.task_start[task._uuid] = time.time()
+        self._write({'event': 'task_start', 'play': self.play, 'task': task.get_name()})
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self.v2_playbook_on_task_start(task, False)
+
+    def v2_runner_on_start(self, host, task):
+        self.host_start[(host.get_name(), task._uuid)] = time.time()
+
+    def v2_runner_on_ok(self, result):
+        self._result('ok', result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._result('failed', result, ignore_errors)
+
+    def v2_runner_on_unreachable(self, result):
+        self._result('unreachable', result, result._task.ignore_unreachable)
+
+    def v2_runner_on_skipped(self, result):
+        self._result('skipped', result)
+
+    def v2_playbook_on_stats(self, stats):
+        hosts = {}
+        for host in sorted(stats.processed.keys()):
+            hosts[host] = stats.summarize(host)
+        self._write({'event': 'stats', 'hosts': hosts})
+        if self.events_file is not None:
+            self.events_file.close()
+            self.events_file = None
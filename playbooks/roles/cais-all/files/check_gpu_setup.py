@@ -3,7 +3,8 @@
 # dependencies = [
 #   "requests",
 #   "psutil",
-#   "distro"
+#   "distro",
+#   "pynvml"
 # ]
 # ///
 
@@ -38,6 +39,10 @@ Usage:
 - The script can be run with specific arguments to perform individual checks.
   Example: `python3 check_gpu_setup.py --gpucount` (runs only the GPU count check).
   Use the `--help` flag to see all available options.
+- The checks run concurrently, each one once the checks it depends on are done (e.g. the RDMA
+  checks wait for the OCA state), with a limit per resource class (GPU, RDMA, host).
+  Checks not completed after `--deadline` seconds are reported as timed out.
+- `--json <file>` writes a report of the checks with their status, timings and results.
 
 ===========================================================================================
 """
@@ -46,6 +51,7 @@ import subprocess
 import re
 import argparse
 from gpu_bw_test import BandwidthTest
+from gpu_snapshot import GpuSnapshot, get_snapshot
 from rdma_link_flapping import LinkFlappingTest
 from xid_checker import XidChecker
 import platform
@@ -54,6 +60,9 @@ import requests
 import json
 import time
 import sys
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import socket
 import psutil
 
@@ -67,6 +76,9 @@ else:
 from shared_logging import logger
 
 SMI_TIMEOUT_SEC = 10
+# Devices probed at the same time by the RDMA checks and how long a probe of one device can take
+PROBE_WORKERS = 8
+PROBE_TIMEOUT_SEC = 30
 
 #Section 0: Common Functions for all Health Checks.
 ###################################################
@@ -107,6 +119,26 @@ def get_devices():
     
     return shape_devices.get(shape, [])
 
+# Run a command on each device or interface at the same time, with at most PROBE_WORKERS commands running.
+# Returns the CompletedProcess of each device in the order of the devices, or the exception when the command failed or timed out.
+def probe_devices(devices, command, timeout=PROBE_TIMEOUT_SEC):
+    def probe(device):
+        if not is_user_root():
+            return subprocess.run(['sudo'] + command(device), stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+        return subprocess.run(command(device), stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+
+    if not devices:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(devices))) as executor:
+        futures = {device: executor.submit(probe, device) for device in devices}
+    results = {}
+    for device, future in futures.items():
+        try:
+            results[device] = future.result()
+        except Exception as e:
+            results[device] = e
+    return results
+
 # Retrieve a unique host identifier and indicate if it's a VM or BM.
 def get_host_serial():
     try:
@@ -132,16 +164,18 @@ def get_host_serial():
 
     return "Unknown Instance"  # Final fallback if all methods fail
 
-# Initialize global variables for Slurm reasons and error count
+# Initialize global variables for Slurm reasons and error count, the checks run concurrently and share them
 slurm_drain_reason = []
 slurm_error_count = 0
+slurm_lock = threading.Lock()
 
 # Function to provide slurm reason for a node to be drained or down
 def slurm_reason(message):
     global slurm_drain_reason
     global slurm_error_count
-    slurm_drain_reason.append(message)
-    slurm_error_count+=1
+    with slurm_lock:
+        slurm_drain_reason.append(message)
+        slurm_error_count+=1
 
 # Function to provide recommendation for any health issue found
 def recommended_action(current, action):
@@ -380,25 +414,21 @@ def check_rttcc_status():
     status_dict = {"devices": {}}
     status = "disabled"
 
-    for device in devices:
-        command = [
-            "sudo" if not is_user_root() else "",
-            "mlxreg", "-d", device, "-y", "--get", "--reg_name=PPCC",
-            "--indexes=local_port=1,pnat=0,lp_msb=0,algo_slot=0,algo_param_index=0"
-        ]
-        command = [c for c in command if c]  # Remove empty elements
+    results = probe_devices(devices, lambda device: [
+        "mlxreg", "-d", device, "-y", "--get", "--reg_name=PPCC",
+        "--indexes=local_port=1,pnat=0,lp_msb=0,algo_slot=0,algo_param_index=0"
+    ])
+    for device, result in results.items():
+        if isinstance(result, Exception):
+            logger.error(f"Failed to check RTTCC on {device}: {result}")
+            continue
+        output = result.stdout.decode('utf-8').split("\n")
 
-        try:
-            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            output = result.stdout.decode('utf-8').split("\n")
-
-            for line in output:
-                if line.startswith("value"):
-                    rttcc_value = line.split("|")[1].strip()
-                    if rttcc_value == "0x00000001":
-                        status_dict["devices"][device] = "enabled"
-        except Exception as e:
-            logger.error(f"Failed to check RTTCC on {device}: {e}")
+        for line in output:
+            if line.startswith("value"):
+                rttcc_value = line.split("|")[1].strip()
+                if rttcc_value == "0x00000001":
+                    status_dict["devices"][device] = "enabled"
 
     for device in status_dict["devices"]:
         if status_dict["devices"][device] == "enabled":
@@ -415,45 +445,23 @@ def check_rttcc_status():
     return link_status
 
 # 4.1 Check ECC errors for NVIDIA or AMD GPUs.
-def check_ecc_errors():
+def check_ecc_errors(snapshot):
     ecc_issues = []
 
-    try:
-        result = subprocess.run(['nvidia-smi', '-q'], stdout=subprocess.PIPE, timeout=SMI_TIMEOUT_SEC)
-        if result.returncode == 0:
-            output = result.stdout.decode('utf-8')
-            sram_matches = re.findall(r'SRAM Uncorrectable\s+:\s+(\d+)', output)
-            if len(sram_matches)==0:
-                sram_matches = re.findall(r'SRAM Uncorrectable Parity\s+:\s+(\d+)', output)
-            dram_matches = re.findall(r'DRAM Uncorrectable\s+:\s+(\d+)', output)
-            gpu_matches = re.findall(r'\nGPU\s+(.*)\n', output)
-            vol_sram_line = sram_matches[0::2]
-            vol_dram_line = dram_matches[0::2]
-            agg_sram_line = sram_matches[1::2]
-            agg_dram_line = dram_matches[1::2]
-
-            for i, gpu in enumerate(gpu_matches):
-                logger.debug(f"GPU: {gpu}")
-                if vol_sram_line[i] != "0":
-                    logger.debug(f"Volatile SRAM Uncorrectable: {vol_sram_line[i]}")
-                    ecc_issues.append(f"{gpu_matches[i]} - Volatile SRAM Uncorrectable: {vol_sram_line[i]}")
-                if vol_dram_line[i] != "0":
-                    logger.debug(f"Volatile DRAM Uncorrectable: {vol_dram_line[i]}")
-                    ecc_issues.append(f"{gpu_matches[i]} - Volatile DRAM Uncorrectable: {vol_dram_line[i]}")
-                if agg_sram_line[i] != "0":
-                    logger.debug(f"Aggregate SRAM Uncorrectable: {agg_sram_line[i]}")
-                    ecc_issues.append(f"{gpu_matches[i]} - Aggregate SRAM Uncorrectable: {agg_sram_line[i]}")
-                if agg_dram_line[i] != "0":
-                    logger.debug(f"Aggregate DRAM Uncorrectable: {agg_dram_line[i]}")
-                    ecc_issues.append(f"{gpu_matches[i]} - Aggregate DRAM Uncorrectable: {agg_dram_line[i]}")
-
-    except subprocess.TimeoutExpired:
-        logger.warning(f"GPU ECC Test: Failed - nvidia-smi timed out after {SMI_TIMEOUT_SEC}s")
-        ecc_issues.append(f"nvidia-smi -q timed out after {SMI_TIMEOUT_SEC}s")
-
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        pass
+    if snapshot.found:
+        if snapshot.error:
+            logger.warning(f"GPU ECC Test: Failed - {snapshot.error}")
+            ecc_issues.append(snapshot.error)
+        for gpu in snapshot.gpus:
+            if gpu["ecc"] is None:
+                continue
+            logger.debug(f"GPU: {gpu['pci']}")
+            for key, label in [("volatile_sram", "Volatile SRAM"), ("volatile_dram", "Volatile DRAM"), ("aggregate_sram", "Aggregate SRAM"), ("aggregate_dram", "Aggregate DRAM")]:
+                if gpu["ecc"][key] != 0:
+                    logger.debug(f"{label} Uncorrectable: {gpu['ecc'][key]}")
+                    ecc_issues.append(f"{gpu['pci']} - {label} Uncorrectable: {gpu['ecc'][key]}")
 
+    else:
         try:
             THRESHOLD = 5
             # Try detecting AMD GPU
@@ -485,7 +493,7 @@ def check_ecc_errors():
     return ecc_issues
 
 # 5.1 Check for row remap errors on GPUs.
-def check_row_remap_errors():
+def check_row_remap_errors(snapshot):
     remap_issues = []
     recommended_action = None
 
@@ -498,47 +506,34 @@ def check_row_remap_errors():
         return remap_issues, recommended_action
 
     # Proceed with the test for BM shapes
-    try:
-        # Run the nvidia-smi -q command
-        result = subprocess.run(
-            ['nvidia-smi', '--query-remapped-rows=remapped_rows.pending,remapped_rows.failure,remapped_rows.uncorrectable', '--format=csv,noheader'],
-            stdout=subprocess.PIPE, timeout=SMI_TIMEOUT_SEC
-        )
-
-        if result.returncode != 0:
-            logger.debug(f"Check row remap command exited with error code: {result.returncode}")
-
-    except FileNotFoundError:
+    if not snapshot.found:
         logger.warning("Skipping Row Remap Test: nvidia-smi command not found")
         return remap_issues, recommended_action
 
-    except subprocess.TimeoutExpired:
-        logger.warning(f"Row Remap Test: Failed - nvidia-smi timed out after {SMI_TIMEOUT_SEC}s")
-        remap_issues.append(f"nvidia-smi --query-remapped-rows=remapped_rows.pending,remapped_rows.failure,remapped_rows.uncorrectable --format=csv,noheader timed out after {SMI_TIMEOUT_SEC}s")
-
-    # Decode the output from bytes to string
-    output = result.stdout.decode('utf-8')
-    logger.debug("Output: {}".format(output))
+    if snapshot.error:
+        logger.warning(f"Row Remap Test: Failed - {snapshot.error}")
+        remap_issues.append(snapshot.error)
 
-    for i, line in enumerate(output.split('\n')):
-        if line == "":
+    for gpu in snapshot.gpus:
+        remapped_rows = gpu["remapped_rows"]
+        if remapped_rows is None:
             continue
-        tmp_data = line.split(",")
-        tmp_data = [x.strip() for x in tmp_data]
-        if tmp_data[0] != "0" and tmp_data[0] != "No":
-            logger.debug(f"GPU: {i} - Row Remap Pending: {tmp_data[0]}")
-            remap_issues.append(f"GPU: {i} Row Remap Pending: {tmp_data[0]}")
+        i = gpu["index"]
+        logger.debug(f"GPU: {i} - Remapped rows: {remapped_rows}")
+        if remapped_rows["pending"]:
+            logger.debug(f"GPU: {i} - Row Remap Pending: Yes")
+            remap_issues.append(f"GPU: {i} Row Remap Pending: Yes")
             recommended_action = "Reboot"
-        if tmp_data[1] != "0" and tmp_data[1] != "No":
-            logger.debug(f"GPU: {i} - Row Remap Failure: {tmp_data[1]}")
+        if remapped_rows["failure"]:
+            logger.debug(f"GPU: {i} - Row Remap Failure: Yes")
             recommended_action = "Terminate"
-        if tmp_data[2] != "0" and tmp_data[2] != "No":
-            logger.debug(f"GPU: {i} - Row Remap Uncorrectable: {tmp_data[2]}")
-            if int(tmp_data[2]) > 512:
-                remap_issues.append(f"GPU: {i} - Row Remap Uncorrectable >512: {tmp_data[2]}")
+        if remapped_rows["uncorrectable"] != 0:
+            logger.debug(f"GPU: {i} - Row Remap Uncorrectable: {remapped_rows['uncorrectable']}")
+            if remapped_rows["uncorrectable"] > 512:
+                remap_issues.append(f"GPU: {i} - Row Remap Uncorrectable >512: {remapped_rows['uncorrectable']}")
                 recommended_action = "Terminate"
             else:
-                remap_issues.append(f"GPU: {i} - Row Remap Uncorrectable <512: {tmp_data[2]}")
+                remap_issues.append(f"GPU: {i} - Row Remap Uncorrectable <512: {remapped_rows['uncorrectable']}")
                 recommended_action = "Reboot"
 
     if len(remap_issues) == 0:
@@ -549,7 +544,7 @@ def check_row_remap_errors():
     return remap_issues, recommended_action
 
 # 6.1 Check the number of GPUs available on the system.
-def check_gpu_count():
+def check_gpu_count(snapshot):
     
     lspci_expected_results_gpu = [
         '0f:00.0 3D controller: NVIDIA Corporation Device 2330 (rev a1)',
@@ -623,22 +618,20 @@ def check_gpu_count():
         return tmp_results
 
     # Check the number of GPUs for NVIDIA
-    try:
-        result = subprocess.run(['nvidia-smi', '--list-gpus'], stdout=subprocess.PIPE, timeout=SMI_TIMEOUT_SEC)
-        output = result.stdout.decode('utf-8').strip()
+    if snapshot.found:
+        if snapshot.error:
+            logger.error(f"GPU Count Test: Failed - {snapshot.error}")
+            return [snapshot.error]
 
         # Handle "No devices found" case
-        if "No devices found" in output:
+        if len(snapshot.gpus) == 0:
             logger.error("GPU Count Test: Failed - No devices found using nvidia-smi")
             return ["No GPUs detected"]
 
-        if "Unable to determine the device handle" in output:
+        if any(gpu["error"] for gpu in snapshot.gpus):
             logger.error("GPU Count Test: Failed - Unable to determine the device handle for one or more devices")
             return ["GPU device handle problem"]
-      
-        lines = output.split('\n')
-        # Remove empty lines
-        lines = [line for line in lines if line]
+
         if "GPU.GB" in shape or shape in ["BM.GPU.L40S-NC.4", "BM.GPU.A10.4"]:
             expected_gpus = 4
         elif shape in ["VM.GPU.A10.1", "VM.GPU.A100.40G.1", "VM.GPU.A100.80G.1"]:
@@ -648,15 +641,15 @@ def check_gpu_count():
         else:
             expected_gpus = 8
 
-        if len(lines) == expected_gpus:
+        if len(snapshot.gpus) == expected_gpus:
             logger.info("GPU Count Test: Passed")
         else:
             logger.error("GPU Count Test: Failed")
-            tmp_results.append(f"Expected {expected_gpus} GPUs, found {len(lines)} using nvidia-smi command")
+            tmp_results.append(f"Expected {expected_gpus} GPUs, found {len(snapshot.gpus)} using nvidia-smi command")
 
         return tmp_results
 
-    except FileNotFoundError:
+    else:
         try:
             # Check if lspci is available
             result = subprocess.run(['lspci', '-v'], stdout=subprocess.PIPE)
@@ -722,12 +715,8 @@ def check_gpu_count():
             logger.warning("Skipping GPU count test: nvidia-smi and lspci commands not found")
             return None
 
-        except subprocess.TimeoutExpired:
-            logger.error(f"GPU Count Test: Failed - nvidia-smi timed out after {SMI_TIMEOUT_SEC}s")
-            return [f"nvidia-smi --list-gpus timed out after {SMI_TIMEOUT_SEC}s"]
-
 # 7.1 Checks PCIe link width for NVIDIA or AMD based on instance shape.
-def check_gpu_pcie():
+def check_gpu_pcie(snapshot):
     shape = metadata.get('shape', '')
 
     expected_pcie_width = 16  # Expected PCIe width
@@ -760,36 +749,24 @@ def check_gpu_pcie():
             return ["AMD PCIe Width Test Skipped"]
 
     else:
-        try:
-            result = subprocess.run(
-                ['nvidia-smi', '--query-gpu=pcie.link.width.current', '--format=csv,noheader'],
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=SMI_TIMEOUT_SEC
-            )
-            output = result.stdout.decode('utf-8').strip()
-
-            if "No devices were found" in output:
-                logger.error("GPU PCIe Width Test: Failed - No devices were found")
-                return ["No GPUs detected"]
+        if not snapshot.found:
+            logger.warning("GPU PCIe Width Test: Skipping - `nvidia-smi` command not found")
+            return ["NVIDIA PCIe Width Test Skipped"]
 
-            widths = list(map(int, output.split("\n")))
-            if all(width == expected_pcie_width for width in widths):
-                logger.info("GPU PCIe Width Test: Passed")
-            else:
-                logger.error("GPU PCIe Width Test: Failed")
-                return [f"Expected PCIe width {expected_pcie_width}, but found {widths}"]
+        if snapshot.error:
+            logger.error(f"GPU PCIe Width Test: Failed - {snapshot.error}")
+            return [snapshot.error]
 
-        except subprocess.CalledProcessError as e:
-            error_msg = e.stderr.decode().strip() if e.stderr else "Unknown error"
-            logger.error(f"GPU PCIe Width Test: Failed with error: {error_msg}")
-            return ["NVIDIA PCIe Width Test Failed"]
+        if len(snapshot.gpus) == 0:
+            logger.error("GPU PCIe Width Test: Failed - No devices were found")
+            return ["No GPUs detected"]
 
-        except FileNotFoundError:
-            logger.warning("GPU PCIe Width Test: Skipping - `nvidia-smi` command not found")
-            return ["NVIDIA PCIe Width Test Skipped"]
-        
-        except subprocess.TimeoutExpired:
-            logger.error(f"GPU PCIe Width Test: Failed - nvidia-smi timed out after {SMI_TIMEOUT_SEC}s")
-            return [f"nvidia-smi PCIe query timed out after {SMI_TIMEOUT_SEC}s"]
+        widths = [gpu["pcie_width"] for gpu in snapshot.gpus]
+        if all(width == expected_pcie_width for width in widths):
+            logger.info("GPU PCIe Width Test: Passed")
+        else:
+            logger.error("GPU PCIe Width Test: Failed")
+            return [f"Expected PCIe width {expected_pcie_width}, but found {widths}"]
 
     return []
 
@@ -821,13 +798,16 @@ def check_rdma_link_status():
     link_issues = []
     devices = get_devices()
 
-    for device in devices:
-        # Run the mlxlink command
-        if not is_user_root():
-            command = ['sudo', 'mlxlink', '-d', device, '-m', '-c', '-e']
-        else:
-            command = ['mlxlink', '-d', device, '-m', '-c', '-e']
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # Run the mlxlink command on all the devices at once
+    results = probe_devices(devices, lambda device: ['mlxlink', '-d', device, '-m', '-c', '-e'])
+    for device, result in results.items():
+        if isinstance(result, subprocess.TimeoutExpired):
+            logger.debug(f"{device}: mlxlink timed out after {PROBE_TIMEOUT_SEC}s")
+            link_issues.append(f"{device}: mlxlink timed out after {PROBE_TIMEOUT_SEC}s")
+            status = False
+            continue
+        if isinstance(result, Exception):
+            raise result
 
         # Decode the output from bytes to string
         output = result.stdout.decode('utf-8')
@@ -922,25 +902,22 @@ def check_wpa_auth(metadata):
     warning = {key: [] for key in interface_names}
     action = None
     for i in range(5):
-        # Check each RDMA interface for WPA authentication status
-        for interface in interface_names:
-            try:
-                if not is_user_root():
-                    command = ['sudo', 'wpa_cli', 'status', '-i', interface]
-                else:
-                    command = ['wpa_cli', 'status', '-i', interface]
-
-                result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                if result.stderr.decode('utf-8') != '':
-                    warning[interface] = result.stderr.decode('utf-8').rstrip("\n")
-                for line in result.stdout.decode('utf-8').splitlines():
-                    if "Supplicant PAE state" in line:
-                        if "AUTHENTICATED" in line:
-                            auth_status[interface] = 1
-                        break
-            except subprocess.CalledProcessError as e:
-                wpa_auth_issues.append(f"Error checking {interface}: {e}")
-                logger.warning(f"Error checking {interface}: {e}")
+        # Check the RDMA interfaces not yet authenticated, all at once
+        pending = [interface for interface in interface_names if auth_status[interface] == 0]
+        results = probe_devices(pending, lambda interface: ['wpa_cli', 'status', '-i', interface])
+        for interface, result in results.items():
+            if isinstance(result, subprocess.TimeoutExpired):
+                warning[interface] = f"wpa_cli status -i {interface} timed out after {PROBE_TIMEOUT_SEC}s"
+                continue
+            if isinstance(result, Exception):
+                raise result
+            if result.stderr.decode('utf-8') != '':
+                warning[interface] = result.stderr.decode('utf-8').rstrip("\n")
+            for line in result.stdout.decode('utf-8').splitlines():
+                if "Supplicant PAE state" in line:
+                    if "AUTHENTICATED" in line:
+                        auth_status[interface] = 1
+                    break
         authenticated_count = sum(auth_status.values())
         if authenticated_count >= required_authenticated:
             break
@@ -965,37 +942,23 @@ def check_wpa_auth(metadata):
     return wpa_auth_issues if wpa_auth_issues else []
 
 # 14.1 Check the status of the Fabric Manager
-def check_fabric_manager():
-    fabric_manager_health = False
-    try:
-        # Run the nvidia-smi -q -i 0 | grep -i -A 2 Fabric
-        result = subprocess.run('nvidia-smi -q -i 0 | grep -i -A 2 Fabric', shell=True, stdout=subprocess.PIPE, timeout=SMI_TIMEOUT_SEC)
-        if result.returncode != 0:
-            logger.debug(f"Fabric Manager Check exited with error code: {result.returncode}")
-
-    except FileNotFoundError:
+def check_fabric_manager(snapshot):
+    if not snapshot.found:
         logger.warning("Skipping Fabric Manager test: nvidia-smi command not found")
-        return fabric_manager_health
- 
-    except subprocess.TimeoutExpired:
-        logger.warning(f"Fabric Manager Check: Failed - nvidia-smi timed out after {SMI_TIMEOUT_SEC}s")
         return False
 
-    # Decode the output from bytes to string
-    output = result.stdout.decode('utf-8')
-    logger.debug("Output: {}".format(output))
-    fabric_manager_status=False
-    fabric_manager_state=False
-    for i, line in enumerate(output.split('\n')):
-        if "State" in line:
-            if "Completed" in line:
-                fabric_manager_state = True
-        elif "Status" in line:
-            if "Success" in line:
-                fabric_manager_status = True
-        else:
-            continue
-    fabric_manager_health= ( fabric_manager_status and fabric_manager_state )
+    if snapshot.error or len(snapshot.gpus) == 0:
+        logger.warning(f"Fabric Manager Check: Failed - {snapshot.error or 'No devices were found'}")
+        return False
+
+    # Fabric state of the first GPU, as `nvidia-smi -q -i 0 | grep -i -A 2 Fabric`
+    fabric = snapshot.gpus[0]["fabric"]
+    logger.debug(f"Fabric: {fabric}")
+    if fabric is None:
+        return False
+    fabric_manager_state = fabric["state"] == "Completed"
+    fabric_manager_status = fabric["status"] == "Success"
+    fabric_manager_health = ( fabric_manager_status and fabric_manager_state )
     return fabric_manager_health
 
 # 15.1 Retrieve online CPUs and check if their profile is set to 'performance'.
@@ -1130,7 +1093,7 @@ def check_ip_addresses():
     return missing_ips,interface_map
 
 # 18.1 Check NVLinks speeds
-def get_nvlink_speed():
+def get_nvlink_speed(snapshot):
     gpu_nvlink_info = {
         "BM.GPU4.8":         {"count": 12, "speed": 25,      "gpu": 8},
         "BM.GPU.B4.8":       {"count": 12, "speed": 25,      "gpu": 8},
@@ -1147,51 +1110,30 @@ def get_nvlink_speed():
     }
 
     shape = metadata.get('shape')
-    info = gpu_nvlink_info[shape]
+    info = gpu_nvlink_info.get(shape)
     if not info:
         logger.info(f"Skipping NVLink speed check: unsupported GPU shape {shape}")
-        return []
+        return True
     count_expected = info['count']
     speed_expected = info['speed']
     expected_gpu = info['gpu']
 
+    if snapshot.error:
+        logger.warning(f"NVLink speed check: {snapshot.error}")
+        return True
+
     error = False
     checked = 0
-    for gpu_index in range(expected_gpu):
-        try:
-            result = subprocess.run(
-                ["nvidia-smi", "--query-gpu=mig.mode.current", "--format=csv,noheader", "-i", str(gpu_index)],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=SMI_TIMEOUT_SEC,
-                check=True
-            )
-            mig_output = result.stdout.decode()
-
-            if "enabled" in mig_output.lower():
-                logger.info(f"Skipping NVLINK check on MIG enabled GPU: {gpu_index}")
-                continue
-
-        except subprocess.TimeoutExpired:
-            logger.warning(f"GPU {gpu_index}: MIG status check command timed out after {SMI_TIMEOUT_SEC}s.")
-        except subprocess.CalledProcessError as e:
-            logger.warning(f"GPU {gpu_index}: MIG status check command failed with return code {e.returncode}.")
-        except Exception as e:
-            logger.warning(f"GPU {gpu_index}: MIG status check unexpected error: {e}")
-
-        try:
-            result = subprocess.run(
-                ["nvidia-smi", "nvlink", "-s", "-i", str(gpu_index)],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=SMI_TIMEOUT_SEC,
-                check=True
-            )
-            gpu_output = result.stdout.decode()
-            
-            link_speeds = re.findall(r'Link \d+: ([\d.]+) GB/s', gpu_output)
-            speeds_float = [float(s) for s in link_speeds]
+    for gpu in snapshot.gpus[:expected_gpu]:
+        gpu_index = gpu["index"]
+        if gpu["mig_enabled"]:
+            logger.info(f"Skipping NVLINK check on MIG enabled GPU: {gpu_index}")
+            continue
 
+        speeds_float = gpu["nvlink_speeds"]
+        if speeds_float is None:
+            logger.warning(f"GPU {gpu_index}: NVLink speeds could not be read.")
+        else:
             count = len(speeds_float)
             speeds_match = all(speed >= speed_expected for speed in speeds_float)
 
@@ -1201,12 +1143,6 @@ def get_nvlink_speed():
             if not speeds_match:
                 logger.error(f"GPU {gpu_index}: ERROR: One or more link speeds do not match expected ({speed_expected} GB/s)")
                 error = True
-        except subprocess.TimeoutExpired:
-            logger.warning(f"GPU {gpu_index}: NVLink speed check command timed out after {SMI_TIMEOUT_SEC}s.")
-        except subprocess.CalledProcessError as e:
-            logger.warning(f"GPU {gpu_index}: NVLink speed check command failed with return code {e.returncode}.")
-        except Exception as e:
-            logger.warning(f"GPU {gpu_index}: NVLink speed check unexpected error: {e}")
         checked += 1
     if error:
         return False
@@ -1272,6 +1208,268 @@ def run_dcgmi_health():
         logger.warning("Error running dcgmi health check or parsing JSON (is jq installed?).")
         return True
 
+#Section 3: Function calls to run all health checks.
+####################################################
+
+# Resource classes of the checks and how many checks of a class can run at the same time, None for no limit.
+# GPU checks go through the GPU driver, RDMA checks through the Mellanox tools and wpa_supplicant.
+RESOURCE_LIMITS = {"gpu": 2, "rdma": 2, "host": None}
+
+class HealthCheck(object):
+    """
+    A health check of the registry. It runs once the checks it depends on are done and gets their results.
+    The default is its result when it fails or does not complete before the deadline.
+    Exclusive checks run alone in their resource class, checks with run_all=False only run when asked for.
+    """
+    def __init__(self, name, function, description, resource="host", depends=(), default=None, when=None, exclusive=False, run_all=True):
+        self.name = name
+        self.function = function
+        self.description = description
+        self.resource = resource
+        self.depends = depends
+        self.default = default
+        self.when = when
+        self.exclusive = exclusive
+        self.run_all = run_all
+
+CHECKS = []
+
+def health_check(name, description, **kwargs):
+    def register(function):
+        CHECKS.append(HealthCheck(name, function, description, **kwargs))
+        return function
+    return register
+
+# 0.3 OCA state for the checks that need the RDMA configuration to be done
+@health_check("oca_state", "check OCA state", default="NOT STARTED", run_all=False)
+def run_oca_state(args, results):
+    return check_oca_status(log_state=False)
+
+# 1.3 Check OCA Status
+@health_check("oca_stat", "check OCA state", default="COMPLETED", when=lambda shape: not ("GPU.GB" in shape or shape in ["BM.GPU.L40S.4", "BM.GPU.A10.4"]))
+def run_oca_stat(args, results):
+    oca_state = check_oca_status(log_state=True)
+    if oca_state != "COMPLETED":
+        logger.error(f"OCA is not ready: {oca_state}")
+        slurm_reason("OCA Not completed")
+    return oca_state
+
+# 2.3 Check for OCA Version
+@health_check("oca_ver", "get Oracle Cloud Agent version", default="Unknown")
+def run_oca_ver(args, results):
+    return get_oca_version()
+
+# 3.3 Check for RTTCC Issues (only if OCA status is COMPLETED)
+@health_check("rttcc_stat", "check RTTCC status", resource="rdma", depends=("oca_state",), default=[])
+def run_rttcc_stat(args, results):
+    if results["oca_state"] == "COMPLETED":
+        return check_rttcc_status()
+    return []
+
+# 0.3 State of the NVIDIA GPUs read once for all the GPU checks
+@health_check("gpu_snapshot", "read the state of the GPUs", resource="gpu", default=GpuSnapshot(None, error="Cannot read the state of the GPUs"), run_all=False)
+def run_gpu_snapshot(args, results):
+    return get_snapshot(SMI_TIMEOUT_SEC)
+
+# 4.3 Check for ECC errors
+@health_check("ecc_err", "check ECC errors", resource="gpu", depends=("gpu_snapshot",), default=[], when=lambda shape: "GPU" in shape and not "BM.GPU.MI" in shape)
+def run_ecc_err(args, results):
+    return check_ecc_errors(results["gpu_snapshot"])
+
+# 5.3 Check for row remap errors
+@health_check("rowremap_err", "check row remap errors", resource="gpu", depends=("gpu_snapshot",), default=([], None), when=lambda shape: "GPU" in shape and not "BM.GPU.MI" in shape)
+def run_rowremap_err(args, results):
+    return check_row_remap_errors(results["gpu_snapshot"])
+
+# 6.3 Check the number of GPUs
+@health_check("gpu_count", "check the number of GPUs", resource="gpu", depends=("gpu_snapshot",))
+def run_gpu_count(args, results):
+    return check_gpu_count(results["gpu_snapshot"])
+
+# 7.3 Check GPU PCIe width
+@health_check("gpu_pcie", "check GPU PCIe Width", resource="gpu", depends=("gpu_snapshot",), when=lambda shape: not "GPU.GB" in shape)
+def run_gpu_pcie(args, results):
+    return check_gpu_pcie(results["gpu_snapshot"])
+
+# 8.3 Check GPU bandwidth, alone on the GPUs so that the other checks do not skew it
+@health_check("bw_test", "check GPU bandwidth", resource="gpu", depends=("gpu_snapshot",), exclusive=True, run_all=False)
+def run_bw_test(args, results):
+    if args.bw_test_exe:
+        bwt = BandwidthTest(bw_test_exe=args.bw_test_exe)
+    else:
+        bwt = BandwidthTest()
+    bwt.measure_gpu_bw(results["gpu_snapshot"])
+    return bwt.validate_results()
+
+# 9.3 Check for devices fallen off the bus
+@health_check("bus_stat", "check the bus")
+def run_bus_stat(args, results):
+    return check_bus()
+
+# 10.3 Check RDMA link status (only if OCA status is COMPLETED)
+@health_check("rdmalink_stat", "check RDMA link status", resource="rdma", depends=("oca_state",), default=[])
+def run_rdmalink_stat(args, results):
+    if results["oca_state"] == "COMPLETED":
+        return check_rdma_link_status()
+    return []
+
+# 11.3 Check RDMA link flapping (only if OCA status is COMPLETED)
+@health_check("rdmalink_flap", "check RDMA link flapping", depends=("oca_state",), default={"failures": [], "link_down": []})
+def run_rdmalink_flap(args, results):
+    if results["oca_state"] == "COMPLETED":
+        lft = LinkFlappingTest(time_interval=args.lf_interval)
+        lft.get_rdma_link_failures()
+        return lft.process_rdma_link_flapping()
+    return {"failures": [], "link_down": []}
+
+# 12.3 Check GPU Xid errors, with the action of the GPU reset Xids
+@health_check("xid_err", "check GPU Xid errors", default=({"status": "None", "results": {}, "categories": {}}, "", True))
+def run_xid_err(args, results):
+    xc = XidChecker(state_file=args.xid_state_file)
+    xid_results = xc.check_gpu_xid()
+    gpu_reset_action, gpu_reset_status = "", True
+    critical_xids = xid_results["categories"].get("critical", {})
+    reset_xids = xid_results["categories"].get("gpu_reset_reboot", {})
+    warning_xids  = xid_results["categories"].get("warning", {})
+    if critical_xids:
+        logger.debug("Xid critical error")
+    elif reset_xids:
+        gpu_reset_action, gpu_reset_status = gpu_reset_reboot(xc)
+    elif warning_xids:
+        logger.debug("Xid warning")
+    return xid_results, gpu_reset_action, gpu_reset_status
+
+# 13.3 Check WPA Authentication status (only if OCA status is COMPLETED)
+@health_check("wpa_auth", "get WPA Authentication status", resource="rdma", depends=("oca_state",))
+def run_wpa_auth(args, results):
+    if results["oca_state"] == "COMPLETED":
+        return check_wpa_auth(metadata)
+    return None
+
+# 14.3 Check Fabric Manager status
+@health_check("fabric_mgr", "check Fabric Manager", resource="gpu", depends=("gpu_snapshot",), default=True)
+def run_fabric_mgr(args, results):
+    if metadata['shape'] in ["BM.GPU.H100.8", "BM.GPU.H200.8", "BM.GPU.B200.8"]:
+        fabric_manager_health = check_fabric_manager(results["gpu_snapshot"])
+        if fabric_manager_health:
+            logger.info("Fabric Manager Running: Passed")
+        return fabric_manager_health
+    return True
+
+# 15.3 Check if CPU profile is performance
+@health_check("cpu_profile", "check CPU profile", default=[])
+def run_cpu_profile(args, results):
+    return get_current_cpu_profile()
+
+# 16.3 Check if AMD GPU has pending bad pages
+@health_check("bad_page", "check pending bad pages", resource="gpu", default=[])
+def run_bad_page(args, results):
+    if metadata['shape'] == "BM.GPU.MI300X.8":
+        return check_bad_pages()
+    return None
+
+# 17.3 Check if all interfaces have an IP address
+@health_check("ip_address", "get all IPS", depends=("oca_state",), default=[], when=lambda shape: not "GPU.GB" in shape)
+def run_ip_address(args, results):
+    if results["oca_state"] == "COMPLETED":
+        missing_ips, ip_list = check_ip_addresses()
+        if len(missing_ips) == 0:
+            logger.info("All interfaces have an IP defined: Passed")
+        return missing_ips
+    return []
+
+# 18.3 Check if NVLink speed is correct
+@health_check("nvlink_speed", "check NVLink speed", resource="gpu", depends=("gpu_snapshot",), default=True, when=lambda shape: shape not in ["BM.GPU.L40S.4", "BM.GPU.MI300X.8", "BM.GPU.A10.4"])
+def run_nvlink_speed(args, results):
+    return get_nvlink_speed(results["gpu_snapshot"])
+
+# 19.3 Check the node health using dcgmi health check
+@health_check("dcgmi_health", "run dcgmi health check", resource="gpu", default=True)
+def run_dcgmi_health_check(args, results):
+    if metadata['shape'] != "BM.GPU.MI300X.8":
+        dcgmi_health_check = run_dcgmi_health()
+        if dcgmi_health_check:
+            logger.info("dcgmi health check: Passed")
+        return dcgmi_health_check
+    return True
+
+# Checks to run in the order of the registry: the ones asked for that apply to the shape and the checks they depend on
+def select_checks(names, shape):
+    checks = {check.name: check for check in CHECKS}
+    selected = set()
+    todo = [name for name in names if checks[name].when is None or checks[name].when(shape)]
+    while todo:
+        name = todo.pop()
+        if not name in selected:
+            selected.add(name)
+            todo.extend(checks[name].depends)
+    return [check for check in CHECKS if check.name in selected]
+
+# Run the checks on up to `workers` threads, each one as soon as the checks it depends on are done and its resource class has room.
+# Checks still running or waiting after `deadline` seconds get their default result, threads left running do not keep the script alive.
+# Returns the result and the report of each check by name.
+def run_checks(checks, args, workers, deadline):
+    start = time.monotonic()
+    results = {}
+    report = {}
+    waiting = list(checks)
+    running = {}
+    done = queue.Queue()
+
+    def run(check, dependencies):
+        check_start = time.monotonic()
+        try:
+            result = check.function(args, dependencies)
+            status, error = "completed", None
+        except Exception as e:
+            logger.warning(f"Failed to {check.description} with error: {e}")
+            result = check.default
+            status, error = "failed", str(e)
+        done.put((check, result, status, error, check_start, time.monotonic()))
+
+    def has_room(check):
+        same_class = [other for other in running.values() if other.resource == check.resource]
+        if check.exclusive or any(other.exclusive for other in same_class):
+            return not same_class
+        limit = RESOURCE_LIMITS.get(check.resource)
+        return limit is None or len(same_class) < limit
+
+    while waiting or running:
+        # Resource classes kept free for an exclusive check waiting for the others to complete
+        reserved = set()
+        for check in list(waiting):
+            if len(running) >= workers:
+                break
+            if any(not name in results for name in check.depends):
+                continue
+            if check.resource in reserved or not has_room(check):
+                if check.exclusive:
+                    reserved.add(check.resource)
+                continue
+            waiting.remove(check)
+            running[check.name] = check
+            dependencies = {name: results[name] for name in check.depends}
+            threading.Thread(target=run, args=(check, dependencies), name=f"check-{check.name}", daemon=True).start()
+
+        # Nothing left that can start
+        if not running:
+            break
+        try:
+            check, result, status, error, check_start, check_end = done.get(timeout=max(deadline - (time.monotonic() - start), 0))
+        except queue.Empty:
+            break
+        del running[check.name]
+        results[check.name] = result
+        report[check.name] = {"resource": check.resource, "status": status, "error": error, "start": round(check_start - start, 3), "duration": round(check_end - check_start, 3), "result": result}
+
+    for check in list(running.values()) + waiting:
+        status = "timeout" if check.name in running else "not_started"
+        logger.warning(f"Failed to {check.description}: not completed within the {deadline}s deadline")
+        results[check.name] = check.default
+        report[check.name] = {"resource": check.resource, "status": status, "error": None, "start": None, "duration": None, "result": check.default}
+
+    return results, report
+
 #Section 2: Main function and args to run all checks (1.2 - 19.2)
 #################################################################
 
@@ -1280,6 +1478,9 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Check Host setup')
     parser.add_argument("-l", "--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default="INFO", help="Set the logging level default: INFO")
     parser.add_argument('-slurm', '--slurm', action='store_true', help='Add a Slurm message')
+    parser.add_argument('--workers', type=int, default=8, help='Number of checks run at the same time (default: 8)')
+    parser.add_argument('--deadline', type=int, default=300, help='Seconds after which the checks not completed are reported as timed out (default: 300)')
+    parser.add_argument('--json', dest='json_report', help='Write a JSON report of the checks with their timings to this file, - for stdout')
 
     parser.add_argument('--oca-stat', action='store_true', help='Check the state of oca')
     parser.add_argument('--oca-ver', action='store_true', help='Run OCA version check')
@@ -1295,6 +1496,7 @@ if __name__ == '__main__':
     parser.add_argument('--rdmalink-flap', action='store_true', help='Run RDMA link flapping check')
     parser.add_argument('--lf-interval', type=int, default=6, help='Link flapping interval with no flapping or link down events (default: 6 hours)')
     parser.add_argument('--xid-err', action='store_true', help='Run GPU Xid errors check')
+    parser.add_argument('--xid-state-file', help='Read only the kernel messages since the last Xid check, keeping the cursor and the Xid counts in this file')
     parser.add_argument('--wpa-auth', action='store_true', help='Run WPA authentication check')
     parser.add_argument('--fabric-mgr', action='store_true', help='Run Fabric Manager check')
     parser.add_argument('--cpu-profile', action='store_true', help='Run CPU profile check')
@@ -1320,219 +1522,15 @@ if __name__ == '__main__':
     logger.info(f"Node details: {hostname} - {host_serial} - {shape}")
     logger.info(f"Node details: {ocid}")
 
-
-#Section 3: Function calls to run all health checks.
-####################################################
-
     # Run everything if no arguments are provided
     run_all = not any(getattr(args, arg) for arg in vars(args) if isinstance(getattr(args, arg), bool) and arg != 'log_level') or args.slurm
 
-    # 1.3 Check OCA Status
-    if (run_all or args.oca_stat) and (not ("GPU.GB" in shape or shape in ["BM.GPU.L40S.4", "BM.GPU.A10.4"])):
-        try:
-            oca_state = check_oca_status(log_state=True)
-        except Exception as e:
-            logger.warning(f"Failed to check OCA state with error: {e}")
-            oca_state = "COMPLETED"
-
-        if oca_state != "COMPLETED":
-            logger.error(f"OCA is not ready: {oca_state}")
-            slurm_reason("OCA Not completed")
-
-    # 2.3 Check for OCA Version
-    if run_all or args.oca_ver:
-        try:
-            oca_version = get_oca_version()
-        except Exception as e:
-            logger.warning(f"Failed to get Oracle Cloud Agent version with error: {e}")
-            oca_version = "Unknown"
-
-    # 3.3 Check for RTTCC Issues (only if OCA status is COMPLETED)
-    rttcc_issues = []
-    if run_all or args.rttcc_stat:
-        try:
-            oca_state = check_oca_status(log_state=False)  # Retrieve OCA state only when needed
-        except Exception as e:
-            logger.warning(f"Failed to check OCA state with error: {e}")
-            oca_state = "NOT STARTED"
-
-        if oca_state == "COMPLETED":
-            try:
-                rttcc_issues = check_rttcc_status()
-            except Exception as e:
-                logger.warning(f"Failed to check RTTCC status with error: {e}")
-                rttcc_issues = []
-    
-    # 4.3 Check for ECC errors
-    if (run_all or args.ecc_err) and "GPU" in shape and not "BM.GPU.MI" in shape:
-        try:
-            ecc_issues = check_ecc_errors()
-        except Exception as e:
-            logger.warning(f"Failed to check ECC errors with error: {e}")
-            ecc_issues = []
-
-    # 5.3 Check for row remap errors
-    if (run_all or args.rowremap_err) and "GPU" in shape and not "BM.GPU.MI" in shape:
-        try:
-            remap_results, row_remap_action = check_row_remap_errors()
-        except Exception as e:
-            logger.warning(f"Failed to check row remap errors with error: {e}")
-            remap_results = []
-
-    # 6.3 Check the number of GPUs
-    if run_all or args.gpu_count:
-        try:
-            gpu_results = check_gpu_count()
-        except Exception as e:
-            logger.warning(f"Failed to check the number of GPUs with error: {e}")
-            gpu_results = None
-
-    # 7.3 Check GPU PCIe width
-    if (run_all or args.gpu_pcie) and ( not "GPU.GB" in shape):    
-        try:
-            gpu_pcie_results = check_gpu_pcie()
-        except Exception as e:
-            logger.warning(f"Failed to check GPU PCIe Width with error: {e}")
-            gpu_pcie_results = None
-
-    # 8.3 Check GPU bandwidth
-    bwt_results = None
-    if args.bw_test:
-        try:
-           if args.bw_test_exe:
-               bwt = BandwidthTest(bw_test_exe=args.bw_test_exe)
-           else:
-               bwt = BandwidthTest()
-           bwt.measure_gpu_bw()
-           bwt_results = bwt.validate_results()
-        except Exception as e:
-            logger.warning(f"Failed to check GPU bandwidth with error: {e}")
-            bwt_results = None
-
-    # 9.3 Check for devices fallen off the bus
-    if run_all or args.bus_stat:
-        try:
-            bus_results = check_bus()
-        except Exception as e:
-            logger.warning(f"Failed to check the bus with error: {e}")
-            bus_results = None
-
-    # 10.3 Check RDMA link status (only if OCA status is COMPLETED)
-    if run_all or args.rdmalink_stat:
-        if oca_state == "COMPLETED":
-            try:
-                rdma_link_issues = check_rdma_link_status()
-            except Exception as e:
-                logger.warning(f"Failed to check RDMA link status with error: {e}")
-                rdma_link_issues = []
-        else:
-            rdma_link_issues = []
-
-    # 11.3 Check RDMA link flapping (only if OCA status is COMPLETED)
-    if run_all or args.rdmalink_flap:
-        if oca_state == "COMPLETED":
-            try:
-                lft = LinkFlappingTest(time_interval=args.lf_interval)
-                lft.get_rdma_link_failures()
-                lft_issues = lft.process_rdma_link_flapping()
-            except Exception as e:
-                logger.warning(f"Failed to check RDMA link flapping with error: {e}")
-                lft_issues = {"failures": [], "link_down": []}
-        else:
-            lft_issues = {"failures": [], "link_down": []}
- 
-    # 12.3 Check GPU Xid errors
-    if run_all or args.xid_err: 
-        try:
-            xc = XidChecker()
-            xid_results = xc.check_gpu_xid()
-            critical_xids = xid_results["categories"].get("critical", {})
-            reset_xids = xid_results["categories"].get("gpu_reset_reboot", {})
-            warning_xids  = xid_results["categories"].get("warning", {})
-            if critical_xids:
-                logger.debug("Xid critical error")
-            elif reset_xids:
-                gpu_reset_action, gpu_reset_status = gpu_reset_reboot(xc)
-            elif warning_xids:
-                logger.debug("Xid warning")
-        except Exception as e:
-            logger.warning(f"Failed to check GPU Xid errors with error: {e}")
-            xid_results = {"status": "None", "results": {}}
-
-    # 13.3 Check WPA Authentication status (only if OCA status is COMPLETED)
-    if run_all or args.wpa_auth:
-        if oca_state == "COMPLETED":
-            try:
-                wpa_auth_results = check_wpa_auth(metadata)
-            except Exception as e:
-                logger.warning(f"Failed to get WPA Authentication status: {e}")
-                wpa_auth_results = None
-        else:
-            wpa_auth_results = None
-
-    # 14.3 Check Fabric Manager status
-    if run_all or args.fabric_mgr:
-        if shape == "BM.GPU.H100.8" or shape == "BM.GPU.H200.8" or shape == "BM.GPU.B200.8":
-            try:
-                fabric_manager_health = check_fabric_manager()
-            except Exception as e:
-                logger.warning(f"Failed to check Fabric Manager with error: {e}")
-                fabric_manager_health = True
-
-            if fabric_manager_health:
-                logger.info("Fabric Manager Running: Passed")
-        else:
-            fabric_manager_health = True
-
-    # 15.3 Check if CPU profile is performance
-    if run_all or args.cpu_profile:
-        try:
-            cpu_profile_issues = get_current_cpu_profile()
-        except Exception as e:
-            logger.warning(f"Failed to check CPU profile with error: {e}")
-            cpu_profile_issues = []
-
-    # 16.3 Check if AMD GPU has pending bad pages
-    if run_all or args.bad_page:   
-        try:
-            if shape == "BM.GPU.MI300X.8":
-                bad_page_issues = check_bad_pages()
-            else:
-                bad_page_issues = None
-        except Exception as e:
-            logger.warning(f"Failed to check pending bad pages: {e}")
-            bad_page_issues = []
-
-    # 17.3 Check if all interfaces have an IP address
-    if (run_all or args.ip_address) and ( not "GPU.GB" in shape):  
-        if oca_state == "COMPLETED":
-            try:
-                missing_ips,ip_list = check_ip_addresses()
-                if len(missing_ips) == 0:
-                    logger.info("All interfaces have an IP defined: Passed")
-            except Exception as e:
-                logger.warning(f"Failed to get all IPS: {e}")
-                missing_ips = []
-        else:
-            missing_ips = []
-
-    # 18.3 Check if NVLink speed is correct
-    if (run_all or args.nvlink_speed) and (shape not in ["BM.GPU.L40S.4", "BM.GPU.MI300X.8", "BM.GPU.A10.4"]):
-        nvlink_speed = get_nvlink_speed()
-    
-    # 19.3 Check the node health using dcgmi health check
-    if run_all or args.dcgmi_health:
-        if shape != "BM.GPU.MI300X.8":
-            try:
-                dcgmi_health_check = run_dcgmi_health()
-            except Exception as e:
-                logger.warning(f"Failed to run dcgmi health check with error: {e}")
-                dcgmi_health_check = True
-
-            if dcgmi_health_check:
-                logger.info("dcgmi health check: Passed")
-        else:
-            dcgmi_health_check = True
+    # Run the checks concurrently, see section 3
+    start = time.monotonic()
+    names = [check.name for check in CHECKS if (run_all and check.run_all) or getattr(args, check.name, False)]
+    results, check_report = run_checks(select_checks(names, shape), args, args.workers, args.deadline)
+    duration = time.monotonic() - start
+    logger.info(f"Ran {len(check_report)} checks in {duration:.1f}s")
 
 #Section 4: Summarize the results and recommend actions.
 ########################################################
@@ -1540,27 +1538,31 @@ if __name__ == '__main__':
     logger.info(f"--------- Summary of Host setup check for {host_serial} ---------")
 
     # 1.4 Summarize OCA status check
-    if (run_all or args.oca_stat) and ( not ("GPU.GB" in shape or shape in ["BM.GPU.L40S.4", "BM.GPU.A10.4"])):
+    if "oca_stat" in results:
+        oca_state = results["oca_stat"]
         if oca_state != "COMPLETED":
             logger.error(f"OCA is not ready: {oca_state}")
             slurm_reason("OCA Not completed")
             action = recommended_action(action, "Wait_For_OCA")
     
     # 2.4 Summarize OCA version check
-    if run_all or args.oca_ver:
+    if "oca_ver" in results:
+        oca_version = results["oca_ver"]
         if oca_version < "1.39.0":
             logger.error(f"Oracle Cloud Agent: {oca_version} needs to be updated to 1.39.0 or higher")
             slurm_reason("OCA version Error")
 
     # 3.4 Summarize RTTCC status check
-    if run_all or args.rttcc_stat:
+    if "rttcc_stat" in results:
+        rttcc_issues = results["rttcc_stat"]
         if shape != "BM.GPU.MI300X.8":
             if len(rttcc_issues) > 0:
                 logger.error(f"RTTCC issues: {rttcc_issues}")
                 slurm_reason("RTTCC Error")
 
     # 4.4 Summarize ECC errors check
-    if (run_all or args.ecc_err) and "GPU" in shape and not "BM.GPU.MI" in shape:
+    if "ecc_err" in results:
+        ecc_issues = results["ecc_err"]
         if len(ecc_issues) > 0:
             ecc_error = False
             for issue in ecc_issues:
@@ -1577,7 +1579,8 @@ if __name__ == '__main__':
                 action = recommended_action(action, "Reboot")
 
     # 5.4 Summarize row remap errors check
-    if (run_all or args.rowremap_err) and "GPU" in shape and not "BM.GPU.MI" in shape:
+    if "rowremap_err" in results:
+        remap_results, row_remap_action = results["rowremap_err"]
         if len(remap_results) > 0:
             remap_error = False
             for issue in remap_results:
@@ -1591,21 +1594,24 @@ if __name__ == '__main__':
                 action = recommended_action(action, row_remap_action)
 
     # 6.4 Summarize GPU count check
-    if run_all or args.gpu_count:
+    if "gpu_count" in results:
+        gpu_results = results["gpu_count"]
         if gpu_results:
             logger.error(f"{host_serial} - Missing GPU(s): {gpu_results}")
             slurm_reason("Missing GPU Error")
             action = recommended_action(action, "Reboot")
 
     # 7.4 Summarize GPU PCIe width check
-    if (run_all or args.gpu_pcie) and ( not "GPU.GB" in shape):
+    if "gpu_pcie" in results:
+            gpu_pcie_results = results["gpu_pcie"]
             if gpu_pcie_results:
                 logger.error(f"{host_serial} - GPU PCIe Width: {gpu_pcie_results}")
                 slurm_reason("GPU PCIe Width Error")
                 action = recommended_action(action, "Terminate")
 
     # 8.4 Summarize GPU bandwidth test
-    if run_all or args.bw_test:
+    if "bw_test" in results:
+        bwt_results = results["bw_test"]
         if bwt_results != None:
             if bwt_results["status"] == "Failed":
                 for issue in bwt_results["issues"]:
@@ -1613,14 +1619,16 @@ if __name__ == '__main__':
                     slurm_reason("GPU Bwt Error")
 
     # 9.4 Summarize bus status check
-    if run_all or args.bus_stat:
+    if "bus_stat" in results:
+        bus_results = results["bus_stat"]
         if bus_results:
             logger.error(f"{host_serial} - Bus issues: {bus_results}")
             slurm_reason("GPU Bus Error")
             action = recommended_action(action, "Terminate")
 
     # 10.4 Summarize RDMA link status check
-    if run_all or args.rdmalink_stat:
+    if "rdmalink_stat" in results:
+        rdma_link_issues = results["rdmalink_stat"]
         if len(rdma_link_issues) > 0:
             for issue in rdma_link_issues:
                 logger.warning(f"{host_serial} - RDMA link issues: {issue}")
@@ -1630,7 +1638,8 @@ if __name__ == '__main__':
                 #action = recommended_action(action, "Terminate")
 
     # 11.4 Summarize RDMA link flapping check
-    if run_all or args.rdmalink_flap:
+    if "rdmalink_flap" in results:
+        lft_issues = results["rdmalink_flap"]
         if len(lft_issues["failures"]) > 0 or len(lft_issues["link_down"]) > 0:
            if len(lft_issues["failures"]) == 1:
               issue = lft_issues["failures"][0]
@@ -1648,7 +1657,8 @@ if __name__ == '__main__':
                   #slurm_reason("RDMA Link Down Error")
 
     # 12.4 Summarize GPU Xid errors check
-    if run_all or args.xid_err:
+    if "xid_err" in results:
+        xid_results, gpu_reset_action, gpu_reset_status = results["xid_err"]
         critical_xids = xid_results["categories"].get("critical", {})
         reset_xids = xid_results["categories"].get("gpu_reset_reboot", {})
         warning_xids  = xid_results["categories"].get("warning", {})
@@ -1696,7 +1706,8 @@ if __name__ == '__main__':
                     )
 
     # 13.4 Summarize WPA Authentication check
-    if run_all or args.wpa_auth:
+    if "wpa_auth" in results:
+        wpa_auth_results = results["wpa_auth"]
         if wpa_auth_results:
             for issue in wpa_auth_results:
                 logger.warning(f"{host_serial} - WPA authentication issue: {issue}")
@@ -1704,14 +1715,16 @@ if __name__ == '__main__':
             #action = recommended_action(action, "Reboot")
 
     # 14.4 Summarize Fabric Manager check
-    if run_all or args.fabric_mgr:
+    if "fabric_mgr" in results:
+        fabric_manager_health = results["fabric_mgr"]
         if not fabric_manager_health:
             logger.error(f"{host_serial} - Fabric Manager not started")
             slurm_reason("Fabric Manager Error")
             action = recommended_action(action, "FabricManagerRestart")
 
     # 15.4 Summarize CPU profile check
-    if run_all or args.cpu_profile:
+    if "cpu_profile" in results:
+        cpu_profile_issues = results["cpu_profile"]
         if cpu_profile_issues:
             logger.warning(f"CPU Profile need to be 'performance'.")
             #for issue in cpu_profile_issues:
@@ -1720,7 +1733,8 @@ if __name__ == '__main__':
             #action = recommended_action(action, "Terminate")
 
     # 16.4 Summarize pending bad pages check for AMD
-    if run_all or args.bad_page:
+    if "bad_page" in results:
+        bad_page_issues = results["bad_page"]
         if bad_page_issues:
             for issue in bad_page_issues:
                 logger.error(f"{host_serial} - GPU has pending bad pages: {issue}")
@@ -1728,21 +1742,24 @@ if __name__ == '__main__':
             action = recommended_action(action, "Reboot")
 
     # 17.4 Summarize all interfaces have an IP address check
-    if (run_all or args.ip_address) and ( not "GPU.GB" in shape):
+    if "ip_address" in results:
+        missing_ips = results["ip_address"]
         if len(missing_ips) > 0:
             logger.error(f"Missing IPs for these interfaces: {','.join(missing_ips)}")
             slurm_reason("Missing IPs")
             action = recommended_action(action, "Reboot")
     
     # 18.4 Summarize NVLink speed check
-    if (run_all or args.nvlink_speed) and (shape not in ["BM.GPU.L40S.4", "BM.GPU.MI300X.8", "BM.GPU.A10.4"]):
+    if "nvlink_speed" in results:
+        nvlink_speed = results["nvlink_speed"]
         if not nvlink_speed:
             logger.error(f"NVLink speed Error for one or more GPUs")
             slurm_reason("NVLink speed Error")
             action = recommended_action(action, "Reboot")
 
     # 19.4 Summarize dcgmi health check
-    if run_all or args.dcgmi_health:
+    if "dcgmi_health" in results:
+        dcgmi_health_check = results["dcgmi_health"]
         if not dcgmi_health_check:
             logger.error(f"{host_serial} - dcgmi health check failed. Run `dcgmi health -c` to get full output.")
             slurm_reason("dcgmi health check failed")
@@ -1765,4 +1782,24 @@ if __name__ == '__main__':
         logger.error("Healthcheck:: " + ", ".join(slurm_drain_reason))
         logger.error("Healthcheck:: Recommended Action:" + str(action))
 
+    # Write the JSON report of the checks
+    if args.json_report:
+        report = {
+            "hostname": hostname,
+            "serial": host_serial,
+            "shape": shape,
+            "ocid": ocid,
+            "started": datetime_str,
+            "duration": round(duration, 3),
+            "deadline": args.deadline,
+            "checks": check_report,
+            "slurm_reasons": slurm_drain_reason,
+            "action": action
+        }
+        if args.json_report == "-":
+            print(json.dumps(report, indent=2, default=str))
+        else:
+            with open(args.json_report, 'w') as file:
+                json.dump(report, file, indent=2, default=str)
+
     logger.info(f"Finished GPU host setup check at: {datetime_str}")
\ No newline at end of file
@@ -7,6 +7,7 @@ import sys
 import re
 import os
 import shlex
+import json
 
 version = sys.version_info
 if version >= (3, 12):
@@ -14,14 +15,48 @@ if version >= (3, 12):
 else:
     from datetime import datetime
 
+# Example line:
+# NVRM: Xid (PCI:0000:08:00): 79, GPU has fallen off the bus
+XID_PATTERN = re.compile(r"NVRM: Xid \(PCI:(.*?): (\d+),")
+KMSG_PATH = "/dev/kmsg"
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+
+def read_kmsg(after_seq=-1, path=KMSG_PATH):
+    """
+    Messages of the kernel ring buffer after the sequence number after_seq, as (sequence number, microseconds since boot, message).
+    The whole buffer is read but only the new messages are decoded.
+    """
+    fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    try:
+        while True:
+            try:
+                record = os.read(fd, 8192)
+            except BlockingIOError:
+                break
+            except BrokenPipeError:
+                # Messages overwritten while reading, go on with the oldest one left
+                continue
+            header, _, message = record.partition(b';')
+            fields = header.split(b',')
+            seq = int(fields[1])
+            if seq > after_seq:
+                yield seq, int(fields[2]), message.split(b'\n')[0].decode('utf-8', errors='replace')
+    finally:
+        os.close(fd)
+
+def get_boot_id():
+    with open(BOOT_ID_PATH) as f:
+        return f.read().strip()
+
 class XidChecker:
-    def __init__(self, dmesg_cmd="dmesg -T", time_interval=60):
+    def __init__(self, dmesg_cmd="dmesg -T", time_interval=60, state_file=None):
         # if user is root
         if not os.geteuid() == 0:
             #logger.info("The XidChecker script did not run since it must be run as root")
             #sys.exit(1)
             raise PermissionError("Root privileges are required to run XidChecker")
         self.dmesg_cmd = dmesg_cmd
+        self.state_file = state_file
         self.results = {}
 
         # Check for the following GPU Xid errors in dmesg
@@ -179,9 +214,9 @@ class XidChecker:
             result = subprocess.run(dmesg_cmd_list, check=True, capture_output=True, text=True, timeout=10)
             dmesg_output = result.stdout
         except subprocess.CalledProcessError as e:
-            logger.info("Error running Xid check command dmesg -T:", e)
+            logger.info(f"Error running Xid check command dmesg -T: {e}")
         except subprocess.TimeoutExpired as e:
-            logger.info("dmesg -T command timed out:", e)
+            logger.info(f"dmesg -T command timed out: {e}")
         return dmesg_output
     
     # Get the timestamp from the dmesg line. This will help when checking whether GPU was reset in the last 24 hours in the healthcheck script.
@@ -197,6 +232,57 @@ class XidChecker:
                 return None
         return None
 
+    def count_xids(self, output, counts=None):
+        """ Count of each known Xid by PCI device in one pass over the output """
+        if counts is None:
+            counts = {}
+        for pci, xid in XID_PATTERN.findall(output):
+            if xid in self.XID_EC:
+                tmp_dict = counts.setdefault(xid, {})
+                tmp_dict[pci] = tmp_dict.get(pci, 0) + 1
+        return counts
+
+    def load_state(self, boot_id):
+        """ Cursor in /dev/kmsg and Xid counts of this boot, the state of a previous boot is dropped """
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+            if state.get("boot_id") == boot_id:
+                return state
+        except (FileNotFoundError, ValueError) as e:
+            logger.debug(f"No Xid state in {self.state_file}: {e}")
+        return {"boot_id": boot_id, "seq": -1, "xids": {}}
+
+    def save_state(self, state):
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.state_file)
+
+    def get_xid_counts(self):
+        """
+        Xid counts of the whole dmesg buffer, None when dmesg fails.
+        When state_file is set, Xid counts of this boot reading only the kernel messages since the last run.
+        """
+        if self.state_file is None:
+            dmesg_output = self.get_dmesg()
+            if dmesg_output == "":
+                return None
+            if "NVRM: Xid" not in dmesg_output:
+                return {}
+            return self.count_xids(dmesg_output)
+
+        state = self.load_state(get_boot_id())
+        messages = []
+        for seq, usec, message in read_kmsg(state["seq"]):
+            state["seq"] = seq
+            if "NVRM: Xid" in message:
+                messages.append(message)
+        logger.debug(f"{len(messages)} new Xid messages up to kernel message {state['seq']}")
+        self.count_xids("\n".join(messages), state["xids"])
+        self.save_state(state)
+        return state["xids"]
+
     def check_gpu_xid(self):
         # buckets we’ll return
         categorized_results = {
@@ -205,15 +291,14 @@ class XidChecker:
             "warning": {},
         }
 
-        dmesg_output = self.get_dmesg()
-
-        if dmesg_output == "":
+        counts = self.get_xid_counts()
+        if counts is None:
             return {
                 "categories": categorized_results,
                 "results": self.results,
-            } 
+            }
 
-        if "NVRM: Xid" not in dmesg_output:
+        if not counts:
             logger.info("Xid Check: Passed")
             # Still return empty buckets + whatever self.results you maintain
             return {
@@ -221,27 +306,11 @@ class XidChecker:
                 "results": self.results,
             }
 
-        # We found at least one "NVRM: Xid" string in dmesg, walk all known XIDs
+        # Known XIDs found, in the order of the table
         for XID in self.XID_EC.keys():
-            logger.debug(f"Checking for GPU Xid {XID} error in dmesg")
-
-            # Example line:
-            # NVRM: Xid (PCI:0000:08:00): 79, GPU has fallen off the bus
-            matches = re.findall(
-                rf"NVRM: Xid \(PCI:(.*?): {XID},",  # capture PCI location
-                dmesg_output,
-            )
-
-            tmp_dict = {}
-            for match in matches:
-                if match not in tmp_dict:
-                    tmp_dict[match] = 1
-                else:
-                    tmp_dict[match] += 1
-
-            if not matches:
-                logger.debug(f"No GPU Xid {XID} error found in dmesg")
+            if not XID in counts:
                 continue
+            tmp_dict = counts[XID]
 
             # We have at least one hit for this XID
             desc = self.XID_EC[XID]["description"]
@@ -284,12 +353,13 @@ if __name__ == '__main__':
     # Argument parsing
     parser = argparse.ArgumentParser(description='Check for GPU Xid errors.')
     parser.add_argument('--dmesg_cmd', default='dmesg -T', help='Dmesg file to check. Default is dmesg -T.')
+    parser.add_argument('--state-file', help='Read only the new messages of /dev/kmsg since the last run, the cursor and the Xid counts of this boot are kept in this file')
     args = parser.parse_args()
     logger.debug(f"Using dmesg command: {args.dmesg_cmd}")
     
     try:
-        xc = XidChecker(dmesg_cmd=args.dmesg_cmd)
+        xc = XidChecker(dmesg_cmd=args.dmesg_cmd, state_file=args.state_file)
         results = xc.check_gpu_xid()
-        logger.debug("Status: {}, Results: {}".format(results["status"], results["results"]))
+        logger.debug("Categories: {}, Results: {}".format(results["categories"], results["results"]))
     except PermissionError:
         pass
\ No newline at end of file
@@ -81,7 +81,7 @@ local var = g.dashboard.variable;
   interface:
     var.query.new('interface')
     + var.query.withDatasourceFromVariable(self.prometheus)
-    + var.query.queryTypes.withLabelValues('interface', 'rdma_np_ecn_marked_roce_packets')
+    + var.query.queryTypes.withLabelValues('interface', 'rdma_np_ecn_marked_roce_packets_total')
     + var.query.selectionOptions.withMulti()
     + var.query.selectionOptions.withIncludeAll()
     + var.query.withRefresh(1),
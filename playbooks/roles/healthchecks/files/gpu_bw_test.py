@@ -7,7 +7,7 @@ import socket
 import time
 import json
 from shared_logging import logger
-import re
+from gpu_snapshot import get_snapshot
 
 
 class BandwidthTest:
@@ -25,19 +25,20 @@ class BandwidthTest:
         filtered_output = [line for line in output.split('\n') if line.startswith('available:')]
         return int(filtered_output[0].split()[1].strip())
 
-    def get_gpus(self):
-        result = subprocess.run(['nvidia-smi', '-L'], stdout=subprocess.PIPE)
-        output = result.stdout.decode('utf-8')
-        filtered_output = [line for line in output.split('\n') if line.startswith('GPU')]
-        return len(filtered_output)
-
-    def measure_gpu_bw(self):
+    def measure_gpu_bw(self, snapshot=None):
         numas = 2
         gpus = 8
         iterations = 1
         size = "32000000"
 
-        gpus = self.get_gpus()
+        # GPUs and their processes from the snapshot shared with the other health checks
+        if snapshot is None:
+            snapshot = get_snapshot()
+        if snapshot.error:
+            logger.error(f"Cannot read the GPUs: {snapshot.error}")
+            self.results = None
+            return self.results
+        gpus = len(snapshot.gpus)
         numas = self.get_numa_nodes()
         gpus_per_numa = gpus // numas
 
@@ -50,23 +51,12 @@ class BandwidthTest:
         results = {"gpus": {}, "host": hostname}
 
         # Check if any processes are running on the GPUs before running the test
-        result = subprocess.run(["nvidia-smi", "-q", "-d", "PIDS"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        # Define the regular expression pattern for the GPU ID and the Processes
-        pattern = r'\nGPU\s(.*)\s+Processes\s+:\s+(.*)'
-
-        # Find all matches in the output
-        matches = re.findall(pattern, result.stdout)
-
-        # For each match, extract the GPU ID and the number of processes
         gpu_idle_count = 0
-        for match in matches:
-            gpu_id, processes = match
-            # If processes is 'None', set it to 0
-            if processes == 'None':
+        for gpu in snapshot.gpus:
+            if gpu["processes"] == 0:
                 gpu_idle_count += 1
             else:
-                logger.debug("GPU {} has processes running on it".format(gpu_id))
-            
+                logger.debug("GPU {} has processes running on it".format(gpu["pci"]))
 
         logger.debug("GPU Idle Count: {}".format(gpu_idle_count))
         if gpu_idle_count != 8:
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import re
+import subprocess
+import threading
+import xml.etree.ElementTree as ET
+from shared_logging import logger
+
+try:
+    import pynvml
+    pynvml_available = True
+except ImportError:
+    pynvml_available = False
+
+SNAPSHOT_TIMEOUT_SEC = 10
+
+class GpuSnapshot:
+    """
+    State of all the NVIDIA GPUs read once and shared by the health checks.
+    found is False when there is no NVIDIA driver or nvidia-smi, error is set when the driver did not answer.
+    Each GPU is a dict with its index, name, pci bus id, uncorrectable ECC errors, remapped rows, PCIe link width,
+    MIG mode, speed of the active NVLinks in GB/s, fabric state and number of processes. Values that cannot be read are None.
+    """
+    def __init__(self, source, gpus=None, found=True, error=None):
+        self.source = source
+        self.gpus = gpus if gpus is not None else []
+        self.found = found
+        self.error = error
+
+    def to_dict(self):
+        return {"source": self.source, "found": self.found, "error": self.error, "gpus": self.gpus}
+
+def new_gpu(index):
+    return {
+        "index": index,
+        "name": None,
+        "pci": None,
+        "error": None,
+        "ecc": None,
+        "remapped_rows": None,
+        "pcie_width": None,
+        "mig_enabled": False,
+        "nvlink_speeds": None,
+        "fabric": None,
+        "processes": None
+    }
+
+# NVML session, every value is read with one call per GPU and feature
+def nvml_call(function, *args, default=None):
+    try:
+        return function(*args)
+    except pynvml.NVMLError:
+        return default
+
+def read_nvml_gpu(index):
+    gpu = new_gpu(index)
+    try:
+        handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+    except pynvml.NVMLError as e:
+        gpu["error"] = str(e)
+        return gpu
+    name = nvml_call(pynvml.nvmlDeviceGetName, handle)
+    gpu["name"] = name.decode() if isinstance(name, bytes) else name
+    pci = nvml_call(pynvml.nvmlDeviceGetPciInfo, handle)
+    if pci is not None:
+        gpu["pci"] = pci.busId.decode() if isinstance(pci.busId, bytes) else pci.busId
+
+    ecc = {}
+    for key, counter, location in [
+        ("volatile_sram", pynvml.NVML_VOLATILE_ECC, pynvml.NVML_MEMORY_LOCATION_SRAM),
+        ("volatile_dram", pynvml.NVML_VOLATILE_ECC, pynvml.NVML_MEMORY_LOCATION_DRAM),
+        ("aggregate_sram", pynvml.NVML_AGGREGATE_ECC, pynvml.NVML_MEMORY_LOCATION_SRAM),
+        ("aggregate_dram", pynvml.NVML_AGGREGATE_ECC, pynvml.NVML_MEMORY_LOCATION_DRAM)
+    ]:
+        ecc[key] = nvml_call(pynvml.nvmlDeviceGetMemoryErrorCounter, handle, pynvml.NVML_MEMORY_ERROR_TYPE_UNCORRECTED, counter, location, default=0)
+    gpu["ecc"] = ecc
+
+    remapped_rows = nvml_call(pynvml.nvmlDeviceGetRemappedRows, handle)
+    if remapped_rows is not None:
+        corrected, uncorrectable, pending, failure = remapped_rows
+        gpu["remapped_rows"] = {"pending": bool(pending), "failure": bool(failure), "uncorrectable": uncorrectable}
+
+    gpu["pcie_width"] = nvml_call(pynvml.nvmlDeviceGetCurrPcieLinkWidth, handle)
+    mig_mode = nvml_call(pynvml.nvmlDeviceGetMigMode, handle)
+    gpu["mig_enabled"] = mig_mode is not None and mig_mode[0] == pynvml.NVML_DEVICE_MIG_ENABLE
+
+    links = [link for link in range(pynvml.NVML_NVLINK_MAX_LINKS) if nvml_call(pynvml.nvmlDeviceGetNvLinkState, handle, link) == pynvml.NVML_FEATURE_ENABLED]
+    if len(links):
+        values = nvml_call(pynvml.nvmlDeviceGetFieldValues, handle, [(pynvml.NVML_FI_DEV_NVLINK_GET_SPEED, link) for link in links])
+        if values is not None:
+            # Speeds in MB/s
+            gpu["nvlink_speeds"] = [value.value.uiVal / 1000 for value in values if value.nvmlReturn == pynvml.NVML_SUCCESS]
+    else:
+        gpu["nvlink_speeds"] = []
+
+    fabric = nvml_call(pynvml.nvmlDeviceGetGpuFabricInfo, handle)
+    if fabric is not None:
+        states = {
+            pynvml.NVML_GPU_FABRIC_STATE_NOT_SUPPORTED: "N/A",
+            pynvml.NVML_GPU_FABRIC_STATE_NOT_STARTED: "Not Started",
+            pynvml.NVML_GPU_FABRIC_STATE_IN_PROGRESS: "In Progress",
+            pynvml.NVML_GPU_FABRIC_STATE_COMPLETED: "Completed"
+        }
+        gpu["fabric"] = {"state": states.get(fabric.state, "Unknown"), "status": "Success" if fabric.status == pynvml.NVML_SUCCESS else "Failure"}
+
+    processes = nvml_call(pynvml.nvmlDeviceGetComputeRunningProcesses, handle)
+    graphics = nvml_call(pynvml.nvmlDeviceGetGraphicsRunningProcesses, handle)
+    if processes is not None or graphics is not None:
+        gpu["processes"] = len(set(process.pid for process in (processes or []) + (graphics or [])))
+    return gpu
+
+def read_nvml():
+    pynvml.nvmlInit()
+    try:
+        return GpuSnapshot("nvml", [read_nvml_gpu(index) for index in range(pynvml.nvmlDeviceGetCount())])
+    finally:
+        pynvml.nvmlShutdown()
+
+# nvidia-smi fallback, one XML dump of all GPUs and one status of all the NVLinks
+def xml_text(element, path):
+    value = element.findtext(path)
+    if value is None:
+        return None
+    value = value.strip()
+    return None if value in ("", "N/A") else value
+
+def xml_int(element, path):
+    value = xml_text(element, path)
+    try:
+        return int(value.rstrip("x")) if value is not None else None
+    except ValueError:
+        return None
+
+def parse_smi_xml(output):
+    gpus = []
+    for index, element in enumerate(ET.fromstring(output).findall("gpu")):
+        gpu = new_gpu(index)
+        gpu["name"] = xml_text(element, "product_name")
+        gpu["pci"] = element.get("id")
+        ecc = {}
+        for key, path in [("volatile_sram", "volatile"), ("volatile_dram", "volatile"), ("aggregate_sram", "aggregate"), ("aggregate_dram", "aggregate")]:
+            if key.endswith("sram"):
+                value = xml_int(element, f"ecc_errors/{path}/sram_uncorrectable")
+                if value is None:
+                    value = xml_int(element, f"ecc_errors/{path}/sram_uncorrectable_parity")
+            else:
+                value = xml_int(element, f"ecc_errors/{path}/dram_uncorrectable")
+            ecc[key] = value or 0
+        gpu["ecc"] = ecc
+        if element.find("remapped_rows") is not None and xml_text(element, "remapped_rows/remapped_row_pending") is not None:
+            gpu["remapped_rows"] = {
+                "pending": xml_text(element, "remapped_rows/remapped_row_pending") == "Yes",
+                "failure": xml_text(element, "remapped_rows/remapped_row_failure") == "Yes",
+                "uncorrectable": xml_int(element, "remapped_rows/remapped_row_unc") or 0
+            }
+        gpu["pcie_width"] = xml_int(element, "pci/pci_gpu_link_info/link_widths/current_link_width")
+        gpu["mig_enabled"] = xml_text(element, "mig_mode/current_mig") == "Enabled"
+        if element.find("fabric") is not None:
+            gpu["fabric"] = {"state": xml_text(element, "fabric/state"), "status": xml_text(element, "fabric/status")}
+        processes = element.find("processes")
+        if processes is not None:
+            gpu["processes"] = len(processes.findall("process_info"))
+        gpus.append(gpu)
+    return gpus
+
+def parse_smi_nvlink(output):
+    """ Speeds in GB/s of the active links of each GPU from `nvidia-smi nvlink -s` """
+    speeds = {}
+    index = None
+    for line in output.splitlines():
+        match = re.match(r'GPU (\d+):', line)
+        if match:
+            index = int(match.group(1))
+            speeds[index] = []
+            continue
+        match = re.search(r'Link \d+: ([\d.]+) GB/s', line)
+        if match and index is not None:
+            speeds[index].append(float(match.group(1)))
+    return speeds
+
+def read_smi(timeout):
+    try:
+        result = subprocess.run(['nvidia-smi', '-q', '-x'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    except FileNotFoundError:
+        return GpuSnapshot(None, found=False, error="nvidia-smi command not found")
+    except subprocess.TimeoutExpired:
+        return GpuSnapshot("nvidia-smi", error=f"nvidia-smi -q -x timed out after {timeout}s")
+    output = result.stdout.decode('utf-8')
+    if result.returncode != 0 or not output.strip().startswith("<?xml"):
+        return GpuSnapshot("nvidia-smi", error=output.strip() or result.stderr.decode('utf-8').strip())
+    try:
+        gpus = parse_smi_xml(output)
+    except ET.ParseError as e:
+        return GpuSnapshot("nvidia-smi", error=f"Cannot parse nvidia-smi -q -x: {e}")
+
+    try:
+        result = subprocess.run(['nvidia-smi', 'nvlink', '-s'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+        if result.returncode == 0:
+            speeds = parse_smi_nvlink(result.stdout.decode('utf-8'))
+            for gpu in gpus:
+                gpu["nvlink_speeds"] = speeds.get(gpu["index"], [])
+    except subprocess.TimeoutExpired:
+        logger.warning(f"nvidia-smi nvlink -s timed out after {timeout}s")
+    return GpuSnapshot("nvidia-smi", gpus)
+
+def read_snapshot(timeout=SNAPSHOT_TIMEOUT_SEC):
+    """
+    Read the GPUs through NVML, or nvidia-smi when NVML cannot be loaded.
+    NVML runs in a thread that is given up after timeout seconds: a hung driver would hang nvidia-smi too, it is not tried.
+    """
+    if not pynvml_available:
+        return read_smi(timeout)
+    snapshot = []
+    errors = []
+
+    def read():
+        try:
+            snapshot.append(read_nvml())
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=read, name="gpu-snapshot", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        logger.warning(f"NVML did not answer within {timeout}s")
+        return GpuSnapshot("nvml", error=f"NVML timed out after {timeout}s")
+    if len(errors):
+        logger.debug(f"Cannot read the GPUs with NVML, using nvidia-smi: {errors[0]}")
+        return read_smi(timeout)
+    return snapshot[0]
+
+lock = threading.Lock()
+cached = None
+
+def get_snapshot(timeout=SNAPSHOT_TIMEOUT_SEC):
+    """ The snapshot of the GPUs, read on the first call and shared by the next ones """
+    global cached
+    with lock:
+        if cached is None:
+            cached = read_snapshot(timeout)
+        return cached
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the state of the NVIDIA GPUs used by the health checks')
+    parser.add_argument('--timeout', type=int, default=SNAPSHOT_TIMEOUT_SEC, help='Seconds to wait for the driver (default: 10)')
+    args = parser.parse_args()
+    print(json.dumps(read_snapshot(args.timeout).to_dict(), indent=2))
@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
+import time
+
+# Metrics about the exporters themselves, shared by all their collectors
+
+collector_duration_seconds = Histogram(
+    'exporter_collector_duration_seconds',
+    'Time spent by a collector to read its metrics',
+    ['collector'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+
+collector_errors_total = Counter(
+    'exporter_collector_errors_total',
+    'Errors of a collector by cause',
+    ['collector', 'cause']
+)
+
+collector_last_success_timestamp_seconds = Gauge(
+    'exporter_collector_last_success_timestamp_seconds',
+    'Time of the last collection that completed',
+    ['collector']
+)
+
+subprocess_forks_total = Counter(
+    'exporter_subprocess_forks_total',
+    'Processes started by a collector',
+    ['collector', 'command']
+)
+
+@contextmanager
+def timed(collector):
+    """ Record the duration of a collection, its completion time, or the exception that stopped it """
+    start = time.monotonic()
+    try:
+        yield
+    except Exception as e:
+        count_error(collector, type(e).__name__)
+        raise
+    else:
+        collector_last_success_timestamp_seconds.labels(collector).set_to_current_time()
+    finally:
+        collector_duration_seconds.labels(collector).observe(time.monotonic() - start)
+
+def count_error(collector, cause):
+    collector_errors_total.labels(collector, cause).inc()
+
+def count_fork(collector, command):
+    subprocess_forks_total.labels(collector, command).inc()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+from prometheus_client import start_http_server
+from prometheus_client.core import REGISTRY
+import argparse
+import heapq
+import socket
+import threading
+import time
+import pyudev
+from custom_metric_common import get_metadata, get_rdma_devices
+from shared_logging import logger
+from exporter_metrics import count_error
+
+class Node(object):
+    """
+    What the plugins share: host metadata, RDMA devices, NVML and one udev monitor.
+    """
+    def __init__(self):
+        self.hostname = socket.gethostname()
+        self.lock = threading.Lock()
+        self.shape = None
+        self.nvml = False
+        self.subscribers = {}
+        try:
+            self.shape = get_metadata()['shape']
+        except Exception as e:
+            logger.warning(f"Cannot get the instance metadata: {e}")
+
+    def rdma_devices(self):
+        """ RDMA devices of the shape that have an rdma network interface, or all of them for other shapes """
+        from rdma_counters_exporter import get_rdma_nics
+        nics = get_rdma_nics()
+        shape_devices = get_rdma_devices(self.shape)
+        if len(shape_devices):
+            nics = [nic for nic in nics if nic in shape_devices]
+        return nics
+
+    def init_nvml(self):
+        import pynvml
+        with self.lock:
+            if not self.nvml:
+                pynvml.nvmlInit()
+                self.nvml = True
+
+    def subscribe(self, subsystems, callback):
+        """ Call back on every udev event of these subsystems """
+        for subsystem in subsystems:
+            self.subscribers.setdefault(subsystem, []).append(callback)
+
+    def udev_event(self, device):
+        for callback in self.subscribers.get(device.subsystem, []):
+            callback()
+
+    def start_udev_monitor(self):
+        if not len(self.subscribers):
+            return None
+        context = pyudev.Context()
+        monitor = pyudev.Monitor.from_netlink(context)
+        for subsystem in self.subscribers.keys():
+            monitor.filter_by(subsystem=subsystem)
+        observer = pyudev.MonitorObserver(monitor, callback=self.udev_event, name='node-agent-udev-monitor')
+        observer.daemon = True
+        observer.start()
+        return observer
+
+class Plugin(object):
+    """
+    A collector of the node agent.
+    update() is called every interval seconds by the agent, plugins with no interval are only read in collect() when Prometheus scrapes.
+    """
+    name = None
+    interval = None
+
+    def __init__(self, node, args):
+        self.node = node
+
+    def start(self):
+        pass
+
+    def update(self):
+        pass
+
+    def collect(self):
+        return []
+
+class RdmaPlugin(Plugin):
+    name = "rdma"
+
+    def __init__(self, node, args):
+        super().__init__(node, args)
+        from rdma_counters_exporter import RdmaCollector, CounterRates
+        self.collector = RdmaCollector(node.hostname, get_nics=node.rdma_devices)
+        self.rates = None
+        windows = [int(window) for window in args.rate_windows.split(',') if window.strip()]
+        if len(windows):
+            self.rates = CounterRates(self.collector, windows, args.sample_interval)
+            self.interval = args.sample_interval
+
+    def start(self):
+        self.collector.discover()
+        self.node.subscribe(["infiniband"], self.collector.refresh)
+
+    def update(self):
+        self.rates.update()
+
+    def collect(self):
+        metrics = self.collector.collect()
+        if self.rates is not None:
+            metrics += self.rates.collect()
+        return metrics
+
+class NvlinkPlugin(Plugin):
+    name = "nvlink"
+
+    def __init__(self, node, args):
+        super().__init__(node, args)
+        self.interval = args.nvlink_interval
+        self.collector = None
+
+    def start(self):
+        from nvlink_counters_exporter import NvlinkCollector
+        self.node.init_nvml()
+        self.collector = NvlinkCollector(self.node.hostname, self.interval)
+
+    def update(self):
+        self.collector.read()
+
+    def collect(self):
+        return self.collector.collect()
+
+class PciePlugin(Plugin):
+    name = "pcie"
+
+    def __init__(self, node, args):
+        super().__init__(node, args)
+        from pcie_faults_exporter import PcieCollector
+        self.collector = PcieCollector(node.hostname)
+
+    def start(self):
+        self.collector.discover()
+        self.node.subscribe(["pci", "infiniband", "nvme"], self.collector.refresh)
+
+    def collect(self):
+        return self.collector.collect()
+
+class NvmlPlugin(Plugin):
+    """ Slurm job utilization, the gauges of the NVML exporter are served by the agent registry """
+    name = "nvml"
+    interval = 15
+
+    def __init__(self, node, args):
+        super().__init__(node, args)
+        import nvml_metrics_exporter
+        self.exporter = nvml_metrics_exporter
+        self.aggregate_jobs = args.aggregate_jobs
+
+    def start(self):
+        self.node.init_nvml()
+        self.exporter.configure(self.aggregate_jobs, self.node.hostname)
+
+    def update(self):
+        self.exporter.export_metrics()
+
+class XidPlugin(Plugin):
+    """ GPU Xid errors, counted by a thread that follows the kernel messages """
+    name = "xid"
+
+    def __init__(self, node, args):
+        super().__init__(node, args)
+        from xid_exporter import XidCollector
+        self.collector = XidCollector(node.hostname, args.xid_state_file)
+
+    def start(self):
+        self.collector.start()
+
+    def collect(self):
+        return self.collector.collect()
+
+PLUGINS = [RdmaPlugin, NvlinkPlugin, PciePlugin, NvmlPlugin, XidPlugin]
+
+class NodeAgent(object):
+    """ Serves the metrics of all the plugins on one port and runs their updates from a single thread """
+    def __init__(self, plugins):
+        self.plugins = plugins
+
+    def collect(self):
+        for plugin in self.plugins:
+            try:
+                for metric in plugin.collect():
+                    yield metric
+            except Exception as e:
+                logger.error(f"Plugin {plugin.name} failed to collect: {e}")
+                count_error(plugin.name, "plugin_collect")
+
+    def run(self):
+        # (next run, order, plugin), the order keeps plugins due at the same time comparable
+        schedule = [(time.monotonic(), index, plugin) for index, plugin in enumerate(self.plugins) if plugin.interval]
+        heapq.heapify(schedule)
+        while True:
+            if not len(schedule):
+                time.sleep(3600)
+                continue
+            next_run, index, plugin = schedule[0]
+            delay = next_run - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                plugin.update()
+            except Exception as e:
+                logger.error(f"Plugin {plugin.name} failed to update: {e}")
+                count_error(plugin.name, "plugin_update")
+            # Skip the runs that were missed instead of running them back to back
+            next_run += plugin.interval
+            if next_run < time.monotonic():
+                next_run = time.monotonic() + plugin.interval
+            heapq.heapreplace(schedule, (next_run, index, plugin))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the RDMA, NVLink, PCIe, Slurm job and GPU Xid metrics of the node on one port')
+    parser.add_argument('--port', type=int, help='Port of the metrics endpoint', default=9500)
+    parser.add_argument('--plugins', help='Comma separated plugins to run', default=','.join(plugin.name for plugin in PLUGINS))
+    parser.add_argument('--rate-windows', help='Comma separated windows in seconds of the RDMA counter rates, none if empty', default='')
+    parser.add_argument('--sample-interval', type=float, help='Seconds between two reads of the RDMA counters for the rates', default=1)
+    parser.add_argument('--nvlink-interval', type=float, help='Seconds between two reads of the NVLink counters, between 1 and 5', default=5)
+    parser.add_argument('--xid-state-file', help='Xid counts of this boot and cursor in /dev/kmsg', default='/run/xid-exporter/xid_events.json')
+    parser.add_argument('--aggregate-jobs', help='If present, sum the utilization of the processes of each job and drop the slurm_job_pid label', action='store_true', default=False)
+    args = parser.parse_args()
+    if args.nvlink_interval < 1 or args.nvlink_interval > 5:
+        parser.error("--nvlink-interval must be between 1 and 5 seconds")
+
+    names = [name.strip() for name in args.plugins.split(',') if name.strip()]
+    unknown = set(names) - set(plugin.name for plugin in PLUGINS)
+    if len(unknown):
+        parser.error(f"Unknown plugins: {', '.join(sorted(unknown))}")
+
+    node = Node()
+    plugins = []
+    for plugin_class in PLUGINS:
+        if not plugin_class.name in names:
+            continue
+        try:
+            plugin = plugin_class(node, args)
+            plugin.start()
+            plugins.append(plugin)
+            logger.info(f"Started plugin {plugin.name}")
+        except Exception as e:
+            logger.error(f"Cannot start plugin {plugin_class.name}: {e}")
+    node.start_udev_monitor()
+    agent = NodeAgent(plugins)
+    REGISTRY.register(agent)
+    start_http_server(args.port)
+    agent.run()
@@ -1,83 +1,139 @@
-from prometheus_client import start_http_server, Gauge
+from prometheus_client import start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+import argparse
+import logging
+import signal
+import socket
+import sys
+import threading
 import time
-import subprocess
-from io import StringIO
-import json
-import re
-gpu_data = {}
-link_data = {}
-gpu_id = None
-gpu = None
+import pynvml
+from exporter_metrics import timed, count_error
 
-data_tx_kib = Gauge('nvlink_data_tx_kib_total', 'Total data in KiB transmitted', ['hostname', 'gpu', "link"])
-data_rx_kib = Gauge('nvlink_data_rx_kib_total', 'Total data in KiB received', ['hostname', 'gpu', "link"])
-raw_tx_kib = Gauge('nvlink_raw_tx_kib_total', 'Total raw bytes in KiB transmitted', ['hostname', 'gpu', "link"])
-raw_rx_kib = Gauge('nvlink_raw_rx_kib_total', 'Total raw bytes in KiB received', ['hostname', 'gpu', "link"])
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Same counters as `nvidia-smi nvlink -gt rd`, in KiB
+NVLINK_FIELDS = [
+    ('data_tx', pynvml.NVML_FI_DEV_NVLINK_THROUGHPUT_DATA_TX, 'data', 'transmitted'),
+    ('data_rx', pynvml.NVML_FI_DEV_NVLINK_THROUGHPUT_DATA_RX, 'data', 'received'),
+    ('raw_tx', pynvml.NVML_FI_DEV_NVLINK_THROUGHPUT_RAW_TX, 'raw bytes', 'transmitted'),
+    ('raw_rx', pynvml.NVML_FI_DEV_NVLINK_THROUGHPUT_RAW_RX, 'raw bytes', 'received'),
+]
+
+def signal_handler(signum, frame):
+    logger.info("Shutting down NVML...")
+    pynvml.nvmlShutdown()
+    sys.exit(0)
+
+def get_nvlinks():
+    """ Returns the handle and the active NVLinks of every GPU by GPU index """
+    gpus = {}
+    for gpu_idx in range(pynvml.nvmlDeviceGetCount()):
+        handle = pynvml.nvmlDeviceGetHandleByIndex(gpu_idx)
+        links = []
+        for link in range(pynvml.NVML_NVLINK_MAX_LINKS):
+            try:
+                if pynvml.nvmlDeviceGetNvLinkState(handle, link) == pynvml.NVML_FEATURE_ENABLED:
+                    links.append(link)
+            except pynvml.NVMLError:
+                # Links past the last one of the GPU are not supported
+                continue
+        gpus[gpu_idx] = (handle, links)
+    return gpus
+
+class NvlinkCollector(object):
+    """
+    Reads the NVLink throughput counters of all GPUs and links every interval seconds,
+    one NVML field values call per GPU. Only the last two reads of each link are kept.
+    """
+    def __init__(self, hostname, interval):
+        self.hostname = hostname
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.gpus = get_nvlinks()
+        # (gpu, link, counter) -> (monotonic time, KiB)
+        self.totals = {}
+        # (gpu, link, counter) -> bytes per second between the last two reads
+        self.rates = {}
+        for gpu_idx, (handle, links) in self.gpus.items():
+            logger.info(f"GPU {gpu_idx}: monitoring NVLinks {links}")
+
+    def read(self):
+        with timed("nvlink"):
+            self.read_gpus()
+
+    def read_gpus(self):
+        for gpu_idx, (handle, links) in self.gpus.items():
+            fields = [(field_id, link) for link in links for counter, field_id, kind, direction in NVLINK_FIELDS]
+            keys = [(str(gpu_idx), str(link), counter) for link in links for counter, field_id, kind, direction in NVLINK_FIELDS]
+            if not len(fields):
+                continue
+            try:
+                values = pynvml.nvmlDeviceGetFieldValues(handle, fields)
+            except pynvml.NVMLError as e:
+                logger.error(f"Failed to read NVLink counters of GPU {gpu_idx}: {e}")
+                count_error("nvlink", "nvml")
+                continue
+            now = time.monotonic()
+            with self.lock:
+                for key, value in zip(keys, values):
+                    if value.nvmlReturn != pynvml.NVML_SUCCESS:
+                        count_error("nvlink", "nvml_field")
+                        self.totals.pop(key, None)
+                        self.rates.pop(key, None)
+                        continue
+                    total = value.value.ullVal
+                    previous = self.totals.get(key)
+                    # A counter going back means the GPU was reset, wait for the next read
+                    if previous is not None and total >= previous[1] and now > previous[0]:
+                        self.rates[key] = (total - previous[1]) * 1024 / (now - previous[0])
+                    else:
+                        self.rates.pop(key, None)
+                    self.totals[key] = (now, total)
+
+    def sample(self):
+        next_read = time.monotonic()
+        while True:
+            self.read()
+            next_read += self.interval
+            delay = next_read - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_read = time.monotonic()
+
+    def start(self):
+        thread = threading.Thread(target=self.sample, name='nvlink-sampler', daemon=True)
+        thread.start()
+        return thread
+
+    def collect(self):
+        families = {}
+        for counter, field_id, kind, direction in NVLINK_FIELDS:
+            families[counter] = CounterMetricFamily(f"nvlink_{counter}_kib", f"Total {kind} in KiB {direction}", labels=['hostname', 'gpu', 'link'])
+            families[counter + "_rate"] = GaugeMetricFamily(f"nvlink_{counter}_bytes_per_second", f"NVLink {kind} {direction} per second over the last {self.interval}s", labels=['hostname', 'gpu', 'link'])
+        with self.lock:
+            for (gpu, link, counter), (timestamp, total) in self.totals.items():
+                families[counter].add_metric([self.hostname, gpu, link], total)
+            for (gpu, link, counter), rate in self.rates.items():
+                families[counter + "_rate"].add_metric([self.hostname, gpu, link], rate)
+        return list(families.values())
 
-def get_nvlink_metrics():
-    hostname = subprocess.getoutput("hostname")
-    metrics_raw = StringIO(subprocess.getoutput("/usr/bin/nvidia-smi nvlink -gt rd"))
-    for line in metrics_raw:
-        line = line.strip()
-        if line.startswith("GPU"):
-            gpu_match = re.match(r"GPU (\d+): (.+?) \(UUID: (.+?)\)", line.strip())
-            if gpu_match:
-                gpu_id = gpu_match.group(1)
-                gpu_model = gpu_match.group(2)
-                gpu_uuid = gpu_match.group(3)
-                gpu = f"GPU_{gpu_id}"
-                gpu_data[gpu] = {
-                    "model": gpu_model,
-                    "uuid": gpu_uuid
-                }
-                link_data[gpu] = {}
-        elif line.startswith("Link") and gpu is not None:
-            line = line.strip()
-            data_tx_match = re.match(r"Link (\d+): Data Tx: (\d+) KiB", line)
-            data_rx_match = re.match(r"Link (\d+): Data Rx: (\d+) KiB", line)
-            raw_tx_match = re.match(r"Link (\d+): Raw Tx: (\d+) KiB", line)
-            raw_rx_match = re.match(r"Link (\d+): Raw Rx: (\d+) KiB", line)
-            if data_tx_match:
-                link_id = data_tx_match.group(1)
-                data_tx = int(data_tx_match.group(2))
-                data_tx_kib.labels(hostname=hostname, gpu=gpu_id, link=link_id).set(data_tx)
-                if link_id in link_data[gpu]:
-                   link_data[gpu][link_id]["data_tx_kib"]=data_tx
-                else:
-                   link_data[gpu][link_id]={}
-                   link_data[gpu][link_id]["data_tx_kib"]=data_tx
-            if data_rx_match:
-                link_id = data_rx_match.group(1)
-                data_rx = int(data_rx_match.group(2))
-                data_rx_kib.labels(hostname=hostname, gpu=gpu_id, link=link_id).set(data_rx)
-                if link_id in link_data[gpu]:
-                   link_data[gpu][link_id]["data_rx_kib"]=data_rx
-                else:
-                   link_data[gpu][link_id]={}
-                   link_data[gpu][link_id]["data_rx_kib"]=data_rx
-            if raw_tx_match:
-                link_id = raw_tx_match.group(1)
-                raw_tx = int(raw_tx_match.group(2))
-                raw_tx_kib.labels(hostname=hostname, gpu=gpu_id, link=link_id).set(raw_tx)
-                if link_id in link_data[gpu]:
-                   link_data[gpu][link_id]["raw_tx_kib"]=raw_tx
-                else:
-                   link_data[gpu][link_id]={}
-                   link_data[gpu][link_id]["raw_tx_kib"]=raw_tx
-            if raw_rx_match:
-                link_id = raw_rx_match.group(1)
-                raw_rx = int(raw_rx_match.group(2))
-                raw_rx_kib.labels(hostname=hostname, gpu=gpu_id, link=link_id).set(raw_rx)
-                if link_id in link_data[gpu]:
-                   link_data[gpu][link_id]["raw_rx_kib"]=raw_rx
-                else:
-                   link_data[gpu][link_id]={}
-                   link_data[gpu][link_id]["raw_rx_kib"]=raw_rx
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the NVLink throughput of all GPUs on port 9600')
+    parser.add_argument('--interval', type=float, help='Seconds between two reads of the NVLink counters, between 1 and 5', default=5)
+    args = parser.parse_args()
+    if args.interval < 1 or args.interval > 5:
+        parser.error("--interval must be between 1 and 5 seconds")
+
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+    pynvml.nvmlInit()
+    collector = NvlinkCollector(socket.gethostname(), args.interval)
+    collector.start()
+    REGISTRY.register(collector)
     # Start up the server to expose the metrics.
     start_http_server(9600)
-    # Generate NVLink metrics every 10 seconds
     while True:
-        get_nvlink_metrics()
-        time.sleep(60)
-
+        time.sleep(3600)
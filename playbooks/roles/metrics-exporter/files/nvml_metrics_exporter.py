@@ -1,3 +1,4 @@
+import argparse
 import os
 import time
 import socket
@@ -13,10 +14,13 @@ import json
 import glob
 import shutil
 from prometheus_client import start_http_server, Gauge
+from exporter_metrics import timed, count_error, count_fork
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 cluster_name = "none"
+hostname = "none"
+aggregate_jobs = False
 
 SCONTROL_PATH = shutil.which("scontrol")
 
@@ -25,29 +29,30 @@ def signal_handler(signum, frame):
     pynvml.nvmlShutdown()
     sys.exit(0)
 
-slurm_job_gpu_util_percent = Gauge(
-    "slurm_job_gpu_util_percent",
-    "GPU Compute utilization in percent",
-    ["cluster_name", "hostname", "gpu", "slurm_job_pid", "slurm_job_id"]
-)
-
-slurm_job_gpu_mem_util_percent = Gauge(
-    "slurm_job_gpu_mem_util_percent",
-    "GPU Memory utilization in percent",
-    ["cluster_name", "hostname", "gpu", "slurm_job_pid", "slurm_job_id"]
-)
-
-slurm_job_cpu_util_seconds = Gauge(
-    "slurm_job_cpu_util_seconds",
-    "CPU utilization in seconds",
-    ["cluster_name", "hostname", "slurm_job_pid", "slurm_job_id"]
-)
-
-slurm_job_mem_util_bytes = Gauge(
-    "slurm_job_mem_util_bytes",
-    "GPU Memory utilization in bytes",
-    ["cluster_name", "hostname", "slurm_job_pid", "slurm_job_id"]
-)
+def create_job_gauges(aggregate_jobs):
+    """ Job gauges, by process or, when aggregating by job, summed over the processes of each job without the PID label """
+    global slurm_job_gpu_util_percent, slurm_job_gpu_mem_util_percent, slurm_job_cpu_util_seconds, slurm_job_mem_util_bytes
+    job_labels = ["slurm_job_id"] if aggregate_jobs else ["slurm_job_pid", "slurm_job_id"]
+    slurm_job_gpu_util_percent = Gauge(
+        "slurm_job_gpu_util_percent",
+        "GPU Compute utilization in percent",
+        ["cluster_name", "hostname", "gpu"] + job_labels
+    )
+    slurm_job_gpu_mem_util_percent = Gauge(
+        "slurm_job_gpu_mem_util_percent",
+        "GPU Memory utilization in percent",
+        ["cluster_name", "hostname", "gpu"] + job_labels
+    )
+    slurm_job_cpu_util_seconds = Gauge(
+        "slurm_job_cpu_util_seconds",
+        "CPU utilization in seconds",
+        ["cluster_name", "hostname"] + job_labels
+    )
+    slurm_job_mem_util_bytes = Gauge(
+        "slurm_job_mem_util_bytes",
+        "GPU Memory utilization in bytes",
+        ["cluster_name", "hostname"] + job_labels
+    )
 
 available_gpu_count = Gauge(
     "available_gpu_count", 
@@ -62,6 +67,7 @@ def get_cluster_name():
         if not SCONTROL_PATH:
             logger.error("scontrol not found in PATH")
             return cluster_name        
+        count_fork("nvml", "scontrol")
         scontrol_output = subprocess.check_output([SCONTROL_PATH, "show", f"node={gpu_host}", "-o", "--json"], universal_newlines=True)
         slurm_node_features = json.loads(scontrol_output)
         features = slurm_node_features['nodes'][0].get('features')
@@ -75,6 +81,7 @@ def get_cluster_name():
             logger.warning(f"Unexpected format for features: {features}")     
     except subprocess.CalledProcessError as e:
         logger.error(f"An error occurred: {e}")
+        count_error("nvml", "scontrol")
     return cluster_name.strip()
 
 
@@ -83,6 +90,7 @@ def get_slurm_job_id_from_scontrol(pid):
         if not SCONTROL_PATH:
             logger.error("scontrol not found in PATH")
             return "none"        
+        count_fork("nvml", "scontrol")
         result = subprocess.run(
             [SCONTROL_PATH, "pidinfo", str(pid)],
             capture_output=True,
@@ -98,88 +106,195 @@ def get_slurm_job_id_from_scontrol(pid):
             return "none"
     except subprocess.CalledProcessError as e:
         logger.error(f"Error running scontrol pidinfo: {e}")
+        count_error("nvml", "scontrol")
         return "none"
 
-def export_process_cpu_and_memory(pid, hostname, job_id):
+# Slurm cgroup paths look like /slurm/uid_1000/job_1234/step_0/task_0 (v1) or /system.slice/slurmstepd.scope/job_1234/step_0 (v2)
+SLURM_CGROUP_JOB = re.compile(r"/job_(\d+)(?:/|$)")
+SLURM_ENVIRON_JOB = (b"SLURM_JOB_ID=", b"SLURM_JOBID=")
+# pid -> (process start time, job id), only holds the processes seen in the last cycle
+job_cache = {}
+
+def get_process_start_time(pid):
+    # Field 22 of /proc/<pid>/stat, counted after the command name that can contain spaces
+    with open(f"/proc/{pid}/stat") as f:
+        return int(f.read().rsplit(")", 1)[1].split()[19])
+
+def get_slurm_job_id_from_cgroup(pid):
+    try:
+        with open(f"/proc/{pid}/cgroup") as f:
+            for line in f:
+                match = SLURM_CGROUP_JOB.search(line.strip().split(":", 2)[-1])
+                if match:
+                    return match.group(1)
+    except OSError as e:
+        logger.debug(f"Cannot read cgroup of PID {pid}: {e}")
+    return None
+
+def get_slurm_job_id_from_environ(pid):
+    try:
+        with open(f"/proc/{pid}/environ", "rb") as f:
+            for variable in f.read().split(b"\0"):
+                if variable.startswith(SLURM_ENVIRON_JOB):
+                    return variable.split(b"=", 1)[1].decode()
+    except OSError as e:
+        # Processes of other users are not readable
+        logger.debug(f"Cannot read environment of PID {pid}: {e}")
+    return None
+
+def get_slurm_job_id(pid):
+    """
+    Job of a process from its cgroup, or else its environment, scontrol pidinfo is only the last resort.
+    Resolved jobs are cached by PID and process start time so that a reused PID is resolved again,
+    "none" is not cached since it can come from a transient scontrol failure.
+    """
+    try:
+        start_time = get_process_start_time(pid)
+    except (OSError, IndexError, ValueError):
+        logger.debug(f"Process with PID {pid} not found.")
+        job_cache.pop(pid, None)
+        return "none"
+    cached = job_cache.get(pid)
+    if cached is not None and cached[0] == start_time:
+        return cached[1]
+    job_id = get_slurm_job_id_from_cgroup(pid)
+    if job_id is None:
+        job_id = get_slurm_job_id_from_environ(pid)
+    if job_id is None:
+        job_id = get_slurm_job_id_from_scontrol(pid)
+    if job_id != "none":
+        job_cache[pid] = (start_time, job_id)
+    return job_id
+
+def evict_job_cache(pids):
+    """ Forget the processes that are not running on a GPU anymore """
+    for pid in list(job_cache.keys()):
+        if not pid in pids:
+            del job_cache[pid]
+
+def get_process_cpu_and_memory(pid):
+    """ Returns the CPU time in seconds and the RSS in bytes of a process, or None if it exited """
     cpu_total = 0
     rss = 0
     try:
         proc = psutil.Process(pid)
     except psutil.NoSuchProcess:
         logger.debug(f"Process with PID {pid} not found.")
+        return None
 
     try:
         cpu_times = proc.cpu_times()
         cpu_total = cpu_times.user + cpu_times.system
     except Exception as e:
         logger.error(f"Error fetching CPU times for PID {pid}: {e}")
+        count_error("nvml", "process")
 
     try:
         mem_info = proc.memory_info()
         rss = mem_info.rss
     except Exception as e:
         logger.error(f"Error fetching memory info for PID {pid}: {e}")
-    
-    slurm_job_cpu_util_seconds.labels(cluster_name=cluster_name, hostname=hostname, slurm_job_id=job_id, slurm_job_pid=pid).set(cpu_total)
-    slurm_job_mem_util_bytes.labels(cluster_name=cluster_name, hostname=hostname, slurm_job_id=job_id, slurm_job_pid=pid).set(rss)
+        count_error("nvml", "process")
+    return cpu_total, rss
 
-def export_gpu_utilization(handle, pid, hostname, gpu_idx, job_id):
+def get_gpu_utilization(handle, pid, gpu_idx):
+    """ Returns the GPU and GPU memory utilization in percent of a process, or None if not available """
     try:
         stats = pynvml.nvmlDeviceGetAccountingStats(handle, pid)
         meminfo = pynvml.nvmlDeviceGetMemoryInfo(handle)
-        processMemUsage = max(round((stats.maxMemoryUsage/meminfo.total)*100), stats.memoryUtilization)        
-        slurm_job_gpu_util_percent.labels(
-            cluster_name=cluster_name,
-            hostname=hostname,
-            gpu=gpu_idx,
-            slurm_job_id=job_id,
-            slurm_job_pid=pid
-        ).set(stats.gpuUtilization)
-        slurm_job_gpu_mem_util_percent.labels(
-            cluster_name=cluster_name,
-            hostname=hostname,
-            gpu=gpu_idx,
-            slurm_job_id=job_id,
-            slurm_job_pid=pid
-        ).set(processMemUsage)
+        processMemUsage = max(round((stats.maxMemoryUsage/meminfo.total)*100), stats.memoryUtilization)
+        return stats.gpuUtilization, processMemUsage
     except pynvml.NVMLError as e:
         logger.error(f"Failed to get accounting stats for PID {pid} on GPU {gpu_idx}: {e}")
+        count_error("nvml", "nvml")
+        return None
+
+# Label values set during the last cycle, by gauge
+exported_series = {}
 
-def export_metrics():    
+def set_series(gauge, series):
+    """ Set the values of a gauge for this cycle and remove the series of the processes and jobs that ended """
+    for labels, value in series.items():
+        gauge.labels(*labels).set(value)
+    for labels in exported_series.get(gauge, set()) - set(series.keys()):
+        gauge.remove(*labels)
+    exported_series[gauge] = set(series.keys())
+
+def export_metrics():
+    with timed("nvml"):
+        export_job_metrics()
+
+def export_job_metrics():
     try:
         device_count = pynvml.nvmlDeviceGetCount()
         available_gpu_count.labels(cluster_name=cluster_name, hostname=hostname).set(device_count)
     except pynvml.NVMLError as e:
         logger.error(f"Failed to get device count: {e}")
+        count_error("nvml", "nvml")
         return
 
+    pids = set()
+    gpu_util = {}
+    gpu_mem_util = {}
+    cpu_util = {}
+    mem_util = {}
     for gpu_idx in range(device_count):
         try:
             handle = pynvml.nvmlDeviceGetHandleByIndex(gpu_idx)
         except pynvml.NVMLError as e:
             logger.error(f"Failed to get handle for GPU {gpu_idx}: {e}")
+            count_error("nvml", "nvml")
             continue
 
         try:
             processes = pynvml.nvmlDeviceGetComputeRunningProcesses(handle)
         except pynvml.NVMLError:
             logger.error(f"Failed to get processes for GPU {gpu_idx}")
+            count_error("nvml", "nvml")
             processes = []    
         
         logger.debug(f"GPU {gpu_idx} has {len(processes)} processes running")
 
         for proc_info in processes:
             pid = proc_info.pid
-            job_id = get_slurm_job_id_from_scontrol(pid)
+            job_id = get_slurm_job_id(pid)
             logger.debug(f"Found job {job_id} running on GPU {gpu_idx}")
-            export_process_cpu_and_memory(pid, hostname, job_id)
-            export_gpu_utilization(handle, pid, hostname, gpu_idx, job_id)
+            job = (str(job_id),) if aggregate_jobs else (str(pid), str(job_id))
+            # A process using several GPUs is only counted once for CPU and memory
+            if not pid in pids:
+                usage = get_process_cpu_and_memory(pid)
+                if usage is not None:
+                    key = (cluster_name, hostname) + job
+                    cpu_util[key] = cpu_util.get(key, 0) + usage[0]
+                    mem_util[key] = mem_util.get(key, 0) + usage[1]
+            pids.add(pid)
+            utilization = get_gpu_utilization(handle, pid, gpu_idx)
+            if utilization is not None:
+                key = (cluster_name, hostname, str(gpu_idx)) + job
+                gpu_util[key] = gpu_util.get(key, 0) + utilization[0]
+                gpu_mem_util[key] = gpu_mem_util.get(key, 0) + utilization[1]
+
+    set_series(slurm_job_gpu_util_percent, gpu_util)
+    set_series(slurm_job_gpu_mem_util_percent, gpu_mem_util)
+    set_series(slurm_job_cpu_util_seconds, cpu_util)
+    set_series(slurm_job_mem_util_bytes, mem_util)
+    evict_job_cache(pids)
+
+def configure(aggregate, host=None):
+    """ Set up the gauges and the labels of the host, also used by the node agent """
+    global cluster_name, hostname, aggregate_jobs
+    aggregate_jobs = aggregate
+    create_job_gauges(aggregate)
+    cluster_name = get_cluster_name()
+    hostname = socket.gethostname() if host is None else host
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the GPU, CPU and memory utilization of Slurm jobs on port 9800')
+    parser.add_argument('--aggregate-jobs', help='If present, sum the utilization of the processes of each job and drop the slurm_job_pid label', action='store_true', default=False)
+    args = parser.parse_args()
+    configure(args.aggregate_jobs)
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)    
-    cluster_name = get_cluster_name()
-    hostname = socket.gethostname()
     start_http_server(9800)
     pynvml.nvmlInit()
     try:
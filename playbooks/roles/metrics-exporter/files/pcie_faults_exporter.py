@@ -1,28 +1,20 @@
-from datetime import datetime, timedelta, timezone
-from prometheus_client import start_http_server, Gauge
+from prometheus_client import start_http_server
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
 import logging
 import os
 import re
+import threading
 import time
 import pyudev
+from exporter_metrics import timed, count_error
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-rdma_pcie_mapping = {}
-nvme_pcie_mapping = {}
-gpu_pcie_mapping = {}
-
-pcie_aer_correctable_error_count = Gauge('pcie_aer_correctable_error_count', 'PCI AER correctable error count',
-                         ['hostname', 'device', 'device_type', 'pcie'])
-pcie_aer_fatal_error_count = Gauge('pcie_aer_fatal_error_count', 'PCI AER fatal error count',
-                         ['hostname', 'device', 'device_type', 'pcie'])
-pcie_aer_nonfatal_error_count = Gauge('pcie_aer_nonfatal_error_count', 'PCI AER non-fatal error count',
-                         ['hostname', 'device', 'device_type', 'pcie'])
-pcie_bus_linkwidth_status = Gauge('pcie_bus_linkwidth_status', 'PCI Link Width mismatch detected (1=error, 0=ok)',
-                         ['hostname', 'device', 'device_type', 'pcie'])
-pcie_bus_inaccessible_status = Gauge('pcie_bus_inaccessible_status', 'PCI Bus Inaccessible (1=error, 0=ok)',
-                        ['hostname', 'device', 'device_type', 'pcie'])
+LABELS = ['hostname', 'device', 'device_type', 'pcie']
+# Display controllers of NVIDIA, NVSwitches are bridges and not listed
+NVIDIA_VENDOR = "0x10de"
+GPU_CLASSES = ("0x0300", "0x0302")
 
 def read_and_parse_sys_file(file_path, key=""):
     try:
@@ -43,9 +35,11 @@ def read_and_parse_sys_file(file_path, key=""):
         return None
     except ValueError as e:
         logger.info(f"Failed to parse integer value for key '{key}' in file {file_path}: {e}")
+        count_error("pcie", "parse")
         return None
     except Exception as e:
         logger.info(f"Error reading file {file_path}: {e}")
+        count_error("pcie", "read")
         return None
 
 def get_pci_addresses(subsystem):
@@ -60,78 +54,132 @@ def get_pci_addresses(subsystem):
     return devices
 
 def get_gpu_pci_addresses():
-    import subprocess
+    """ GPUs named nvidia<index> in PCI address order, like nvidia-smi lists them """
+    context = pyudev.Context()
     devices = {}
-    try:
-        out = subprocess.check_output([
-            "nvidia-smi",
-            "--query-gpu=pci.bus_id",
-            "--format=csv,noheader,nounits"
-        ], stderr=subprocess.DEVNULL).decode().strip()
-        
-        bus_ids = [line.strip() for line in out.splitlines() if line.strip()]
-        
-        for gpu_index, bus_id in enumerate(bus_ids):
-            normalized_bus_id = bus_id.lower()
-            if normalized_bus_id.startswith('0000:'):
-                normalized_bus_id = normalized_bus_id[5:]
-            else:
-                normalized_bus_id = normalized_bus_id[4:]
-            
-            device_sys_path = f"/sys/bus/pci/devices/{normalized_bus_id}"
-            gpu_device_name = f"nvidia{gpu_index}"
-            devices[gpu_device_name] = {
-                'pcie_addr': normalized_bus_id, 
-                'pcie_path': device_sys_path, 
-                'path_len': len(device_sys_path.split('/'))
-            }
-    except subprocess.CalledProcessError:
-        logger.info("nvidia-smi failed or no NVIDIA GPUs found")
-    except Exception as e:
-        logger.info(f"Error getting GPU PCI addresses: {e}")
-    
+    gpus = []
+    for device in context.list_devices(subsystem="pci"):
+        if device.attributes.get("vendor") == NVIDIA_VENDOR.encode() and device.attributes.get("class", b"").decode().startswith(GPU_CLASSES):
+            gpus.append(device.sys_name)
+    for gpu_index, bus_id in enumerate(sorted(gpus)):
+        device_sys_path = f"/sys/bus/pci/devices/{bus_id}"
+        devices[f"nvidia{gpu_index}"] = {
+            'pcie_addr': bus_id,
+            'pcie_path': device_sys_path,
+            'path_len': len(device_sys_path.split('/'))
+        }
     return devices
 
-def collect_pcie_metrics(hostname, device_mapping, device_type):
+def read_link_speed(file_path):
+    """ Link speed in GT/s from content like "16.0 GT/s PCIe", None if unknown """
+    try:
+        with open(file_path, 'r') as file:
+            match = re.search(r"([\d.]+) GT/s", file.read())
+        return float(match.group(1)) if match else None
+    except (OSError, ValueError):
+        return None
+
+class PcieCollector(object):
+    """
+    Reads the AER counters and the link status of the NVMe, RDMA and GPU devices at scrape time.
+    The device lists are built again after udev reports a PCI, infiniband or NVMe change.
+    """
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.lock = threading.Lock()
+        self.refresh_needed = True
+        self.devices = []
+
+    def discover(self):
+        self.devices = [
+            ("NVME", get_pci_addresses("nvme")),
+            ("RDMA", get_pci_addresses("infiniband")),
+            ("GPU", get_gpu_pci_addresses()),
+        ]
+        self.refresh_needed = False
+        for device_type, device_mapping in self.devices:
+            logger.info(f"Found {len(device_mapping)} {device_type} devices")
+
+    def refresh(self):
+        self.refresh_needed = True
+
+    def collect(self):
+        families = {
+            'correctable': GaugeMetricFamily('pcie_aer_correctable_error_count', 'PCI AER correctable error count', labels=LABELS),
+            'fatal': GaugeMetricFamily('pcie_aer_fatal_error_count', 'PCI AER fatal error count', labels=LABELS),
+            'nonfatal': GaugeMetricFamily('pcie_aer_nonfatal_error_count', 'PCI AER non-fatal error count', labels=LABELS),
+            'linkwidth': GaugeMetricFamily('pcie_bus_linkwidth_status', 'PCI Link Width mismatch detected (1=error, 0=ok)', labels=LABELS),
+            'inaccessible': GaugeMetricFamily('pcie_bus_inaccessible_status', 'PCI Bus Inaccessible (1=error, 0=ok)', labels=LABELS),
+            'speed': GaugeMetricFamily('pcie_link_speed_gts', 'Current PCI link speed in GT/s', labels=LABELS),
+            'max_speed': GaugeMetricFamily('pcie_max_link_speed_gts', 'Maximum PCI link speed in GT/s', labels=LABELS),
+            'width': GaugeMetricFamily('pcie_link_width', 'Current PCI link width in lanes', labels=LABELS),
+            'max_width': GaugeMetricFamily('pcie_max_link_width', 'Maximum PCI link width in lanes', labels=LABELS),
+        }
+        with self.lock, timed("pcie"):
+            if self.refresh_needed:
+                self.discover()
+            for device_type, device_mapping in self.devices:
+                collect_pcie_metrics(self.hostname, device_mapping, device_type, families)
+        return list(families.values())
+
+def start_udev_monitor(collector):
+    context = pyudev.Context()
+    monitor = pyudev.Monitor.from_netlink(context)
+    for subsystem in ["pci", "infiniband", "nvme"]:
+        monitor.filter_by(subsystem=subsystem)
+    observer = pyudev.MonitorObserver(monitor, callback=lambda device: collector.refresh(), name='pcie-udev-monitor')
+    observer.daemon = True
+    observer.start()
+    return observer
+
+def collect_pcie_metrics(hostname, device_mapping, device_type, families):
     for device in device_mapping.keys():
         pcimap = device_mapping[device]
+        labels = [hostname, device, device_type, pcimap['pcie_addr']]
         correctable_error_count = read_and_parse_sys_file(pcimap['pcie_path'] + "/aer_dev_correctable", "TOTAL_ERR_COR")
         fatal_error_count = read_and_parse_sys_file(pcimap['pcie_path'] + "/aer_dev_fatal", "TOTAL_ERR_FATAL")
         nonfatal_error_count = read_and_parse_sys_file(pcimap['pcie_path'] + "/aer_dev_nonfatal", "TOTAL_ERR_NONFATAL")
         current_link_speed = read_and_parse_sys_file(pcimap['pcie_path'] + "/current_link_speed")
         current_link_width = read_and_parse_sys_file(pcimap['pcie_path'] + "/current_link_width")
         if current_link_speed is None or current_link_width is None:
-            pcie_bus_inaccessible_status.labels(hostname=hostname, device=device, device_type=device_type, pcie=pcimap['pcie_addr']).set(1)
+            families['inaccessible'].add_metric(labels, 1)
         else:
-            pcie_bus_inaccessible_status.labels(hostname=hostname, device=device, device_type=device_type, pcie=pcimap['pcie_addr']).set(0)
+            families['inaccessible'].add_metric(labels, 0)
 
         if device_type == "RDMA" and pcimap['path_len']==14:
            if current_link_width == current_link_speed:
-              pcie_bus_linkwidth_status.labels(hostname=hostname, device=device, device_type=device_type, pcie=pcimap['pcie_addr']).set(0)
+              families['linkwidth'].add_metric(labels, 0)
            else:
-              pcie_bus_linkwidth_status.labels(hostname=hostname, device=device, device_type=device_type, pcie=pcimap['pcie_addr']).set(1)
+              families['linkwidth'].add_metric(labels, 1)
         elif device_type == "GPU":
            if current_link_width and current_link_speed:
-              pcie_bus_linkwidth_status.labels(hostname=hostname, device=device, device_type=device_type, pcie=pcimap['pcie_addr']).set(0)
+              families['linkwidth'].add_metric(labels, 0)
            else:
-              pcie_bus_linkwidth_status.labels(hostname=hostname, device=device, device_type=device_type, pcie=pcimap['pcie_addr']).set(1)
+              families['linkwidth'].add_metric(labels, 1)
 
-        correctable_error_count = correctable_error_count or 0
-        fatal_error_count = fatal_error_count or 0
-        nonfatal_error_count = nonfatal_error_count or 0        
-        pcie_aer_correctable_error_count.labels(hostname=hostname, device=device, device_type=device_type, pcie=pcimap['pcie_addr']).set(correctable_error_count)
-        pcie_aer_fatal_error_count.labels(hostname=hostname, device=device, device_type=device_type, pcie=pcimap['pcie_addr']).set(fatal_error_count)
-        pcie_aer_nonfatal_error_count.labels(hostname=hostname, device=device, device_type=device_type, pcie=pcimap['pcie_addr']).set(nonfatal_error_count)
+        link_speed = read_link_speed(pcimap['pcie_path'] + "/current_link_speed")
+        max_link_speed = read_link_speed(pcimap['pcie_path'] + "/max_link_speed")
+        max_link_width = read_and_parse_sys_file(pcimap['pcie_path'] + "/max_link_width")
+        if link_speed is not None:
+            families['speed'].add_metric(labels, link_speed)
+        if max_link_speed is not None:
+            families['max_speed'].add_metric(labels, max_link_speed)
+        if current_link_width is not None:
+            families['width'].add_metric(labels, current_link_width)
+        if max_link_width is not None:
+            families['max_width'].add_metric(labels, max_link_width)
+
+        families['correctable'].add_metric(labels, correctable_error_count or 0)
+        families['fatal'].add_metric(labels, fatal_error_count or 0)
+        families['nonfatal'].add_metric(labels, nonfatal_error_count or 0)
 
 if __name__ == "__main__":
     hostname = os.uname().nodename
-    rdma_pcie_mapping = get_pci_addresses("infiniband")
-    nvme_pcie_mapping = get_pci_addresses("nvme")
-    gpu_pcie_mapping = get_gpu_pci_addresses()
+    collector = PcieCollector(hostname)
+    collector.discover()
+    start_udev_monitor(collector)
+    REGISTRY.register(collector)
+    # Start up the server to expose the metrics, sysfs is read when Prometheus scrapes
     start_http_server(9700)
     while True:
-        collect_pcie_metrics(hostname, nvme_pcie_mapping, "NVME")
-        collect_pcie_metrics(hostname, rdma_pcie_mapping, "RDMA")
-        collect_pcie_metrics(hostname, gpu_pcie_mapping, "GPU")
-        time.sleep(60)
-
+        time.sleep(3600)
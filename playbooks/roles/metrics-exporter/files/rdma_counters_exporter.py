@@ -1,125 +1,287 @@
-from prometheus_client import start_http_server, Gauge
+from prometheus_client import start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+from collections import deque
+import argparse
+from exporter_metrics import timed, count_error
+import logging
+import os
+import socket
+import threading
 import time
-import subprocess
 
-# Define Prometheus metrics
+try:
+    import pyudev
+    pyudev_available = True
+except ImportError:
+    pyudev_available = False
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SYSFS_INFINIBAND = "/sys/class/infiniband"
+# Rediscover the NICs at this interval when pyudev is not available
+DISCOVERY_INTERVAL = 300
+
+# Metric name, file under /sys/class/infiniband/<nic>/ports/1 and description
+# Everything but the port states is a hardware counter that only goes up until the driver is reloaded
 # HW Counters for ROCEv2
-np_ecn_marked_roce_packets = Gauge('rdma_np_ecn_marked_roce_packets', 'Number of ROCEv2 packets marked for congestion', ['hostname', 'interface'])
-out_of_sequence = Gauge('rdma_out_of_sequence', 'Number of out of sequence packets received.', ['hostname', 'interface'])
-packet_seq_err = Gauge('rdma_packet_seq_err', 'Number of received NAK sequence error packets', ['hostname', 'interface'])
-local_ack_timeout_err = Gauge('rdma_local_ack_timeout_err', 'Number of times QPs ack timer expired', ['hostname', 'interface'])
-roce_adp_retrans = Gauge('rdma_roce_adp_retrans', 'Number of adaptive retransmissions for RoCE traffic', ['hostname', 'interface'])
-np_cnp_sent = Gauge('rdma_np_cnp_sent', 'Number of CNP packets sent', ['hostname', 'interface'])
-rp_cnp_handled = Gauge('rdma_rp_cnp_handled', 'Number of CNP packets handled to throttle', ['hostname', 'interface'])
-rp_cnp_ignored = Gauge('rdma_rp_cnp_ignored', 'Number of CNP packets received and ignored', ['hostname', 'interface'])
-rx_icrc_encapsulated = Gauge('rdma_rx_icrc_encapsulated', 'Number of RoCE packets with ICRC (Invertible Cyclic Redundancy Check) errors', ['hostname', 'interface'])
-roce_slow_restart = Gauge('rdma_roce_slow_restart', 'Number of times RoCE slow restart was used', ['hostname', 'interface'])
+RDMA_METRICS = [
+    ('rdma_np_ecn_marked_roce_packets', 'hw_counters/np_ecn_marked_roce_packets', 'Number of ROCEv2 packets marked for congestion'),
+    ('rdma_out_of_sequence', 'hw_counters/out_of_sequence', 'Number of out of sequence packets received.'),
+    ('rdma_packet_seq_err', 'hw_counters/packet_seq_err', 'Number of received NAK sequence error packets'),
+    ('rdma_local_ack_timeout_err', 'hw_counters/local_ack_timeout_err', 'Number of times QPs ack timer expired'),
+    ('rdma_roce_adp_retrans', 'hw_counters/roce_adp_retrans', 'Number of adaptive retransmissions for RoCE traffic'),
+    ('rdma_np_cnp_sent', 'hw_counters/np_cnp_sent', 'Number of CNP packets sent'),
+    ('rdma_rp_cnp_handled', 'hw_counters/rp_cnp_handled', 'Number of CNP packets handled to throttle'),
+    ('rdma_rp_cnp_ignored', 'hw_counters/rp_cnp_ignored', 'Number of CNP packets received and ignored'),
+    ('rdma_rx_icrc_encapsulated', 'hw_counters/rx_icrc_encapsulated', 'Number of RoCE packets with ICRC (Invertible Cyclic Redundancy Check) errors'),
+    ('rdma_roce_slow_restart', 'hw_counters/roce_slow_restart', 'Number of times RoCE slow restart was used'),
+]
 # Port Counters for Infiniband
-ib_link_state = Gauge('ib_link_state', 'Port State', ['hostname', 'interface'])
-ib_link_phys_state = Gauge('ib_link_phys_state', 'Port Physical State', ['hostname', 'interface'])
-ib_symbol_error = Gauge('ib_symbol_error', 'Total number of minor link errors detected on one or more physical lanes', ['hostname', 'interface'])
-ib_port_rcv_errors = Gauge('ib_port_rcv_errors', 'Total number of packets containing an error that were received on the port', ['hostname', 'interface'])
-ib_port_rcv_remote_phsyical_errors = Gauge('ib_port_rcv_remote_phsyical_errors', 'Total number of packets marked with the EBP delimiter received on the port', ['hostname', 'interface'])
-ib_port_rcv_switch_relay_errors = Gauge('ib_port_rcv_switch_relay_errors', 'Total number of packets received on the port that were discarded because they could not be forwarded by the switch relay', ['hostname', 'interface'])
-ib_link_error_recovery = Gauge('ib_link_error_recovery', 'Total number of times the Port Training state machine has successfully completed the link error recovery process', ['hostname', 'interface'])
-ib_port_xmit_constraint_errors =  Gauge('ib_port_xmit_constraint_errors', 'Total number of packets not transmitted from the switch physical port due to outbound raw filtering or failing outbound partition or IP version check', ['hostname', 'interface'])
-ib_port_rcv_contraint_errors = Gauge('ib_port_rcv_contraint_errors', 'Total number of packets received on the switch physical port that are discarded due to inbound raw filtering or failing inbound partition or IP version check.', ['hostname', 'interface'])
-ib_local_link_integrity_errors = Gauge('ib_local_link_integrity_errors', 'The number of times that the count of local physical errors exceeded the threshold specified by LocalPhyErrors', ['hostname', 'interface'])
-ib_excessive_buffer_overrun_errors = Gauge('ib_excessive_buffer_overrun_errors', 'This counter, indicates an input buffer overrun. It indicates possible misconfiguration of a port, either by the Subnet Manager (SM) or by user intervention. It can also indicate hardware issues or extremely poor link signal integrity', ['hostname', 'interface'])
-ib_port_xmit_data = Gauge('ib_port_xmit_data', 'Total number of data octets, divided by 4 (lanes), transmitted on all VLs', ['hostname', 'interface'])
-ib_port_rcv_data = Gauge('ib_port_rcv_data', 'Total number of data octets, divided by 4 (lanes), received on all VLs', ['hostname', 'interface'])
-ib_port_xmit_packets = Gauge('ib_port_xmit_packets', 'Total number of packets transmitted on all VLs from this port. This may include packets with errors', ['hostname', 'interface'])
-ib_port_rcv_packets = Gauge('ib_port_rcv_packets', 'Total number of packets received on all VLs from this port. This may include packets with errors', ['hostname', 'interface'])
-ib_unicast_rcv_packets = Gauge('ib_unicast_rcv_packets', 'Total number of unicast packets, including unicast packets containing errors', ['hostname', 'interface'])
-ib_unicast_xmit_packets = Gauge('ib_unicast_xmit_packets', 'Total number of unicast packets transmitted on all VLs from the port. This may include unicast packets with errors', ['hostname', 'interface'])
-ib_multicast_rcv_packets = Gauge('ib_multicast_rcv_packets', 'Total number of multicast packets received on all VLS from the port. This may include multicast packets with errors', ['hostname', 'interface'])
-ib_multicast_xmit_packets = Gauge('ib_multicast_xmit_packets', 'Total number of multicast packets transmitted on all VLs from the port. This may include multicast packets with errors', ['hostname', 'interface'])
-ib_link_downed = Gauge('ib_link_downed', 'Total number of times the Port Training state machine has failed the link error recovery process and downed the link', ['hostname', 'interface'])
-ib_port_xmit_discards = Gauge('ib_port_xmit_discards', 'Total number of outbound packets discarded by the port because the port is down or congested', ['hostname', 'interface'])
-ib_VL15_dropped = Gauge('ib_VL15_dropped', 'Number of incoming VL15 packets dropped due to resource limitations', ['hostname', 'interface'])
-ib_port_xmit_wait = Gauge('ib_port_xmit_wait', 'The number of ticks during which the port had data to transmit but no data was sent during the entire tick (either because of insufficient credits or because of lack of arbitration)', ['hostname', 'interface'])
-
-def get_rdma_metrics():
-    hostname = subprocess.getoutput("hostname")
-    rdma_nics = subprocess.getoutput("rdma link show | grep rdma | cut -d ' ' -f2 | sed 's/\/1//g' | tr '\n' ' '").split()
-    for nic in rdma_nics:
-        # Hardware counters for ROCEv2 Diagnostics
-        ecn_packets = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/hw_counters/np_ecn_marked_roce_packets".format(nic=nic)))
-        out_of_seq = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/hw_counters/out_of_sequence".format(nic=nic)))
-        seq_err = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/hw_counters/packet_seq_err".format(nic=nic)))
-        local_ack_timeout = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/hw_counters/local_ack_timeout_err".format(nic=nic)))
-        adp_retrans = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/hw_counters/roce_adp_retrans".format(nic=nic)))
-        cnp_sent = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/hw_counters/np_cnp_sent".format(nic=nic)))
-        cnp_handled = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/hw_counters/rp_cnp_handled".format(nic=nic)))
-        cnp_ignored = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/hw_counters/rp_cnp_ignored".format(nic=nic)))
-        icrc_encaps = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/hw_counters/rx_icrc_encapsulated".format(nic=nic)))
-        slow_restart = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/hw_counters/roce_slow_restart".format(nic=nic)))
-
-        # Port counters for Mellanox Port Diagnostics
-        link_state = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/state".format(nic=nic)).split(':')[0])
-        link_phys_state = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/phys_state".format(nic=nic)).split(':')[0]) 
-        symbol_error = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/symbol_error".format(nic=nic)))
-        port_rcv_errors = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/port_rcv_errors".format(nic=nic)))
-        port_rcv_remote_phsyical_errors = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/port_rcv_remote_physical_errors".format(nic=nic)))
-        port_rcv_switch_relay_errors = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/port_rcv_switch_relay_errors".format(nic=nic)))
-        link_error_recovery = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/link_error_recovery".format(nic=nic)))
-        port_xmit_constraint_errors = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/port_xmit_constraint_errors".format(nic=nic)))
-        port_rcv_contraint_errors = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/port_rcv_constraint_errors".format(nic=nic)))
-        local_link_integrity_errors = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/local_link_integrity_errors".format(nic=nic)))
-        excessive_buffer_overrun_errors = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/excessive_buffer_overrun_errors".format(nic=nic)))
-        port_xmit_data = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/port_xmit_data".format(nic=nic)))
-        port_rcv_data = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/port_rcv_data".format(nic=nic)))
-        port_xmit_packets = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/port_xmit_packets".format(nic=nic)))
-        port_rcv_packets = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/port_rcv_packets".format(nic=nic)))
-        unicast_rcv_packets = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/unicast_rcv_packets".format(nic=nic)))
-        unicast_xmit_packets = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/unicast_xmit_packets".format(nic=nic)))
-        multicast_rcv_packets = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/multicast_rcv_packets".format(nic=nic)))
-        multicast_xmit_packets = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/multicast_xmit_packets".format(nic=nic)))
-        link_downed = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/link_downed".format(nic=nic)))
-        port_xmit_discards = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/port_xmit_discards".format(nic=nic)))
-        VL15_dropped = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/VL15_dropped".format(nic=nic)))
-        port_xmit_wait = int(subprocess.getoutput("cat /sys/class/infiniband/{nic}/ports/1/counters/port_xmit_wait".format(nic=nic)))
-        
-        # Publish metrics
-        np_ecn_marked_roce_packets.labels(hostname=hostname, interface=nic).set(ecn_packets)
-        out_of_sequence.labels(hostname=hostname, interface=nic).set(out_of_seq)
-        packet_seq_err.labels(hostname=hostname, interface=nic).set(seq_err)
-        local_ack_timeout_err.labels(hostname=hostname, interface=nic).set(local_ack_timeout)
-        roce_adp_retrans.labels(hostname=hostname, interface=nic).set(adp_retrans)
-        np_cnp_sent.labels(hostname=hostname, interface=nic).set(cnp_sent)
-        rp_cnp_handled.labels(hostname=hostname, interface=nic).set(cnp_handled)
-        rp_cnp_ignored.labels(hostname=hostname, interface=nic).set(cnp_ignored)
-        rx_icrc_encapsulated.labels(hostname=hostname, interface=nic).set(icrc_encaps)
-        roce_slow_restart.labels(hostname=hostname, interface=nic).set(slow_restart)
-
-        ib_link_state.labels(hostname=hostname, interface=nic).set(link_state)
-        ib_link_phys_state.labels(hostname=hostname, interface=nic).set(link_phys_state)
-        ib_symbol_error.labels(hostname=hostname, interface=nic).set(symbol_error)
-        ib_port_rcv_errors.labels(hostname=hostname, interface=nic).set(port_rcv_errors)
-        ib_port_rcv_remote_phsyical_errors.labels(hostname=hostname, interface=nic).set(port_rcv_remote_phsyical_errors)
-        ib_port_rcv_switch_relay_errors.labels(hostname=hostname, interface=nic).set(port_rcv_switch_relay_errors)
-        ib_link_error_recovery.labels(hostname=hostname, interface=nic).set(link_error_recovery)
-        ib_port_xmit_constraint_errors.labels(hostname=hostname, interface=nic).set(port_xmit_constraint_errors)
-        ib_port_rcv_contraint_errors.labels(hostname=hostname, interface=nic).set(port_rcv_contraint_errors)
-        ib_local_link_integrity_errors.labels(hostname=hostname, interface=nic).set(local_link_integrity_errors)
-        ib_excessive_buffer_overrun_errors.labels(hostname=hostname, interface=nic).set(excessive_buffer_overrun_errors)
-        ib_port_xmit_data.labels(hostname=hostname, interface=nic).set(port_xmit_data)
-        ib_port_rcv_data.labels(hostname=hostname, interface=nic).set(port_rcv_data)
-        ib_port_xmit_packets.labels(hostname=hostname, interface=nic).set(port_xmit_packets)
-        ib_port_rcv_packets.labels(hostname=hostname, interface=nic).set(port_rcv_packets)
-        ib_unicast_rcv_packets.labels(hostname=hostname, interface=nic).set(unicast_rcv_packets)
-        ib_unicast_xmit_packets.labels(hostname=hostname, interface=nic).set(unicast_xmit_packets)
-        ib_multicast_rcv_packets.labels(hostname=hostname, interface=nic).set(multicast_rcv_packets)
-        ib_multicast_xmit_packets.labels(hostname=hostname, interface=nic).set(multicast_xmit_packets)
-        ib_link_downed.labels(hostname=hostname, interface=nic).set(link_downed)
-        ib_port_xmit_discards.labels(hostname=hostname, interface=nic).set(port_xmit_discards)
-        ib_VL15_dropped.labels(hostname=hostname, interface=nic).set(VL15_dropped)
-        ib_port_xmit_wait.labels(hostname=hostname, interface=nic).set(port_xmit_wait)
+IB_METRICS = [
+    ('ib_link_state', 'state', 'Port State'),
+    ('ib_link_phys_state', 'phys_state', 'Port Physical State'),
+    ('ib_symbol_error', 'counters/symbol_error', 'Total number of minor link errors detected on one or more physical lanes'),
+    ('ib_port_rcv_errors', 'counters/port_rcv_errors', 'Total number of packets containing an error that were received on the port'),
+    ('ib_port_rcv_remote_phsyical_errors', 'counters/port_rcv_remote_physical_errors', 'Total number of packets marked with the EBP delimiter received on the port'),
+    ('ib_port_rcv_switch_relay_errors', 'counters/port_rcv_switch_relay_errors', 'Total number of packets received on the port that were discarded because they could not be forwarded by the switch relay'),
+    ('ib_link_error_recovery', 'counters/link_error_recovery', 'Total number of times the Port Training state machine has successfully completed the link error recovery process'),
+    ('ib_port_xmit_constraint_errors', 'counters/port_xmit_constraint_errors', 'Total number of packets not transmitted from the switch physical port due to outbound raw filtering or failing outbound partition or IP version check'),
+    ('ib_port_rcv_contraint_errors', 'counters/port_rcv_constraint_errors', 'Total number of packets received on the switch physical port that are discarded due to inbound raw filtering or failing inbound partition or IP version check.'),
+    ('ib_local_link_integrity_errors', 'counters/local_link_integrity_errors', 'The number of times that the count of local physical errors exceeded the threshold specified by LocalPhyErrors'),
+    ('ib_excessive_buffer_overrun_errors', 'counters/excessive_buffer_overrun_errors', 'This counter, indicates an input buffer overrun. It indicates possible misconfiguration of a port, either by the Subnet Manager (SM) or by user intervention. It can also indicate hardware issues or extremely poor link signal integrity'),
+    ('ib_port_xmit_data', 'counters/port_xmit_data', 'Total number of data octets, divided by 4 (lanes), transmitted on all VLs'),
+    ('ib_port_rcv_data', 'counters/port_rcv_data', 'Total number of data octets, divided by 4 (lanes), received on all VLs'),
+    ('ib_port_xmit_packets', 'counters/port_xmit_packets', 'Total number of packets transmitted on all VLs from this port. This may include packets with errors'),
+    ('ib_port_rcv_packets', 'counters/port_rcv_packets', 'Total number of packets received on all VLs from this port. This may include packets with errors'),
+    ('ib_unicast_rcv_packets', 'counters/unicast_rcv_packets', 'Total number of unicast packets, including unicast packets containing errors'),
+    ('ib_unicast_xmit_packets', 'counters/unicast_xmit_packets', 'Total number of unicast packets transmitted on all VLs from the port. This may include unicast packets with errors'),
+    ('ib_multicast_rcv_packets', 'counters/multicast_rcv_packets', 'Total number of multicast packets received on all VLS from the port. This may include multicast packets with errors'),
+    ('ib_multicast_xmit_packets', 'counters/multicast_xmit_packets', 'Total number of multicast packets transmitted on all VLs from the port. This may include multicast packets with errors'),
+    ('ib_link_downed', 'counters/link_downed', 'Total number of times the Port Training state machine has failed the link error recovery process and downed the link'),
+    ('ib_port_xmit_discards', 'counters/port_xmit_discards', 'Total number of outbound packets discarded by the port because the port is down or congested'),
+    ('ib_VL15_dropped', 'counters/VL15_dropped', 'Number of incoming VL15 packets dropped due to resource limitations'),
+    ('ib_port_xmit_wait', 'counters/port_xmit_wait', 'The number of ticks during which the port had data to transmit but no data was sent during the entire tick (either because of insufficient credits or because of lack of arbitration)'),
+]
+METRICS = RDMA_METRICS + IB_METRICS
+GAUGES = ['ib_link_state', 'ib_link_phys_state']
+# Counters are 64 bit in sysfs, some older drivers still expose 32 bit ones
+COUNTER_WIDTHS = [32, 64]
+
+def get_rdma_nics():
+    """ RDMA devices whose network interface is named rdma*, like `rdma link show | grep rdma` """
+    nics = []
+    try:
+        devices = sorted(os.listdir(SYSFS_INFINIBAND))
+    except OSError:
+        return nics
+    for nic in devices:
+        try:
+            netdevs = os.listdir(os.path.join(SYSFS_INFINIBAND, nic, "device", "net"))
+        except OSError:
+            continue
+        if any(netdev.startswith("rdma") for netdev in netdevs):
+            nics.append(nic)
+    return nics
+
+def read_counter(fd):
+    # state and phys_state look like "4: ACTIVE"
+    return int(os.pread(fd, 64, 0).split(b':')[0])
+
+class RdmaCollector(object):
+    """
+    Reads the counters of every RDMA NIC at scrape time.
+    The counter files are opened once and re-read with os.pread, no process is forked per scrape.
+    """
+    def __init__(self, hostname, get_nics=get_rdma_nics):
+        self.hostname = hostname
+        self.get_nics = get_nics
+        self.lock = threading.Lock()
+        self.fds = {}
+        self.discovered = 0
+        self.refresh_needed = True
+
+    def close(self):
+        for nic_fds in self.fds.values():
+            for fd in nic_fds.values():
+                os.close(fd)
+        self.fds = {}
+
+    def discover(self):
+        self.close()
+        for nic in self.get_nics():
+            nic_fds = {}
+            for name, path, description in METRICS:
+                try:
+                    nic_fds[name] = os.open(os.path.join(SYSFS_INFINIBAND, nic, "ports", "1", path), os.O_RDONLY)
+                except OSError as e:
+                    logger.debug(f"Counter {path} not available on {nic}: {e}")
+            self.fds[nic] = nic_fds
+        self.discovered = time.time()
+        self.refresh_needed = False
+        logger.info(f"Monitoring RDMA NICs: {' '.join(self.fds.keys())}")
+
+    def refresh(self):
+        """ Called from the udev monitor when an infiniband device is added or removed """
+        self.refresh_needed = True
+
+    def read_counters(self):
+        """ Returns the current value of every counter by (interface, metric name) """
+        values = {}
+        with self.lock:
+            if self.refresh_needed or (not pyudev_available and time.time() - self.discovered > DISCOVERY_INTERVAL):
+                self.discover()
+            for nic, nic_fds in self.fds.items():
+                for name, fd in nic_fds.items():
+                    try:
+                        values[(nic, name)] = read_counter(fd)
+                    except ValueError as e:
+                        logger.info(f"Cannot parse {name} on {nic}: {e}")
+                        count_error("rdma", "parse")
+                    except OSError as e:
+                        # The device went away, find the NICs again on the next read
+                        logger.info(f"Cannot read {name} on {nic}: {e}")
+                        count_error("rdma", "read")
+                        self.refresh_needed = True
+        return values
+
+    def collect(self):
+        families = {}
+        for name, path, description in METRICS:
+            if name in GAUGES:
+                families[name] = GaugeMetricFamily(name, description, labels=['hostname', 'interface'])
+            else:
+                families[name] = CounterMetricFamily(name, description, labels=['hostname', 'interface'])
+        with timed("rdma"):
+            for (nic, name), value in self.read_counters().items():
+                families[name].add_metric([self.hostname, nic], value)
+        return list(families.values())
+
+def counter_delta(previous, value):
+    """
+    Increase of a counter between two reads.
+    A counter that goes back from close to its maximum wrapped around, any other decrease
+    means the counters were reset (driver reload) and the new value is what was counted since.
+    """
+    if value >= previous:
+        return value - previous
+    for bits in COUNTER_WIDTHS:
+        limit = 2 ** bits
+        margin = limit // 16
+        if limit - margin <= previous < limit and value < margin:
+            return value + limit - previous
+    return value
+
+class CounterRates(object):
+    """
+    Per-second rates of the counters over sliding windows, from reads done on the node every interval seconds.
+    Only the samples of the largest window are kept, a read only adds one sample per counter.
+    """
+    def __init__(self, collector, windows, interval):
+        self.collector = collector
+        self.windows = sorted(windows)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last = {}
+        # (interface, metric name) -> samples of (monotonic time, total increase since the first read)
+        self.samples = {}
+        self.maxlen = int(self.windows[-1] / interval) + 2
+
+    def add(self, timestamp, values):
+        with self.lock:
+            for key in list(self.samples.keys()):
+                if not key in values:
+                    del self.samples[key]
+                    del self.last[key]
+            for key, value in values.items():
+                if key[1] in GAUGES:
+                    continue
+                samples = self.samples.get(key)
+                if samples is None:
+                    samples = self.samples[key] = deque(maxlen=self.maxlen)
+                    samples.append((timestamp, 0))
+                else:
+                    samples.append((timestamp, samples[-1][1] + counter_delta(self.last[key], value)))
+                self.last[key] = value
+
+    def update(self):
+        with timed("rdma_rates"):
+            self.add(time.monotonic(), self.collector.read_counters())
+
+    def sample(self):
+        next_read = time.monotonic()
+        while True:
+            self.update()
+            next_read += self.interval
+            delay = next_read - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_read = time.monotonic()
+
+    def start(self):
+        thread = threading.Thread(target=self.sample, name='rdma-rate-sampler', daemon=True)
+        thread.start()
+        return thread
+
+    def collect(self):
+        families = {}
+        for name, path, description in METRICS:
+            if name in GAUGES:
+                continue
+            families[name] = GaugeMetricFamily(f"{name}_rate", f"Per second increase over the window: {description}", labels=['hostname', 'interface', 'window'])
+            families[name + "_max"] = GaugeMetricFamily(f"{name}_rate_max", f"Highest per second increase between two reads during the window: {description}", labels=['hostname', 'interface', 'window'])
+        with self.lock:
+            for (nic, name), samples in self.samples.items():
+                if len(samples) < 2:
+                    continue
+                end_time, end_total = samples[-1]
+                for window in self.windows:
+                    start_time, start_total = samples[-1]
+                    max_rate = 0
+                    for i in range(len(samples) - 1, 0, -1):
+                        if end_time - samples[i - 1][0] > window + self.interval / 2:
+                            break
+                        start_time, start_total = samples[i - 1]
+                        elapsed = samples[i][0] - samples[i - 1][0]
+                        if elapsed > 0:
+                            max_rate = max(max_rate, (samples[i][1] - samples[i - 1][1]) / elapsed)
+                    if end_time == start_time:
+                        continue
+                    labels = [self.collector.hostname, nic, f"{window}s"]
+                    families[name].add_metric(labels, (end_total - start_total) / (end_time - start_time))
+                    families[name + "_max"].add_metric(labels, max_rate)
+        return list(families.values())
+
+def start_udev_monitor(collector):
+    context = pyudev.Context()
+    monitor = pyudev.Monitor.from_netlink(context)
+    monitor.filter_by(subsystem='infiniband')
+    observer = pyudev.MonitorObserver(monitor, callback=lambda device: collector.refresh(), name='rdma-udev-monitor')
+    observer.daemon = True
+    observer.start()
+    return observer
 
 if __name__ == '__main__':
-    # Start up the server to expose the metrics.
+    parser = argparse.ArgumentParser(description='Export the counters of the RDMA NICs on port 9500')
+    parser.add_argument('--rate-windows', help='Comma separated windows in seconds, e.g. 10,60. If present, per second rates of the counters over these windows are computed on the node', default='')
+    parser.add_argument('--sample-interval', type=float, help='Seconds between two reads of the counters for the rates', default=1)
+    args = parser.parse_args()
+
+    hostname = socket.gethostname()
+    collector = RdmaCollector(hostname)
+    collector.discover()
+    if pyudev_available:
+        start_udev_monitor(collector)
+    else:
+        logger.info(f"pyudev is not installed, looking for new RDMA NICs every {DISCOVERY_INTERVAL}s")
+    REGISTRY.register(collector)
+    windows = [int(window) for window in args.rate_windows.split(',') if window.strip()]
+    if len(windows):
+        rates = CounterRates(collector, windows, args.sample_interval)
+        rates.start()
+        REGISTRY.register(rates)
+    # Start up the server to expose the metrics, counters are read when Prometheus scrapes
     start_http_server(9500)
-    # Generate RDMA metrics every 10 seconds
     while True:
-        get_rdma_metrics()
-        time.sleep(10)
+        time.sleep(3600)
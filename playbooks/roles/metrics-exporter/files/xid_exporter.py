@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+from prometheus_client import start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from shared_logging import logger
+from exporter_metrics import timed, count_error
+from xid_checker import XID_EC, XID_PATTERN, read_kmsg, get_boot_id
+
+LABELS = ['hostname', 'gpu', 'pci', 'xid', 'severity']
+XID_STATE_FILE = "/run/xid-exporter/xid_events.json"
+NVIDIA_GPUS_PATH = "/proc/driver/nvidia/gpus"
+RETRY_INTERVAL_SEC = 10
+
+def xid_events(messages):
+    """ (sequence number, microseconds since boot, PCI device, Xid) of the Xid messages among the kernel messages """
+    for seq, usec, message in messages:
+        match = XID_PATTERN.search(message)
+        if match:
+            yield seq, usec, match.group(1).rstrip(")").lower(), match.group(2)
+
+def get_gpu_indexes(path=NVIDIA_GPUS_PATH):
+    """ Index of the NVIDIA GPUs by PCI device, nvidia-smi numbers them in the order of the PCI bus """
+    try:
+        devices = sorted(device.lower() for device in os.listdir(path))
+    except FileNotFoundError:
+        return {}
+    # Xid messages name the device without its function, e.g. 0000:08:00
+    return {device.rsplit(".", 1)[0]: str(index) for index, device in enumerate(devices)}
+
+class XidCollector(object):
+    """
+    Follows the kernel messages and counts the Xids of each GPU as soon as they are logged.
+    The counts and last seen times of this boot are kept in state_file: the exporter goes on where it stopped
+    after a restart and the job prologs read the Xids of the node without scanning dmesg.
+    """
+    def __init__(self, hostname, state_file=XID_STATE_FILE):
+        self.hostname = hostname
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.boot_id = get_boot_id()
+        # Kernel messages are timed in microseconds since the boot
+        self.boot_time = time.time() - time.monotonic()
+        self.seq = -1
+        self.events = {}
+        self.gpus = get_gpu_indexes()
+        self.load_state()
+
+    def load_state(self):
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError) as e:
+            logger.info(f"No Xid state in {self.state_file}, reading the whole kernel ring buffer: {e}")
+            return
+        if state.get("boot_id") != self.boot_id:
+            return
+        self.seq = state["seq"]
+        for event in state["events"]:
+            self.events[(event["pci"], event["xid"])] = event
+        logger.info(f"Loaded {len(self.events)} Xid counters up to kernel message {self.seq}")
+
+    def save_state(self):
+        state = {"boot_id": self.boot_id, "seq": self.seq, "updated": time.time(), "events": list(self.events.values())}
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.state_file)
+
+    def gpu(self, pci):
+        if not pci in self.gpus:
+            # GPU probed after the exporter started
+            self.gpus = get_gpu_indexes()
+        return self.gpus.get(pci, "unknown")
+
+    def add(self, seq, usec, pci, xid):
+        with self.lock:
+            event = self.events.get((pci, xid))
+            if event is None:
+                xid_ec = XID_EC.get(xid, {"description": "Unknown", "severity": "Unknown"})
+                event = {"gpu": self.gpu(pci), "pci": pci, "xid": xid, "severity": xid_ec["severity"], "description": xid_ec["description"], "count": 0, "last_seen": None}
+                self.events[(pci, xid)] = event
+            event["count"] += 1
+            event["last_seen"] = round(self.boot_time + usec / 1000000, 3)
+            self.seq = seq
+            self.save_state()
+        logger.warning(f"Xid {xid} on GPU {event['gpu']} - PCI: {pci}, count: {event['count']}, {event['description']}")
+
+    def follow(self):
+        """ Count the Xids of the kernel messages not counted yet, then of each new message as it is logged """
+        while True:
+            try:
+                for seq, usec, pci, xid in xid_events(read_kmsg(self.seq, follow=True)):
+                    self.add(seq, usec, pci, xid)
+            except Exception as e:
+                logger.error(f"Cannot read the kernel messages: {e}")
+                count_error("xid", type(e).__name__)
+                time.sleep(RETRY_INTERVAL_SEC)
+
+    def start(self):
+        thread = threading.Thread(target=self.follow, name='xid-kmsg-reader', daemon=True)
+        thread.start()
+        return thread
+
+    def collect(self):
+        events = CounterMetricFamily('xid_events', 'GPU Xid errors logged by the NVIDIA driver since the boot', labels=LABELS)
+        last_seen = GaugeMetricFamily('xid_last_seen_timestamp_seconds', 'Time of the last GPU Xid error logged by the NVIDIA driver', labels=LABELS)
+        with self.lock, timed("xid"):
+            for event in self.events.values():
+                labels = [self.hostname, event["gpu"], event["pci"], event["xid"], event["severity"]]
+                events.add_metric(labels, event["count"])
+                last_seen.add_metric(labels, event["last_seen"])
+        return [events, last_seen]
+
+def query_state(state_file, since=None):
+    """
+    Xid events of this boot saved by the exporter, the ones seen in the last since seconds if set.
+    None when the exporter did not save a state for this boot.
+    """
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError) as e:
+        logger.warning(f"Cannot read the Xid state in {state_file}: {e}")
+        return None
+    if state.get("boot_id") != get_boot_id():
+        logger.warning(f"The Xid state in {state_file} is from a previous boot")
+        return None
+    events = state["events"]
+    if since is not None:
+        events = [event for event in events if event["last_seen"] >= time.time() - since]
+    return events
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the GPU Xid errors of the kernel messages as they are logged')
+    parser.add_argument('--port', type=int, help='Port of the metrics endpoint', default=9750)
+    parser.add_argument('--state-file', help=f'Xid counts of this boot and cursor in /dev/kmsg (default: {XID_STATE_FILE})', default=XID_STATE_FILE)
+    parser.add_argument('--query', action='store_true', help='Print the Xids saved in the state file by the running exporter and exit 1 on critical ones, 2 when there is no state for this boot')
+    parser.add_argument('--since', type=int, help='With --query, only the Xids seen in the last seconds')
+    args = parser.parse_args()
+
+    if args.query:
+        events = query_state(args.state_file, args.since)
+        if events is None:
+            sys.exit(2)
+        print(json.dumps(events, indent=2))
+        sys.exit(1 if any(event["severity"] == "Critical" for event in events) else 0)
+
+    collector = XidCollector(os.uname().nodename, args.state_file)
+    collector.start()
+    REGISTRY.register(collector)
+    # Start up the server to expose the metrics, the counters are updated by the kernel message reader
+    start_http_server(args.port)
+    while True:
+        time.sleep(3600)
@@ -9,6 +9,9 @@ import paramiko
 import subprocess
 import os
 import requests
+# Run through ansible.builtin.script on the controller, the inventory model comes from the resize scripts
+sys.path.insert(0,"/opt/oci-hpc/bin/resize")
+from inventory import Inventory
 
 def distribute_new_mt_assignments(new_nodes, mt_distribution, current_nodes, args_nfs_path):
   assignments = dict()
@@ -68,24 +71,6 @@ def get_metadata():
   request_url = metadata_url + "v" + metadata_ver + "/instance/"
   return requests.get(request_url, headers=headers).json()
 
-def parse_inventory(inventory):
-  try:
-      inv = open(inventory,"r")
-  except:
-      return None
-  inventory_dict = {}
-  current_section = None
-  for line in inv:
-      if line.strip().startswith("[") and line.strip().endswith("]"):
-          current_section=line.split('[')[1].split(']')[0]
-          if not current_section in inventory_dict.keys():
-              inventory_dict[current_section]=[]
-      else:
-          if not current_section is None:
-              inventory_dict[current_section].append(line)
-  inv.close()
-  return inventory_dict
-
 def getClusterNames():
   out = subprocess.Popen(["ls /opt/oci-hpc/autoscaling/clusters/"],stdout=subprocess.PIPE, stderr=subprocess.STDOUT,shell=True,universal_newlines=True)
   stdout,stderr = out.communicate()
@@ -104,20 +89,9 @@ def getNodesInClusters(metadata, cluster_name):
   permanent_cluster = metadata['displayName'].replace('-controller','')
   if cluster_name == permanent_cluster:
     inventory = "/etc/ansible/hosts"
-    inventory_dict = parse_inventory(inventory)
-    inv_list = inventory_dict["compute_configured"]
-    for i in inv_list:
-      split_str = i.split()
-      node_name = split_str[0]
-      nodes.append(node_name)
   else:
     inventory = "/opt/oci-hpc/autoscaling/clusters/"+cluster_name+"/inventory"
-    inventory_dict = parse_inventory(inventory)
-    inv_list = inventory_dict["compute_configured"]
-    for i in inv_list:
-      split_str = i.split()
-      node_name = split_str[0]
-      nodes.append(node_name)
+  nodes.extend(Inventory.load(inventory)["compute_configured"].names())
   return nodes
 
 def main():
@@ -1,166 +1,83 @@
 import oci
-from datetime import datetime, timedelta, timezone
-from prometheus_client import start_http_server, Gauge
-import logging
-import re
-import time
-import requests
+from oci_monitoring_exporter import Namespace, main, logger
+from exporter_metrics import count_error
 
-signer = oci.auth.signers.InstancePrincipalsSecurityTokenSigner()
-monitoring = oci.monitoring.MonitoringClient({}, signer=signer)
-file_storage_client = oci.file_storage.FileStorageClient({}, signer=signer)
-prometheus_metrics = {}
+class FileStorageNamespace(Namespace):
+    namespace = "oci_filestorage"
+    labelnames = ['mount_target', 'file_system', 'availability_domain', 'resource_type', 'size']
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+    def __init__(self, signer):
+        super().__init__(signer)
+        self.file_storage_client = oci.file_storage.FileStorageClient({}, signer=signer)
+        self.mount_targets = {}
+        self.filesystems = {}
 
-def get_compartment_id():
-    url = "http://169.254.169.254/opc/v1/instance/"
-    headers = {
-        "Authorization": "Bearer Oracle"
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()['compartmentId']
+    def get_resource(self, cache, get_function, resource_id):
+        """ Name and AD of a mount target or file system, looked up once """
+        if not resource_id in cache:
+            try:
+                resource = get_function(resource_id, retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY).data
+                cache[resource_id] = {
+                    "name": resource.display_name,
+                    "ad": "-".join(resource.availability_domain.split("-")[1:]).lower()
+                }
+            except Exception as e:
+                logger.error(f"Failed to process resource {resource_id}: {str(e)}")
+                count_error(self.namespace, "lookup")
+                return None
+        return cache[resource_id]
 
-def initialize_metrics(
-    monitoring: oci.monitoring.MonitoringClient,
-    file_storage_client: oci.file_storage.FileStorageClient,
-    compartment_id: str
-) -> dict:
-    oci_data = {
-        'metrics': [],
-        'mount_targets': {},
-        'filesystems': {}
-    }
-    
-    try:
-        # Fetch metrics
-        paginated_response = oci.pagination.list_call_get_all_results(
-            monitoring.list_metrics,
-            compartment_id,
-            oci.monitoring.models.ListMetricsDetails(namespace="oci_filestorage")  
+    def discover(self, exporter):
+        metrics = exporter.call(
+            self.namespace,
+            oci.pagination.list_call_get_all_results,
+            exporter.monitoring.list_metrics,
+            exporter.compartment_id,
+            oci.monitoring.models.ListMetricsDetails(namespace=self.namespace)
         ).data
-        
-        # Store metrics
-        oci_data['metrics'] = [metric.name for metric in paginated_response]
-        logger.info(f"Found {len(oci_data['metrics'])} filesystem metrics")
-        print(oci_data['metrics'])
 
         unique_mount_target_ids = set()
         unique_file_system_ids = set()
+        for metric in metrics:
+            if metric.dimensions.get("resourceType") == "filesystem":
+                unique_mount_target_ids.add(metric.dimensions["mountTargetId"])
+                unique_file_system_ids.add(metric.dimensions["resourceId"])
+            elif metric.dimensions.get("resourceType") == "mountTarget":
+                unique_mount_target_ids.add(metric.dimensions["resourceId"])
 
-        # Process mount targets     
-        for resp in paginated_response:
-            if resp.dimensions.get("resourceType") == "filesystem":
-                unique_mount_target_ids.add(resp.dimensions["mountTargetId"])
-                unique_file_system_ids.add(resp.dimensions["resourceId"])
-            elif resp.dimensions.get("resourceType") == "mountTarget":
-                unique_mount_target_ids.add(resp.dimensions["resourceId"])
-
+        # Names can change, look the resources up again
+        self.mount_targets = {}
+        self.filesystems = {}
         for mount_target_id in unique_mount_target_ids:
-            try:
-                if mount_target_id not in oci_data['mount_targets']:
-                    mount_target = file_storage_client.get_mount_target(
-                        mount_target_id=mount_target_id,
-                        retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY
-                    ).data
-                    oci_data['mount_targets'][mount_target_id] = {
-                        "name": mount_target.display_name,
-                        "ad": "-".join(mount_target.availability_domain.split("-")[1:]).lower()
-                    }
-            except Exception as e:
-                logger.error(f"Failed to process mount target {mount_target_id}: {str(e)}")
-                continue
-
+            self.get_resource(self.mount_targets, self.file_storage_client.get_mount_target, mount_target_id)
         for file_system_id in unique_file_system_ids:
-            try:
-                if file_system_id not in oci_data['filesystems']:
-                    file_system = file_storage_client.get_file_system(
-                        file_system_id=file_system_id,
-                        retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY
-                    ).data
-                    oci_data['filesystems'][file_system_id] = {
-                        "name": file_system.display_name,
-                        "ad": "-".join(file_system.availability_domain.split("-")[1:]).lower()
-                    }
-            except Exception as e:
-                logger.error(f"Failed to process file system {file_system_id}: {str(e)}")
-                continue
-
-        logger.info(f"Processed {len(oci_data['mount_targets'])} mount target metadata lookup")
-        logger.info(f"Processed {len(oci_data['filesystems'])} file system metadata lookup")
-        return oci_data
-        
-    except Exception as e:
-        logger.error(f"Failed to initialize OCI data: {str(e)}")
-        raise
-
-def fetch_and_push_metric_data(monitoring: oci.monitoring.MonitoringClient, 
-                     compartment_id: str,
-                     metrics: dict):    
-    end_time = datetime.now(timezone.utc)
-    start_time = end_time - timedelta(minutes=5)
+            self.get_resource(self.filesystems, self.file_storage_client.get_file_system, file_system_id)
+        logger.info(f"Processed {len(self.mount_targets)} mount target metadata lookup")
+        logger.info(f"Processed {len(self.filesystems)} file system metadata lookup")
+        return sorted(set(metric.name for metric in metrics))
 
-    for metric_name in metrics["metrics"]:
-        try:
-            metric_details = oci.monitoring.models.SummarizeMetricsDataDetails(
-                namespace="oci_filestorage",
-                query=f"{metric_name}[1m].avg()",
-                start_time=start_time,
-                end_time=end_time,
-                resolution="1m"
-            )
-
-            response = monitoring.summarize_metrics_data(
-                compartment_id=compartment_id,
-                summarize_metrics_data_details=metric_details,
-                retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY
-            )
-            for metric_data in response.data:      
-                if metric_name not in prometheus_metrics:
-                    description = metric_data.metadata['description'] + "(" + metric_data.metadata['unit'] + ")"
-                    gauge = Gauge(
-                        name=f"oci_{metric_name}",
-                        documentation=description,
-                        labelnames=['mount_target', 'file_system', 'availability_domain', 'resource_type', 'size'],
-                    )
-                    prometheus_metrics[metric_name] = gauge
-                mount_target_id = ""
-                if 'mountTargetId' in metric_data.dimensions:
-                    mount_target_id = metric_data.dimensions['mountTargetId']
-                else:
-                    mount_target_id = metric_data.dimensions['resourceId']   
-                if 'size' in metric_data.dimensions:
-                    size = metric_data.dimensions['size']
-                else:
-                    size = "none"
-                if metric_data.dimensions['resourceType'] == "filesystem":
-                    prometheus_metrics[metric_name].labels(
-                        mount_target=metrics["mount_targets"][mount_target_id]['name'],
-                        file_system=metrics["filesystems"][metric_data.dimensions['resourceId']]['name'],
-                        availability_domain=metrics["mount_targets"][mount_target_id]['ad'],
-                        resource_type=metric_data.dimensions['resourceType'],
-                        size=size
-                    ).set(metric_data.aggregated_datapoints[0].value)
-                else:
-                    prometheus_metrics[metric_name].labels(
-                        mount_target=metrics["mount_targets"][mount_target_id]['name'],
-                        availability_domain=metrics["mount_targets"][mount_target_id]['ad'],
-                        resource_type=metric_data.dimensions['resourceType'],
-                        file_system="none",
-                        size=size
-                    ).set(metric_data.aggregated_datapoints[0].value) 
-        except Exception as e:
-            logger.error(f"Failed to fetch metric {metric_name}: {str(e)}")
-            continue
+    def labels(self, metric_data):
+        dimensions = metric_data.dimensions
+        if 'mountTargetId' in dimensions:
+            mount_target_id = dimensions['mountTargetId']
+        else:
+            mount_target_id = dimensions['resourceId']
+        mount_target = self.get_resource(self.mount_targets, self.file_storage_client.get_mount_target, mount_target_id)
+        if mount_target is None:
+            return None
+        file_system_name = "none"
+        if dimensions['resourceType'] == "filesystem":
+            file_system = self.get_resource(self.filesystems, self.file_storage_client.get_file_system, dimensions['resourceId'])
+            if file_system is None:
+                return None
+            file_system_name = file_system['name']
+        return {
+            'mount_target': mount_target['name'],
+            'file_system': file_system_name,
+            'availability_domain': mount_target['ad'],
+            'resource_type': dimensions['resourceType'],
+            'size': dimensions.get('size', "none")
+        }
 
 if __name__ == "__main__":
-    compartment_id = get_compartment_id()
-    metrics = initialize_metrics(monitoring=monitoring, file_storage_client=file_storage_client, compartment_id=compartment_id)
-    start_http_server(9200)
-    while True:
-        fetch_and_push_metric_data(monitoring, compartment_id, metrics)
-        time.sleep(60)
-
-
+    main([FileStorageNamespace], 9200, 'Export the OCI File Storage metrics of the compartment on port 9200')
@@ -1,89 +1,74 @@
-import oci
-from datetime import datetime, timedelta, timezone
-from prometheus_client import start_http_server, Gauge
-import logging
+from datetime import timedelta
+from oci_monitoring_exporter import Namespace, main, logger
+import os
 import re
-import time
-import requests
 
-signer = oci.auth.signers.InstancePrincipalsSecurityTokenSigner()
-monitoring = oci.monitoring.MonitoringClient({}, signer=signer)
+def mixed_case_to_underline(text):
+  return re.sub(r"([a-z])([A-Z])", r"\1_\2", text).lower()
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+class HostsIndex(object):
+    """
+    Hostname of each name of /etc/hosts, the first name after the IP like the lookups done so far.
+    The file is parsed again only when its mtime changes.
+    """
+    def __init__(self, hosts_file='/etc/hosts'):
+        self.hosts_file = hosts_file
+        self.mtime = None
+        self.hostnames = {}
 
-prometheus_metrics = {}
-oci_metric_names = {}
+    def reload(self):
+        try:
+            mtime = os.stat(self.hosts_file).st_mtime_ns
+        except OSError as e:
+            logger.error(f"Cannot read {self.hosts_file}: {e}")
+            return
+        if mtime == self.mtime:
+            return
+        hostnames = {}
+        with open(self.hosts_file, 'r') as f:
+            for line in f:
+                parts = line.split('#', 1)[0].split()
+                if len(parts) < 2:
+                    continue
+                for name in parts[1:]:
+                    # The first line with the name wins
+                    hostnames.setdefault(name, parts[1])
+        self.hostnames = hostnames
+        self.mtime = mtime
+        logger.info(f"Loaded {len(hostnames)} names from {self.hosts_file}")
 
-def get_compartment_id():
-    url = "http://169.254.169.254/opc/v1/instance/"
-    headers = {
-        "Authorization": "Bearer Oracle"
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()['compartmentId']
+    def get(self, instance_name):
+        self.reload()
+        return self.hostnames.get(instance_name)
 
-def mixed_case_to_underline(text):
-  return re.sub(r"([a-z])([A-Z])", r"\1_\2", text).lower()
+hosts_index = HostsIndex()
+
+def get_gpu_name(instance_name):
+    return hosts_index.get(instance_name)
+
+class RdmaFaultsNamespace(Namespace):
+    namespace = "rdma_infrastructure_health"
+    statistic = "mean"
+    window = timedelta(minutes=1)
+    labelnames = ['device_name', 'oci_name', 'hostname']
+
+    def discover(self, exporter):
+        metrics = [name for name in super().discover(exporter) if 'Fault' in name]
+        logger.info(f"Found {len(metrics)} rdma fault metrics")
+        return metrics
 
-def get_gpu_name(instance_name, hosts_file='/etc/hosts'):
-    with open(hosts_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            if instance_name in line:
-                parts = line.split()                
-                if len(parts) >= 2:
-                    return parts[1]
-    return None
+    def gauge_name(self, metric_data):
+        return f"oci_{mixed_case_to_underline(metric_data.name)}"
 
-def initialize_metrics(monitoring: oci.monitoring.MonitoringClient, compartment_id: str) -> list:
-    metrics = oci.pagination.list_call_get_all_results(
-        monitoring.list_metrics,
-        compartment_id,
-        oci.monitoring.models.ListMetricsDetails(namespace="rdma_infrastructure_health")
-    ).data
-    return metrics
+    def description(self, metric_data):
+        return metric_data.metadata['displayName'] + "(" + metric_data.metadata['unit'] + ")"
 
-def fetch_and_push_metric_data(monitoring: oci.monitoring.MonitoringClient, compartment_id: str, metrics: dict):
-    for each_metric in metrics:
-        end_time = datetime.now(timezone.utc)
-        start_time = end_time - timedelta(minutes=1)        
-        metric_details = oci.monitoring.models.SummarizeMetricsDataDetails(
-            namespace="rdma_infrastructure_health",
-            query=f"{each_metric}[1m].mean()",
-            start_time=start_time,
-            end_time=end_time,
-            resolution="1m"
-        )
-        response = monitoring.summarize_metrics_data(
-            compartment_id=compartment_id,
-            summarize_metrics_data_details=metric_details,
-            retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY
-        )
-        for metric_data in response.data:
-            metric_name = mixed_case_to_underline(metric_data.name)
-            if metric_name not in prometheus_metrics:
-                description = metric_data.metadata['displayName'] + "(" + metric_data.metadata['unit'] + ")"
-                gauge = Gauge(
-                    name=f"oci_{metric_name}",
-                    documentation=description,
-                    labelnames=['device_name', 'oci_name', 'hostname'],
-                )
-                prometheus_metrics[metric_name] = gauge
-            prometheus_metrics[metric_name].labels(
-                device_name=metric_data.dimensions['deviceName'],
-                oci_name=metric_data.dimensions['resourceDisplayName'],
-                hostname=get_gpu_name(metric_data.dimensions['resourceDisplayName'])).set(metric_data.aggregated_datapoints[0].value)                 
+    def labels(self, metric_data):
+        return {
+            'device_name': metric_data.dimensions['deviceName'],
+            'oci_name': metric_data.dimensions['resourceDisplayName'],
+            'hostname': get_gpu_name(metric_data.dimensions['resourceDisplayName'])
+        }
 
 if __name__ == "__main__":
-    compartment_id = get_compartment_id()
-    metrics = initialize_metrics(monitoring=monitoring, compartment_id=compartment_id)
-    unique_fault_metrics = {metric.name: metric for metric in metrics if 'Fault' in metric.name}
-    logger.info(f"Found {len(unique_fault_metrics)} rdma fault metrics")
-    start_http_server(9300)
-    while True:
-        fetch_and_push_metric_data(monitoring, compartment_id, unique_fault_metrics)
-        time.sleep(60)
+    main([RdmaFaultsNamespace], 9300, 'Export the RDMA faults reported by the OCA agents of the compartment on port 9300')
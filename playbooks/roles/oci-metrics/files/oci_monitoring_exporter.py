@@ -0,0 +1,229 @@
+import oci
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from prometheus_client import start_http_server, Gauge
+import argparse
+import logging
+import random
+import threading
+import time
+import requests
+from exporter_metrics import collector_duration_seconds, collector_last_success_timestamp_seconds, count_error
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Status codes of the OCI API worth another try after a pause
+RETRY_STATUS = [409, 429, 500, 502, 503, 504]
+
+def get_compartment_id():
+    url = "http://169.254.169.254/opc/v1/instance/"
+    headers = {
+        "Authorization": "Bearer Oracle"
+    }
+    response = requests.get(url, headers=headers)
+    response.raise_for_status()
+    return response.json()['compartmentId']
+
+class TokenBucket(object):
+    """
+    Limits the rate of the OCI calls of all the workers of an exporter.
+    When OCI throttles a call, every worker waits before the next one.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+class Namespace(object):
+    """
+    Metrics of one OCI Monitoring namespace. Subclasses give the namespace, the query and how
+    the dimensions of a series become Prometheus labels.
+    """
+    namespace = None
+    interval = "1m"
+    statistic = "avg"
+    window = timedelta(minutes=5)
+    labelnames = []
+
+    def __init__(self, signer):
+        self.signer = signer
+
+    def discover(self, exporter):
+        """ Names of the metrics to query, called again every discovery interval """
+        metrics = exporter.call(
+            self.namespace,
+            oci.pagination.list_call_get_all_results,
+            exporter.monitoring.list_metrics,
+            exporter.compartment_id,
+            oci.monitoring.models.ListMetricsDetails(namespace=self.namespace)
+        ).data
+        return sorted(set(metric.name for metric in metrics))
+
+    def query(self, metric_name):
+        return f"{metric_name}[{self.interval}].{self.statistic}()"
+
+    def gauge_name(self, metric_data):
+        return f"oci_{metric_data.name}"
+
+    def description(self, metric_data):
+        return metric_data.metadata['description'] + "(" + metric_data.metadata['unit'] + ")"
+
+    def labels(self, metric_data):
+        """ Labels of a series, None to skip it """
+        raise NotImplementedError
+
+class OciMonitoringExporter(object):
+    """
+    Queries the metrics of one or more namespaces with a pool of workers and exposes them as gauges.
+    The list of metrics and the resource lookups of the namespaces are refreshed every discovery_interval.
+    """
+    def __init__(self, namespaces, signer, compartment_id, workers=8, rate=5, burst=10, discovery_interval=3600, max_attempts=5):
+        self.namespaces = namespaces
+        self.compartment_id = compartment_id
+        self.monitoring = oci.monitoring.MonitoringClient({}, signer=signer)
+        self.workers = workers
+        self.bucket = TokenBucket(rate, burst)
+        self.discovery_interval = discovery_interval
+        self.max_attempts = max_attempts
+        self.discovered = 0
+        self.metrics = {}
+        self.gauges = {}
+
+    def call(self, collector, function, *args, **kwargs):
+        """ Call the OCI API within the rate limit, waiting longer after each throttled or failed attempt, retries are counted as errors of the collector """
+        for attempt in range(self.max_attempts):
+            self.bucket.acquire()
+            try:
+                return function(*args, retry_strategy=oci.retry.NoneRetryStrategy(), **kwargs)
+            except oci.exceptions.ServiceError as e:
+                if not e.status in RETRY_STATUS or attempt == self.max_attempts - 1:
+                    raise
+                count_error(collector, "throttled" if e.status == 429 else f"http_{e.status}")
+                delay = min(2 ** attempt, 30) + random.random()
+                logger.warning(f"OCI returned {e.status}, retrying in {delay:.1f}s")
+                if e.status == 429:
+                    self.bucket.pause(delay)
+                else:
+                    time.sleep(delay)
+
+    def discover(self):
+        for namespace in self.namespaces:
+            try:
+                self.metrics[namespace] = namespace.discover(self)
+                logger.info(f"Found {len(self.metrics[namespace])} metrics in {namespace.namespace}")
+            except Exception as e:
+                # Keep the metrics found last time
+                logger.error(f"Failed to discover the metrics of {namespace.namespace}: {str(e)}")
+                count_error(namespace.namespace, "discovery")
+                if not namespace in self.metrics:
+                    self.metrics[namespace] = []
+        self.discovered = time.monotonic()
+
+    def fetch(self, namespace, metric_name):
+        end_time = datetime.now(timezone.utc)
+        start_time = end_time - namespace.window
+        metric_details = oci.monitoring.models.SummarizeMetricsDataDetails(
+            namespace=namespace.namespace,
+            query=namespace.query(metric_name),
+            start_time=start_time,
+            end_time=end_time,
+            resolution=namespace.interval
+        )
+        return self.call(
+            namespace.namespace,
+            self.monitoring.summarize_metrics_data,
+            compartment_id=self.compartment_id,
+            summarize_metrics_data_details=metric_details
+        ).data
+
+    def push(self, namespace, metric_data):
+        if not metric_data.aggregated_datapoints:
+            return
+        labels = namespace.labels(metric_data)
+        if labels is None:
+            return
+        name = namespace.gauge_name(metric_data)
+        if not name in self.gauges:
+            self.gauges[name] = Gauge(
+                name=name,
+                documentation=namespace.description(metric_data),
+                labelnames=namespace.labelnames,
+            )
+        # Latest datapoint of the window
+        self.gauges[name].labels(**labels).set(metric_data.aggregated_datapoints[-1].value)
+
+    def update(self):
+        if time.monotonic() - self.discovered > self.discovery_interval:
+            self.discover()
+        queries = [(namespace, metric_name) for namespace in self.namespaces for metric_name in self.metrics[namespace]]
+        if not len(queries):
+            return
+        start = time.monotonic()
+        # Queries left and failed of each namespace, its duration is the time until its last query completes
+        pending = {namespace: len(self.metrics[namespace]) for namespace in self.namespaces}
+        failed = {namespace: 0 for namespace in self.namespaces}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(queries))) as executor:
+            futures = {executor.submit(self.fetch, namespace, metric_name): (namespace, metric_name) for namespace, metric_name in queries}
+            for future in as_completed(futures):
+                namespace, metric_name = futures[future]
+                try:
+                    for metric_data in future.result():
+                        self.push(namespace, metric_data)
+                except oci.exceptions.ServiceError as e:
+                    logger.error(f"Failed to fetch metric {metric_name}: {str(e)}")
+                    count_error(namespace.namespace, "throttled" if e.status == 429 else f"http_{e.status}")
+                    failed[namespace] += 1
+                except Exception as e:
+                    logger.error(f"Failed to fetch metric {metric_name}: {str(e)}")
+                    count_error(namespace.namespace, type(e).__name__)
+                    failed[namespace] += 1
+                pending[namespace] -= 1
+                if pending[namespace] == 0:
+                    collector_duration_seconds.labels(namespace.namespace).observe(time.monotonic() - start)
+                    if failed[namespace] < len(self.metrics[namespace]):
+                        collector_last_success_timestamp_seconds.labels(namespace.namespace).set_to_current_time()
+
+    def run(self, port, interval=60):
+        start_http_server(port)
+        while True:
+            start = time.monotonic()
+            self.update()
+            elapsed = time.monotonic() - start
+            if elapsed > interval:
+                logger.warning(f"Fetching the metrics took {elapsed:.1f}s, more than the {interval}s interval")
+            time.sleep(max(interval - elapsed, 0))
+
+def main(namespace_classes, port, description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--workers', type=int, help='Number of metrics queried at the same time', default=8)
+    parser.add_argument('--rate', type=float, help='Maximum number of OCI calls per second', default=5)
+    parser.add_argument('--burst', type=int, help='Number of OCI calls allowed at once above the rate', default=10)
+    parser.add_argument('--interval', type=int, help='Seconds between two updates of the metrics', default=60)
+    parser.add_argument('--discovery-interval', type=int, help='Seconds between two discoveries of the metrics and resources', default=3600)
+    args = parser.parse_args()
+
+    signer = oci.auth.signers.InstancePrincipalsSecurityTokenSigner()
+    namespaces = [namespace_class(signer) for namespace_class in namespace_classes]
+    exporter = OciMonitoringExporter(namespaces, signer, get_compartment_id(), workers=args.workers, rate=args.rate, burst=args.burst, discovery_interval=args.discovery_interval)
+    exporter.run(port, args.interval)
@@ -6,6 +6,13 @@ from datetime import datetime
 import argparse
 import os
 import shlex
+import sys
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','bin','resize'))
+from inventory_cache import get_cached_instances, set_cached_instances, default_ttl
+from inventory import Inventory
+
+cache_ttl = default_ttl
 
 
 
@@ -101,34 +108,21 @@ def get_summary(comp_ocid,cluster_name):
 
 
 def get_instances(comp_ocid,cn_ocid):
+    cached_instances = get_cached_instances(cn_ocid,cache_ttl)
+    if cached_instances is not None:
+        return [instance['display_name'] for instance in cached_instances]
     signer = oci.auth.signers.InstancePrincipalsSecurityTokenSigner()
     computeManagementClient = oci.core.ComputeManagementClient(config={}, signer=signer)
     instance_summaries = oci.pagination.list_call_get_all_results(computeManagementClient.list_cluster_network_instances,comp_ocid,cn_ocid).data
     node_list = []
     for instance_summary in instance_summaries:
         node_list.append(instance_summary.display_name)
+    # The IPs are not listed, resize.py resolves them again before using the entry
+    if cache_ttl > 0:
+        set_cached_instances(cn_ocid,[{'display_name':instance_summary.display_name,'ip':None,'ocid':instance_summary.id,'lifecycle_state':instance_summary.state} for instance_summary in instance_summaries])
     return node_list
 
 
-def parse_inventory(inventory):
-    try:
-        inv = open(inventory,"r")
-    except:
-        return None
-    inventory_dict = {}
-    current_section = None
-    for line in inv:
-        if line.strip().startswith("[") and line.strip().endswith("]"):
-            current_section=line.split('[')[1].split(']')[0]
-            if not current_section in inventory_dict.keys():
-                inventory_dict[current_section]=[]
-        else:
-            if not current_section is None:
-                inventory_dict[current_section].append(line)
-    inv.close()
-    return inventory_dict
-
-
 # this is the source of truth for cluster names and total number of nodes
 def getResizeClusterNames(filepath):
     if filepath is None:
@@ -156,11 +150,15 @@ def getResizeClusterNames(filepath):
 
 # this is the source of truth for total number of nodes in a cluster
 def getResizeNodes(args, metadata, cluster_names, mode):
+    if args.no_cache:
+        resize_cache_option = " --no_cache"
+    else:
+        resize_cache_option = ""
     if mode == 1 or mode == 2:
         resize_cluster_node_dict = {}
         str = "ocid1.instance."
         for cluster in cluster_names:
-            out = subprocess.Popen(["/opt/oci-hpc/bin/resize.sh --cluster_name "+cluster],stdout=subprocess.PIPE, stderr=subprocess.STDOUT,shell=True,universal_newlines=True)
+            out = subprocess.Popen(["/opt/oci-hpc/bin/resize.sh --cluster_name "+cluster+resize_cache_option],stdout=subprocess.PIPE, stderr=subprocess.STDOUT,shell=True,universal_newlines=True)
             stdout,stderr = out.communicate()
             x = stdout.split("\n")
             del x[-1]
@@ -172,7 +170,7 @@ def getResizeNodes(args, metadata, cluster_names, mode):
                 if len(cluster_node_set) > 0:
                     resize_cluster_node_dict.update({cluster: cluster_node_set})
     if mode == 2 or (mode == 1 and args.cluster_names is None):
-        out = subprocess.Popen(["/opt/oci-hpc/bin/resize.sh list"],stdout=subprocess.PIPE, stderr=subprocess.STDOUT,shell=True,universal_newlines=True)
+        out = subprocess.Popen(["/opt/oci-hpc/bin/resize.sh list"+resize_cache_option],stdout=subprocess.PIPE, stderr=subprocess.STDOUT,shell=True,universal_newlines=True)
         stdout,stderr = out.communicate()
         x = stdout.split("\n")
         del x[-1]
@@ -394,20 +392,10 @@ def inventoryNodes(metadata, cluster_names):
     for cluster in cluster_names:
         if cluster == permanent_cluster:
             inventory = "/etc/ansible/hosts"
-            inventory_dict = parse_inventory(inventory)
-            inv_list = inventory_dict["compute_configured"]
-            for i in inv_list:
-                split_str = i.split()
-                node_name = split_str[0]
-                inventory_node_cluster_dict.update({node_name: cluster})
         else:
             inventory = "/opt/oci-hpc/autoscaling/clusters/"+cluster+"/inventory"
-            inventory_dict = parse_inventory(inventory)
-            inv_list = inventory_dict["compute_configured"]
-            for i in inv_list:
-                split_str = i.split()
-                node_name = split_str[0]
-                inventory_node_cluster_dict.update({node_name: cluster})
+        for node_name in Inventory.load(inventory)["compute_configured"].names():
+            inventory_node_cluster_dict.update({node_name: cluster})
     return inventory_node_cluster_dict
 
 
@@ -533,14 +521,18 @@ parser.add_argument('-cn', '--cluster_names', help = "Provide a file that lists
 parser.add_argument('-p', '--pcie', help = "Runs PCIe bandwidth check")
 parser.add_argument('-g', '--gpu_throttle', help = "Performs GPU throttle check")
 parser.add_argument('-e', '--etc_hosts', help = "Performs md5 sum check on all hosts and checks if it matches with the controller")
+parser.add_argument('--no_cache', help = "Always query OCI for the list of nodes instead of using the local inventory cache", action='store_true', default=False)
 
 args = parser.parse_args()
 
 args_vars = vars(args)
-if not any(args_vars.values()):
+if not any(value for key, value in args_vars.items() if key != 'no_cache'):
     parser.error('No arguments provided')
     exit()
 
+if args.no_cache:
+    cache_ttl = 0
+
 metadata=get_metadata()
 
 path = None